@@ -1,30 +1,300 @@
+import json
 import random
-from locust import HttpUser, task, between
+import time
+from datetime import datetime, timezone
 
-class SchoolAppUser(HttpUser):
-    # Waktu tunggu antar request (simulasi user sungguhan)
-    # Gunakan 0.1 - 0.5 jika ingin mensimulasikan trafik padat (intensif)
+from locust import HttpUser, task, between, events
+
+try:
+    import websocket  # websocket-client, opsional untuk skenario WebSocket
+except ImportError:
+    websocket = None
+
+BULAN = ["Januari", "Februari", "Maret", "April", "Mei", "Juni",
+         "Juli", "Agustus", "September", "Oktober", "November", "Desember"]
+
+# PNG 1x1 untuk simulasi upload bukti transfer
+TINY_PNG = bytes.fromhex(
+    "89504e470d0a1a0a0000000d4948445200000001000000010806000000"
+    "1f15c4890000000d49444154789c6360000002000100e221bc330000000049454e44ae426082"
+)
+
+
+@events.init_command_line_parser.add_listener
+def _(parser):
+    parser.add_argument("--slo-p95", type=float, default=800, help="Batas p95 (ms) seluruh request")
+    parser.add_argument("--slo-p99", type=float, default=2000, help="Batas p99 (ms) seluruh request")
+    parser.add_argument("--slo-error-rate", type=float, default=0.01, help="Batas rasio error (0.01 = 1%)")
+    parser.add_argument("--results-json", type=str, default="", help="Tulis hasil (per endpoint + SLO) ke file JSON")
+    parser.add_argument("--siswa-nis", type=str, default="100001-100300",
+                        help="Rentang NIS akun siswa hasil seed_data.py, mis. 100001-100300")
+    parser.add_argument("--siswa-password", type=str, default="siswa123")
+
+
+@events.quitting.add_listener
+def check_slo(environment, **kwargs):
+    """Mode headless: cek SLO, tulis hasil JSON dan set exit code != 0 jika SLO dilanggar."""
+    opts = environment.parsed_options
+    if opts is None:
+        return
+    total = environment.stats.total
+    p95 = total.get_response_time_percentile(0.95) or 0
+    p99 = total.get_response_time_percentile(0.99) or 0
+    error_rate = total.fail_ratio
+
+    violations = []
+    if p95 > opts.slo_p95:
+        violations.append(f"p95 {p95:.0f}ms > {opts.slo_p95:.0f}ms")
+    if p99 > opts.slo_p99:
+        violations.append(f"p99 {p99:.0f}ms > {opts.slo_p99:.0f}ms")
+    if error_rate > opts.slo_error_rate:
+        violations.append(f"error rate {error_rate:.2%} > {opts.slo_error_rate:.2%}")
+
+    if opts.results_json:
+        endpoints = []
+        for entry in environment.stats.entries.values():
+            endpoints.append({
+                "method": entry.method,
+                "name": entry.name,
+                "requests": entry.num_requests,
+                "failures": entry.num_failures,
+                "median_ms": entry.median_response_time,
+                "p95_ms": entry.get_response_time_percentile(0.95),
+                "p99_ms": entry.get_response_time_percentile(0.99),
+                "max_ms": entry.max_response_time,
+                "rps": entry.total_rps,
+            })
+        result = {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "host": environment.host,
+            "users": opts.num_users,
+            "total": {
+                "requests": total.num_requests,
+                "failures": total.num_failures,
+                "error_rate": error_rate,
+                "p95_ms": p95,
+                "p99_ms": p99,
+                "rps": total.total_rps,
+            },
+            "slo": {
+                "p95_ms": opts.slo_p95,
+                "p99_ms": opts.slo_p99,
+                "error_rate": opts.slo_error_rate,
+                "passed": not violations,
+                "violations": violations,
+            },
+            "endpoints": sorted(endpoints, key=lambda e: (e["name"], e["method"] or "")),
+        }
+        with open(opts.results_json, "w") as f:
+            json.dump(result, f, indent=2)
+
+    if violations:
+        print(f"[SLO] GAGAL: {'; '.join(violations)}")
+        environment.process_exit_code = 1
+    else:
+        print(f"[SLO] OK: p95={p95:.0f}ms p99={p99:.0f}ms error={error_rate:.2%}")
+
+
+class AuthenticatedUser(HttpUser):
+    """Login sekali di on_start lalu pakai ulang token untuk semua request."""
+    abstract = True
     wait_time = between(1, 3)
+    username = None
+    password = None
+
+    def credentials(self):
+        return self.username, self.password
+
+    def on_start(self):
+        self.user = None
+        username, password = self.credentials()
+        with self.client.post("/api/auth/login", json={"username": username, "password": password},
+                              name="/api/auth/login", catch_response=True) as resp:
+            if resp.status_code != 200:
+                resp.failure(f"Login {username} gagal: {resp.status_code}")
+                self.token = None
+                return
+            data = resp.json()
+            self.token = data["token"]
+            self.user = data["user"]
+        self.client.headers["Authorization"] = f"Bearer {self.token}"
+        self.open_websocket()
+
+    def on_stop(self):
+        ws = getattr(self, "ws", None)
+        if ws is not None:
+            ws.close()
+
+    def open_websocket(self):
+        """Koneksi /api/ws/{user_id} seperti frontend (status online)."""
+        self.ws = None
+        if websocket is None or not self.user:
+            return
+        url = self.host.replace("http", "ws", 1) + f"/api/ws/{self.user['id']}"
+        started = time.perf_counter()
+        exc = None
+        try:
+            self.ws = websocket.create_connection(url, timeout=10)
+        except Exception as e:  # noqa: BLE001 - dilaporkan ke statistik locust
+            exc = e
+        self.environment.events.request.fire(
+            request_type="WS", name="/api/ws/[user_id]", response_time=(time.perf_counter() - started) * 1000,
+            response_length=0, exception=exc, context={},
+        )
+
+    def current_period(self):
+        now = datetime.now()
+        return BULAN[now.month - 1], now.year
+
+
+class AdminUser(AuthenticatedUser):
+    weight = 3
+    username = "admin"
+    password = "admin123"
+
+    def on_start(self):
+        super().on_start()
+        self.pending_bills = []
+
+    @task(5)
+    def dashboard(self):
+        self.client.get("/api/dashboard/stats")
+        self.client.get("/api/dashboard/arrears-detail")
+
+    @task(4)
+    def list_bills(self):
+        self.client.get("/api/bills", params={"status": "menunggu_konfirmasi"}, name="/api/bills?status=[status]")
+
+    @task(3)
+    def confirm_bill(self):
+        if not self.pending_bills:
+            resp = self.client.get("/api/bills", params={"status": "menunggu_konfirmasi"},
+                                   name="/api/bills?status=[status]")
+            if resp.status_code == 200:
+                self.pending_bills = [b["id"] for b in resp.json()]
+                random.shuffle(self.pending_bills)
+        if self.pending_bills:
+            bill_id = self.pending_bills.pop()
+            self.client.put(f"/api/bills/{bill_id}/confirm", json={"status": "lunas"}, name="/api/bills/[id]/confirm")
+
+    @task(2)
+    def list_payments(self):
+        self.client.get("/api/payments")
 
     @task(1)
-    def visit_root(self):
-        self.client.get("/")
+    def export_monthly(self):
+        bulan, tahun = self.current_period()
+        fmt = random.choice(["pdf", "xlsx"])
+        self.client.get(f"/api/reports/export-{fmt}", params={"bulan": bulan, "tahun": tahun},
+                        name=f"/api/reports/export-{fmt}")
+
+
+class KepsekUser(AuthenticatedUser):
+    weight = 1
+    username = "kepsek"
+    password = "kepsek123"
+
+    @task(4)
+    def dashboard(self):
+        self.client.get("/api/dashboard/stats")
 
     @task(3)
-    def attempt_login_fail(self):
-        """
-        Simulasi percobaan login gagal secara berulang
-        Ini akan memicu fitur 'is_suspicious' dan 'Auto-Ban'
-        """
-        self.client.post("/api/auth/login", json={
-            "username": f"user_test_{random.randint(1, 100)}",
-            "password": "wrongpassword123"
-        })
+    def monthly_report(self):
+        bulan, tahun = self.current_period()
+        self.client.get("/api/reports/monthly", params={"bulan": bulan, "tahun": tahun}, name="/api/reports/monthly")
+
+    @task(2)
+    def class_recap(self):
+        self.client.get("/api/reports/class-recap")
 
     @task(2)
-    def get_public_profile(self):
-        self.client.get("/api/school-profile")
+    def arrears(self):
+        self.client.get("/api/reports/arrears")
+
+    @task(1)
+    def annual(self):
+        self.client.get("/api/reports/annual")
+
+    @task(1)
+    def exports(self):
+        fmt = random.choice(["pdf", "xlsx"])
+        target = random.choice(["arrears", "class-recap"])
+        self.client.get(f"/api/reports/{target}/export-{fmt}", name=f"/api/reports/{target}/export-{fmt}")
+
+
+class MasterUser(AuthenticatedUser):
+    weight = 1
+    username = "master"
+    password = "master123"
+
+    @task(3)
+    def security_logs(self):
+        self.client.get("/api/master/login-logs")
+        self.client.get("/api/master/activity-logs")
+
+    @task(2)
+    def staff(self):
+        self.client.get("/api/master/staff")
+
+    @task(2)
+    def dashboard(self):
+        self.client.get("/api/dashboard/stats")
+
+    @task(1)
+    def online_users(self):
+        self.client.get("/api/auth/online-users")
+
+
+class SiswaUser(AuthenticatedUser):
+    weight = 10
+    wait_time = between(2, 5)
+
+    def credentials(self):
+        start, _, end = self.environment.parsed_options.siswa_nis.partition("-")
+        nis = random.randint(int(start), int(end or start))
+        return f"siswa{nis}", self.environment.parsed_options.siswa_password
 
     def on_start(self):
-        """Dipanggil saat user mulai aktif"""
-        pass
+        super().on_start()
+        self.open_bills = []
+
+    @task(6)
+    def portal(self):
+        if not self.user:
+            return
+        # Dashboard siswa: satu request overview (profil, tagihan, pembayaran, rekening)
+        resp = self.client.get(f"/api/student/{self.user['id']}/overview", name="/api/student/[id]/overview")
+        if resp.status_code == 200:
+            self.open_bills = [b for b in resp.json()["bills"] if b["status"] == "belum"]
+
+    @task(2)
+    def portal_pages(self):
+        if not self.user:
+            return
+        sid = self.user["id"]
+        self.client.get(f"/api/student/bills/{sid}", name="/api/student/bills/[id]")
+        self.client.get(f"/api/student/payments/{sid}", name="/api/student/payments/[id]")
+
+    @task(2)
+    def pay_and_upload(self):
+        if not self.user or not self.open_bills:
+            return
+        bill = self.open_bills.pop()
+        resp = self.client.post("/api/payments", json={
+            "id_tagihan": bill["id"],
+            "id_siswa": self.user["id"],
+            "jumlah": bill["jumlah"],
+            "nama_pengirim": self.user["nama"],
+            "bank_asal": random.choice(["BRI", "BNI", "BCA", "Mandiri"]),
+        })
+        if resp.status_code == 200:
+            payment_id = resp.json()["id"]
+            self.client.post(f"/api/payments/{payment_id}/upload_receipt",
+                             files={"file": ("bukti.png", TINY_PNG, "image/png")},
+                             name="/api/payments/[id]/upload_receipt")
+
+    @task(1)
+    def student_report(self):
+        if not self.user:
+            return
+        self.client.get(f"/api/reports/student/{self.user['id']}", name="/api/reports/student/[id]")
@@ -0,0 +1,106 @@
+"""Migrasi online: ubah field tanggal berformat string ISO menjadi BSON date.
+
+Contoh:
+    python migrate_dates.py                 # migrasi semua koleksi
+    python migrate_dates.py --dry-run       # hanya hitung dokumen yang perlu diubah
+    python migrate_dates.py --batch-size 2000 --pause 0.2 --only payments
+
+Aman dijalankan saat server hidup: dokumen diproses per batch, dan setiap update
+bersyarat pada nilai string lamanya, sehingga dokumen yang sudah diubah oleh
+request lain di tengah jalan tidak tertimpa. Bisa dihentikan dan diulang kapan saja.
+Versi data (data_versions) koleksi yang diubah dinaikkan sehingga cache laporan di
+server yang sedang berjalan ikut basi.
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+from dotenv import load_dotenv
+from pymongo import MongoClient, UpdateOne
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+# (koleksi, field) yang dulu disimpan dengan .isoformat()
+DATE_FIELDS = [
+    ("payments", "tanggal_bayar"),
+    ("bills", "created_at"),
+    ("students", "created_at"),
+    ("users", "created_at"),
+    ("classes", "created_at"),
+    ("school_profile", "updated_at"),
+    ("login_logs", "timestamp"),
+    ("activity_logs", "timestamp"),
+]
+
+
+def parse_iso(value: str):
+    dt = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if dt.tzinfo is None:
+        # Data lama selalu dibuat dengan datetime.now(timezone.utc)
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt
+
+
+def migrate_field(db, collection: str, field: str, batch_size: int, pause: float, dry_run: bool) -> dict:
+    coll = db[collection]
+    query = {field: {"$type": "string"}}
+    stats = {"converted": 0, "invalid": 0}
+    if dry_run:
+        stats["pending"] = coll.count_documents(query)
+        return stats
+
+    skip_ids = []  # dokumen dengan string yang tidak bisa di-parse, dilewati
+    while True:
+        batch = list(coll.find({**query, "_id": {"$nin": skip_ids}}, {field: 1}).limit(batch_size))
+        if not batch:
+            break
+        ops = []
+        for doc in batch:
+            try:
+                ops.append(UpdateOne({"_id": doc["_id"], field: doc[field]}, {"$set": {field: parse_iso(doc[field])}}))
+            except ValueError:
+                skip_ids.append(doc["_id"])
+                stats["invalid"] += 1
+        if ops:
+            result = coll.bulk_write(ops, ordered=False)
+            stats["converted"] += result.modified_count
+            if result.modified_count:
+                # Sama dengan bump_data_version di server.py, per batch supaya cache tidak basi selama migrasi
+                db.data_versions.update_one({"_id": collection}, {"$inc": {"version": 1}}, upsert=True)
+        if pause:
+            time.sleep(pause)
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Konversi tanggal string ISO -> BSON date secara bertahap.")
+    parser.add_argument("--mongo-url", default=os.environ.get("MONGO_URL", "mongodb://localhost:27017"))
+    parser.add_argument("--db", default=os.environ.get("DB_NAME", "test_database"))
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--pause", type=float, default=0.05, help="Jeda antar batch (detik) agar beban server tetap rendah")
+    parser.add_argument("--only", action="append", default=None, help="Batasi ke koleksi tertentu (bisa berulang)")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args(argv)
+
+    client = MongoClient(args.mongo_url)
+    db = client[args.db]
+    for collection, field in DATE_FIELDS:
+        if args.only and collection not in args.only:
+            continue
+        started = time.perf_counter()
+        stats = migrate_field(db, collection, field, args.batch_size, args.pause, args.dry_run)
+        if args.dry_run:
+            print(f"[MIGRASI] {collection}.{field}: {stats['pending']} dokumen masih string")
+        else:
+            print(f"[MIGRASI] {collection}.{field}: {stats['converted']} dikonversi, "
+                  f"{stats['invalid']} tidak valid ({time.perf_counter() - started:.1f} detik)")
+    client.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,99 @@
+"""Analitik pembayaran kelas x bulan dengan pandas/numpy (GET /api/reports/analytics).
+
+Seperti report_render, modul ini baru di-import saat analitik pertama dihitung
+sehingga worker tidak membayar biaya import pandas/numpy saat start.
+"""
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+
+ANALYTICS_METRICS = ["tagihan", "lunas", "menunggu", "belum", "nominal", "nominal_lunas", "nominal_belum", "tingkat_koleksi"]
+
+
+def collection_rate(paid, total):
+    """nominal_lunas / nominal (0 jika tidak ada tagihan), vektor maupun skalar."""
+    return np.round(np.divide(paid, total, out=np.zeros_like(paid, dtype=float), where=np.asarray(total) != 0), 4)
+
+
+def summarize_bills(df: pd.DataFrame, keys: list) -> pd.DataFrame:
+    g = df.groupby(keys, sort=True).agg(
+        tagihan=("jumlah", "size"),
+        lunas=("is_lunas", "sum"),
+        menunggu=("is_menunggu", "sum"),
+        nominal=("jumlah", "sum"),
+        nominal_lunas=("nominal_lunas", "sum"),
+    )
+    g["belum"] = g["tagihan"] - g["lunas"] - g["menunggu"]
+    g["nominal_belum"] = g["nominal"] - g["nominal_lunas"]
+    g["tingkat_koleksi"] = collection_rate(g["nominal_lunas"].to_numpy(dtype=float), g["nominal"].to_numpy(dtype=float))
+    return g
+
+
+def build_payment_matrix(bills: list, students: list, tahun: int, bulan_names: list) -> dict:
+    """Matriks kelas x bulan + rekap per kelas dan per angkatan dari proyeksi tagihan."""
+    df = pd.DataFrame.from_records(bills, columns=["id_siswa", "kelas", "bulan", "jumlah", "status"])
+    info = pd.DataFrame.from_records(students, columns=["id", "kelas", "angkatan"]).set_index("id")
+    df["kelas"] = df["kelas"].fillna(df["id_siswa"].map(info["kelas"])).fillna("-")
+    df["angkatan"] = df["id_siswa"].map(info["angkatan"]).fillna("-")
+    df["bulan_idx"] = df["bulan"].map({nama: i for i, nama in enumerate(bulan_names)})
+    df = df.dropna(subset=["bulan_idx"]).astype({"bulan_idx": int, "jumlah": float})
+    df["is_lunas"] = df["status"].eq("lunas")
+    df["is_menunggu"] = df["status"].eq("menunggu_konfirmasi")
+    df["nominal_lunas"] = df["jumlah"].where(df["is_lunas"], 0.0)
+
+    months = sorted(df["bulan_idx"].unique().tolist())
+    grid = summarize_bills(df, ["kelas", "bulan_idx"])
+    kelas = grid.index.get_level_values("kelas").unique().tolist()
+    matrix = {
+        metric: grid[metric].unstack(fill_value=0).reindex(index=kelas, columns=months, fill_value=0).to_numpy().tolist()
+        for metric in ANALYTICS_METRICS
+    }
+
+    def records(frame: pd.DataFrame, key: str, extra: tuple = ()) -> list:
+        out = frame.reset_index()
+        out[key] = out[key].astype(str)
+        return out[[key, *extra] + ANALYTICS_METRICS].to_dict("records")
+
+    per_kelas = summarize_bills(df, ["kelas"])
+    # Perbandingan angkatan: rekap + tingkat koleksi per bulan (urutan baris sama, sama-sama di-sort)
+    per_angkatan = summarize_bills(df, ["angkatan"])
+    per_angkatan["siswa"] = df.groupby("angkatan")["id_siswa"].nunique()
+    cohort_rates = summarize_bills(df, ["angkatan", "bulan_idx"])["tingkat_koleksi"].unstack(fill_value=0).reindex(
+        index=per_angkatan.index, columns=months, fill_value=0)
+    angkatan = records(per_angkatan, "angkatan", ("siswa",))
+    for row, rates in zip(angkatan, cohort_rates.to_numpy().tolist()):
+        row["tingkat_koleksi_per_bulan"] = rates
+
+    nominal = float(df["jumlah"].sum())
+    nominal_lunas = float(df["nominal_lunas"].sum())
+    return {
+        "tahun": tahun,
+        "bulan": [bulan_names[i] for i in months],
+        "kelas": kelas,
+        "matrix": matrix,
+        "per_kelas": records(per_kelas, "kelas"),
+        "angkatan": angkatan,
+        "total": {
+            "tagihan": int(len(df)),
+            "lunas": int(df["is_lunas"].sum()),
+            "menunggu": int(df["is_menunggu"].sum()),
+            "nominal": nominal,
+            "nominal_lunas": nominal_lunas,
+            "tingkat_koleksi": float(collection_rate(np.array([nominal_lunas]), np.array([nominal]))[0]),
+        },
+    }
+
+
+def payment_matrix_xlsx(report: dict) -> bytes:
+    buffer = BytesIO()
+    with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
+        for metric, sheet in [("lunas", "Lunas"), ("menunggu", "Menunggu"), ("belum", "Belum"),
+                              ("nominal_lunas", "Nominal Lunas"), ("nominal_belum", "Nominal Belum"),
+                              ("tingkat_koleksi", "Tingkat Koleksi")]:
+            pd.DataFrame(report["matrix"][metric], index=report["kelas"], columns=report["bulan"]).to_excel(
+                writer, sheet_name=sheet, index_label="Kelas")
+        pd.DataFrame(report["per_kelas"]).to_excel(writer, sheet_name="Per Kelas", index=False)
+        angkatan = pd.DataFrame(report["angkatan"]).drop(columns="tingkat_koleksi_per_bulan", errors="ignore")
+        angkatan.to_excel(writer, sheet_name="Angkatan", index=False)
+    return buffer.getvalue()
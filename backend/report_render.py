@@ -0,0 +1,499 @@
+"""Render kuitansi dan laporan ke PDF (reportlab) / XLSX (pandas + openpyxl).
+
+Modul ini sengaja tidak di-import di level atas server.py: reportlab dan pandas
+memakan ratusan milidetik dan puluhan MB per worker, padahal hanya dipakai saat
+export. server.py mengambil data dari Mongo lalu memanggil fungsi di sini lewat
+``asyncio.to_thread`` (import pertama terjadi di sana, atau saat prewarm).
+Semua fungsi sinkron, tidak menyentuh database, dan mengembalikan bytes.
+"""
+from datetime import datetime, timezone, tzinfo
+from io import BytesIO
+from pathlib import Path
+from typing import Optional
+
+import pandas as pd
+from reportlab.lib import colors
+from reportlab.lib.enums import TA_CENTER, TA_RIGHT
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib.units import inch
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Image
+
+DEFAULT_SCHOOL = {"nama_sekolah": "SMK MEKAR MURNI", "alamat": "Jl. Pendidikan No. 123", "no_telp": "-"}
+HEADER_TABLE_STYLE = [
+    ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#1e3a8a')),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+]
+
+
+def to_local(value, tz: tzinfo) -> datetime:
+    """Sama dengan server.to_local, dengan zona waktu sekolah sebagai argumen."""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(tz)
+
+
+def school_header(school: Optional[dict], logo_path: Optional[Path] = None) -> list:
+    """Kop laporan A4: logo (jika ada) + nama, alamat, telepon sekolah, lalu garis pemisah."""
+    school = school or DEFAULT_SCHOOL
+    h_style = ParagraphStyle('RepHeader', fontSize=14, fontName='Helvetica-Bold', alignment=TA_CENTER)
+    a_style = ParagraphStyle('RepAddr', fontSize=10, fontName='Helvetica', alignment=TA_CENTER)
+
+    elements = []
+    if logo_path and logo_path.exists():
+        logo_img = Image(str(logo_path), width=0.8*inch, height=0.8*inch)
+        school_info = [
+            [Paragraph(school['nama_sekolah'].upper(), h_style)],
+            [Paragraph(school['alamat'], a_style)],
+            [Paragraph(f"Telp: {school['no_telp']}", a_style)]
+        ]
+        info_table = Table(school_info, colWidths=[5*inch])
+        header_table = Table([[logo_img, info_table]], colWidths=[1*inch, 5.5*inch])
+        header_table.setStyle(TableStyle([('VALIGN', (0,0), (-1,-1), 'MIDDLE')]))
+        elements.append(header_table)
+    else:
+        elements.append(Paragraph(school['nama_sekolah'].upper(), h_style))
+        elements.append(Paragraph(school['alamat'], a_style))
+
+    elements.append(Spacer(1, 0.1*inch))
+    elements.append(Paragraph("-" * 95, a_style))
+    elements.append(Spacer(1, 0.2*inch))
+    return elements
+
+
+def report_title_style() -> ParagraphStyle:
+    styles = getSampleStyleSheet()
+    return ParagraphStyle('Title', parent=styles['Heading1'], fontSize=16, alignment=TA_CENTER, spaceAfter=20)
+
+
+def build_pdf(elements: list, **kwargs) -> bytes:
+    buffer = BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=kwargs.pop("pagesize", A4), **kwargs)
+    doc.build(elements)
+    return buffer.getvalue()
+
+
+def dataframe_xlsx(rows: list, sheet_name: str) -> bytes:
+    buffer = BytesIO()
+    with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
+        pd.DataFrame(rows).to_excel(writer, index=False, sheet_name=sheet_name)
+    return buffer.getvalue()
+
+
+def receipt_pdf(bill: dict, payment: dict, student: dict, school: dict, logo_path: Optional[Path], tz: tzinfo) -> bytes:
+    """Kuitansi half-letter landscape (8.5 x 5.5 inch) dengan huruf Courier."""
+    elements = []
+
+    # Define styles with Courier (Monospace)
+    f_bold = 'Courier-Bold'
+    f_norm = 'Courier'
+
+    header_style = ParagraphStyle('Header', fontSize=12, alignment=TA_CENTER, fontName=f_bold, leading=14)
+    addr_style = ParagraphStyle('Addr', fontSize=9, alignment=TA_CENTER, fontName=f_norm, leading=11)
+    title_style = ParagraphStyle('Title', fontSize=11, alignment=TA_CENTER, fontName=f_bold, spaceBefore=2, spaceAfter=2)
+
+    label_style = ParagraphStyle('Label', fontSize=9, fontName=f_norm)
+    value_style = ParagraphStyle('Value', fontSize=9, fontName=f_bold)
+
+    table_header = ParagraphStyle('THeader', fontSize=9, fontName=f_bold, alignment=TA_CENTER)
+    table_cell = ParagraphStyle('TCell', fontSize=9, fontName=f_norm)
+    table_right = ParagraphStyle('TRight', fontSize=9, fontName=f_norm, alignment=TA_RIGHT)
+    table_bold_right = ParagraphStyle('TBoldRight', fontSize=9, fontName=f_bold, alignment=TA_RIGHT)
+
+    footer_style = ParagraphStyle('Footer', fontSize=9, fontName=f_norm, alignment=TA_CENTER)
+
+    def p(text, style):
+        return Paragraph(str(text), style)
+
+    # --- 1. Header with Logo ---
+    if logo_path and logo_path.exists():
+        # Create a table for header: [Logo, School Info]
+        logo_img = Image(str(logo_path), width=0.7*inch, height=0.7*inch)
+
+        school_info = [
+            [p(school['nama_sekolah'].upper(), header_style)],
+            [p(school['alamat'], addr_style)],
+            [p(f"Telp: {school['no_telp']}", addr_style)]
+        ]
+        info_table = Table(school_info, colWidths=[6.5*inch])
+        info_table.setStyle(TableStyle([
+            ('ALIGN', (0,0), (-1,-1), 'CENTER'),
+            ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
+        ]))
+
+        header_table = Table([[logo_img, info_table]], colWidths=[0.8*inch, 6.7*inch])
+        header_table.setStyle(TableStyle([
+            ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
+        ]))
+        elements.append(header_table)
+    else:
+        elements.append(p(school['nama_sekolah'].upper(), header_style))
+        elements.append(p(school['alamat'], addr_style))
+        elements.append(p(f"Telp: {school['no_telp']}", addr_style))
+
+    # Separator Line
+    line_str = "-" * 85
+    elements.append(p(line_str, addr_style))
+
+    # --- 2. Title ---
+    elements.append(p("BUKTI PEMBAYARAN", title_style))
+
+    # --- 3. Info Section (Two Columns) ---
+    # Tampilkan dalam WIB
+    tgl_bayar = payment['tanggal_bayar']
+    try:
+        tgl_str = to_local(tgl_bayar, tz).strftime('%d-%m-%Y %H:%M:%S')
+    except (TypeError, ValueError):
+        tgl_str = str(tgl_bayar)
+
+    info_data = [
+        [p("No Transaksi", label_style), p(":", label_style), p(payment['id'][:12].upper(), value_style),
+         p("", label_style), # gap
+         p("Tanggal", label_style), p(":", label_style), p(tgl_str, value_style)],
+
+        [p("No Induk", label_style), p(":", label_style), p(student['nis'], value_style),
+         p("", label_style), # gap
+         p("Kelas", label_style), p(":", label_style), p(student['kelas'], value_style)],
+
+        [p("Nama", label_style), p(":", label_style), p(student['nama'], value_style),
+         p("", label_style), p("", label_style), p("", label_style), p("", label_style)],
+    ]
+
+    info_table = Table(info_data, colWidths=[1.1*inch, 0.1*inch, 2.5*inch, 0.5*inch, 0.8*inch, 0.1*inch, 2.5*inch])
+    info_table.setStyle(TableStyle([
+        ('VALIGN', (0,0), (-1,-1), 'TOP'),
+        ('LEFTPADDING', (0,0), (-1,-1), 0),
+        ('BOTTOMPADDING', (0,0), (-1,-1), 0),
+        ('TOPPADDING', (0,0), (-1,-1), 0),
+    ]))
+    elements.append(info_table)
+    elements.append(p(line_str, addr_style)) # Line after info
+
+    # --- 4. Items Table ---
+    # Reduced spacing to ensure one page
+    item_data = [
+        [p("No", table_header), p("Nama Pembayaran", table_header), p("Nominal", table_header)],
+        [p("1", table_cell), p(f"BIAYA SPP {bill['tahun']} Bulan {bill['bulan']}", table_cell), p(f"{bill['jumlah']:,.0f}", table_right)],
+    ]
+
+    item_table = Table(item_data, colWidths=[0.5*inch, 5.5*inch, 1.6*inch])
+    item_table.setStyle(TableStyle([
+        ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
+        ('LINEBELOW', (0,0), (-1,0), 0.5, colors.black),
+        ('TOPPADDING', (0,0), (-1,-1), 2),
+        ('BOTTOMPADDING', (0,0), (-1,-1), 2),
+    ]))
+    elements.append(item_table)
+    elements.append(p(line_str, addr_style))
+
+    # --- 5. Totals Section ---
+    total_data = [
+        [p("", table_cell), p("Total   :", table_bold_right), p(f"{bill['jumlah']:,.0f}", table_bold_right)],
+        [p("", table_cell), p("Tunai   :", table_cell), p(f"{bill['jumlah']:,.0f}", table_right)],
+        [p("", table_cell), p("Kembali :", table_cell), p("0", table_right)],
+    ]
+    total_table = Table(total_data, colWidths=[5.0*inch, 1.0*inch, 1.6*inch])
+    total_table.setStyle(TableStyle([
+        ('ALIGN', (1,0), (-1,-1), 'RIGHT'),
+        ('LEFTPADDING', (0,0), (-1,-1), 0),
+        ('BOTTOMPADDING', (0,0), (-1,-1), 0),
+        ('TOPPADDING', (0,0), (-1,-1), 0),
+    ]))
+    elements.append(total_table)
+    elements.append(p(line_str, addr_style))
+
+    # --- 6. Signature Section ---
+    # Signature moved up and made more compact
+    elements.append(Spacer(1, 0.1*inch))
+
+    tgl_now = datetime.now(tz).strftime('%d-%m-%Y')
+    sig_data = [
+        ["", p(f"Indonesia, {tgl_now}", footer_style)],
+        ["", p("Petugas", footer_style)],
+        ["", Spacer(1, 0.2*inch)], # reduced from 0.3
+        ["", p("Admin", footer_style)],
+    ]
+
+    sig_table = Table(sig_data, colWidths=[5.5*inch, 1.8*inch])
+    sig_table.setStyle(TableStyle([
+        ('ALIGN', (1,0), (1,-1), 'CENTER'),
+    ]))
+    elements.append(sig_table)
+
+    return build_pdf(elements, pagesize=(8.5*inch, 5.5*inch), leftMargin=0.4*inch, rightMargin=0.4*inch,
+                     topMargin=0.3*inch, bottomMargin=0.3*inch)
+
+
+def monthly_pdf(report_data: dict, school: Optional[dict], logo_path: Optional[Path], status: Optional[str], tz: tzinfo) -> bytes:
+    bulan, tahun = report_data["bulan"], report_data["tahun"]
+    payments = report_data["payments"]
+
+    styles = getSampleStyleSheet()
+    title_style = ParagraphStyle(
+        'CustomTitle',
+        parent=styles['Heading1'],
+        fontSize=16,
+        textColor=colors.HexColor('#1e3a8a'),
+        spaceAfter=30,
+        alignment=TA_CENTER
+    )
+    elements = school_header(school, logo_path)
+
+    # Title
+    filter_text = f" ({status.upper()})" if status and status != 'all' else ""
+    title = Paragraph(f"LAPORAN PEMBAYARAN SPP BULANAN{filter_text}<br/>{bulan} {tahun}", title_style)
+    elements.append(title)
+    elements.append(Spacer(1, 0.2*inch))
+
+    # Table data
+    data = [['No', 'NIS', 'Nama', 'Kelas', 'Tgl Bayar', 'Jumlah', 'Status']]
+
+    total_jumlah = 0
+    for idx, p in enumerate(payments, 1):
+        # Format date to DD/MM/YYYY (WIB)
+        tgl_bayar = "-"
+        if p.get('tanggal_bayar'):
+            try:
+                tgl_bayar = to_local(p['tanggal_bayar'], tz).strftime("%d/%m/%Y")
+            except (TypeError, ValueError):
+                tgl_bayar = str(p['tanggal_bayar'])
+
+        data.append([
+            str(idx),
+            p['siswa']['nis'],
+            p['siswa']['nama'],
+            p['siswa']['kelas'],
+            tgl_bayar,
+            f"Rp {p['jumlah']:,.0f}",
+            p['status'].upper()
+        ])
+        total_jumlah += p['jumlah']
+
+    # Add total row
+    data.append(['', '', '', '', 'Total:', f"Rp {total_jumlah:,.0f}", ''])
+
+    table = Table(data, colWidths=[0.4*inch, 0.8*inch, 1.8*inch, 0.8*inch, 1*inch, 1.2*inch, 1*inch])
+    table.setStyle(TableStyle(HEADER_TABLE_STYLE + [
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 9),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black),
+        ('BACKGROUND', (0, -1), (-1, -1), colors.HexColor('#fbbf24')),
+        ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold'),
+    ]))
+    elements.append(table)
+    return build_pdf(elements)
+
+
+def monthly_xlsx(report_data: dict, tz: tzinfo) -> bytes:
+    data_list = []
+    for p in report_data["payments"]:
+        tgl_bayar = to_local(p['tanggal_bayar'], tz).strftime('%Y-%m-%d') if p.get('tanggal_bayar') else '-'
+        data_list.append({
+            'NIS': p['siswa']['nis'],
+            'Nama': p['siswa']['nama'],
+            'Kelas': p['siswa']['kelas'],
+            'Bulan Tagihan': p['tagihan']['bulan'],
+            'Tahun Tagihan': p['tagihan']['tahun'],
+            'Tanggal Bayar': tgl_bayar,
+            'Jumlah': p['jumlah'],
+            'Status': p['status'].upper()
+        })
+    return dataframe_xlsx(data_list, 'Laporan SPP')
+
+
+def student_pdf(report: dict, school: Optional[dict], logo_path: Optional[Path], status: Optional[str] = None) -> bytes:
+    student = report['student']
+    styles = getSampleStyleSheet()
+    elements = school_header(school, logo_path)
+
+    status_text = f" ({status.upper()})" if status else ""
+    elements.append(Paragraph(f"LAPORAN PEMBAYARAN SISWA{status_text}", report_title_style()))
+
+    info_data = [
+        [Paragraph(f"Nama: <b>{student.get('nama', '-')}</b>", styles['Normal']), Paragraph(f"NIS: <b>{student.get('nis', '-')}</b>", styles['Normal'])],
+        [Paragraph(f"Kelas: <b>{student.get('kelas', '-')}</b>", styles['Normal']), Paragraph(f"Angkatan: <b>{student.get('angkatan', '-')}</b>", styles['Normal'])]
+    ]
+    elements.append(Table(info_data, colWidths=[3*inch, 3*inch]))
+    elements.append(Spacer(1, 0.2*inch))
+
+    data = [['No', 'Bulan/Tahun', 'Jumlah', 'Status']]
+    for idx, b in enumerate(report['bills'], 1):
+        data.append([str(idx), f"{b['bulan']} {b['tahun']}", f"Rp {b['jumlah']:,.0f}", b['status'].upper()])
+
+    summary = report['summary']
+    data.append(['', 'Total Tagihan', f"Rp {summary['total_tagihan']:,.0f}", ''])
+    data.append(['', 'Total Dibayar', f"Rp {summary['total_dibayar']:,.0f}", ''])
+    data.append(['', 'Sisa Tagihan', f"Rp {summary['sisa_tagihan']:,.0f}", ''])
+
+    t = Table(data, colWidths=[0.5*inch, 2.5*inch, 1.5*inch, 1.5*inch])
+    t.setStyle(TableStyle(HEADER_TABLE_STYLE + [
+        ('GRID', (0, 0), (-1, -4), 1, colors.black),
+        ('FONTNAME', (0, -3), (-1, -1), 'Helvetica-Bold')
+    ]))
+    elements.append(t)
+    return build_pdf(elements)
+
+
+def student_xlsx(report: dict) -> bytes:
+    data_list = []
+    for b in report['bills']:
+        data_list.append({
+            'Bulan': b['bulan'],
+            'Tahun': b['tahun'],
+            'Jumlah': b['jumlah'],
+            'Status': b['status'].upper()
+        })
+    return dataframe_xlsx(data_list, 'Laporan Siswa')
+
+
+def class_pdf(report: dict, class_name: str, school: Optional[dict], logo_path: Optional[Path]) -> bytes:
+    elements = school_header(school, logo_path)
+    elements.append(Paragraph(f"LAPORAN PEMBAYARAN KELAS {class_name}", report_title_style()))
+
+    summary_data = [
+        ["Total Estimasi", f"Rp {report['total_estimasi']:,.0f}"],
+        ["Total Masuk", f"Rp {report['total_masuk']:,.0f}"],
+        ["Total Tunggakan", f"Rp {report['total_tunggakan']:,.0f}"],
+        ["Jumlah Siswa", str(report['student_count'])]
+    ]
+    elements.append(Table(summary_data, colWidths=[2*inch, 2*inch]))
+    elements.append(Spacer(1, 0.2*inch))
+
+    data = [['NIS', 'Nama', 'Tagihan', 'Dibayar', 'Status']]
+    for s in report['breakdown']:
+        data.append([s['nis'], s['nama'], f"Rp {s['total_tagihan']:,.0f}", f"Rp {s['total_dibayar']:,.0f}", s['status']])
+
+    t = Table(data, colWidths=[1*inch, 2.5*inch, 1.2*inch, 1.2*inch, 1*inch])
+    t.setStyle(TableStyle(HEADER_TABLE_STYLE + [
+        ('GRID', (0, 0), (-1, -1), 1, colors.black),
+    ]))
+    elements.append(t)
+    return build_pdf(elements)
+
+
+def class_xlsx(report: dict, class_name: str) -> bytes:
+    data_list = []
+    for s in report['breakdown']:
+        data_list.append({
+            'NIS': s['nis'],
+            'Nama': s['nama'],
+            'Total Tagihan': s['total_tagihan'],
+            'Total Dibayar': s['total_dibayar'],
+            'Tunggakan': s['total_tagihan'] - s['total_dibayar'],
+            'Status': s['status']
+        })
+    return dataframe_xlsx(data_list, f'Kelas {class_name}')
+
+
+def batch_pdf(report: dict, batch: str, school: Optional[dict], logo_path: Optional[Path]) -> bytes:
+    elements = school_header(school, logo_path)
+    elements.append(Paragraph(f"LAPORAN PEMBAYARAN ANGKATAN {batch}", report_title_style()))
+
+    data = [['Kelas', 'Siswa', 'Tagihan', 'Dibayar', 'Tunggakan']]
+    for c in report['class_breakdown']:
+        data.append([c['kelas'], str(c['student_count']), f"Rp {c['total_tagihan']:,.0f}", f"Rp {c['total_dibayar']:,.0f}", f"Rp {c['total_tunggakan']:,.0f}"])
+
+    data.append(['TOTAL', str(report['student_count']), f"Rp {report['total_estimasi']:,.0f}", f"Rp {report['total_masuk']:,.0f}", f"Rp {report['total_tunggakan']:,.0f}"])
+
+    t = Table(data, colWidths=[1.5*inch, 0.8*inch, 1.5*inch, 1.5*inch, 1.5*inch])
+    t.setStyle(TableStyle(HEADER_TABLE_STYLE + [
+        ('GRID', (0, 0), (-1, -1), 1, colors.black),
+        ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold')
+    ]))
+    elements.append(t)
+    return build_pdf(elements)
+
+
+def batch_xlsx(report: dict, batch: str) -> bytes:
+    data_list = []
+    for c in report['class_breakdown']:
+        data_list.append({
+            'Kelas': c['kelas'],
+            'Jumlah Siswa': c['student_count'],
+            'Total Tagihan': c['total_tagihan'],
+            'Total Dibayar': c['total_dibayar'],
+            'Tunggakan': c['total_tunggakan']
+        })
+    return dataframe_xlsx(data_list, f'Angkatan {batch}')
+
+
+def arrears_pdf(bills: list, school: Optional[dict]) -> bytes:
+    # Laporan tunggakan dan rekap kelas memakai kop tanpa logo
+    elements = school_header(school)
+    elements.append(Paragraph("LAPORAN TUNGGAKAN SISWA", report_title_style()))
+
+    data = [['No', 'NIS', 'Nama', 'Kelas', 'Bulan/Tahun', 'Jumlah']]
+    total_tunggakan = 0
+    for idx, b in enumerate(bills, 1):
+        data.append([
+            str(idx),
+            b['siswa']['nis'],
+            b['siswa']['nama'],
+            b['siswa']['kelas'],
+            f"{b['bulan']} {b['tahun']}",
+            f"Rp {b['jumlah']:,.0f}"
+        ])
+        total_tunggakan += b['jumlah']
+
+    data.append(['', '', '', '', 'Total:', f"Rp {total_tunggakan:,.0f}"])
+
+    t = Table(data, colWidths=[0.5*inch, 1*inch, 2*inch, 1*inch, 1*inch, 1.2*inch])
+    t.setStyle(TableStyle(HEADER_TABLE_STYLE + [
+        ('GRID', (0, 0), (-1, -2), 1, colors.black),
+        ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold')
+    ]))
+    elements.append(t)
+    return build_pdf(elements)
+
+
+def arrears_xlsx(bills: list) -> bytes:
+    data_list = []
+    for b in bills:
+        data_list.append({
+            'NIS': b['siswa']['nis'],
+            'Nama': b['siswa']['nama'],
+            'Kelas': b['siswa']['kelas'],
+            'Bulan': b['bulan'],
+            'Tahun': b['tahun'],
+            'Jumlah': b['jumlah']
+        })
+    return dataframe_xlsx(data_list, 'Tunggakan')
+
+
+def class_recap_pdf(recap: list, school: Optional[dict]) -> bytes:
+    elements = school_header(school)
+    elements.append(Paragraph("REKAP PEMBAYARAN PER KELAS", report_title_style()))
+
+    data = [['Kelas', 'Siswa', 'Total Tagihan', 'Lunas', 'Tunggakan']]
+    for c in recap:
+        data.append([
+            c['nama_kelas'],
+            str(c['jumlah_siswa']),
+            f"Rp {c['total_tagihan']:,.0f}",
+            f"Rp {c['pembayaran_lunas']:,.0f}",
+            f"Rp {c['total_tunggakan']:,.0f}"
+        ])
+
+    t = Table(data, colWidths=[1.5*inch, 0.8*inch, 1.5*inch, 1.2*inch, 1.5*inch])
+    t.setStyle(TableStyle(HEADER_TABLE_STYLE + [
+        ('GRID', (0, 0), (-1, -1), 1, colors.black)
+    ]))
+    elements.append(t)
+    return build_pdf(elements)
+
+
+def class_recap_xlsx(recap: list) -> bytes:
+    data_list = []
+    for c in recap:
+        data_list.append({
+            'Nama Kelas': c['nama_kelas'],
+            'Jumlah Siswa': c['jumlah_siswa'],
+            'Total Tagihan': c['total_tagihan'],
+            'Lunas': c['pembayaran_lunas'],
+            'Tunggakan': c['total_tunggakan']
+        })
+    return dataframe_xlsx(data_list, 'Rekap Kelas')
@@ -0,0 +1,230 @@
+"""Generator data sintetis untuk uji beban / skala.
+
+Contoh:
+    python seed_data.py --classes 30 --angkatan 3 --students-per-class 36 --months 12 --drop
+    python seed_data.py --students 100000 --classes 2800 --lunas-rate 0.65 --pending-rate 0.1 --db spp_load
+
+Dokumen dibangun dari model di server.py (Class, Student, Bill, Payment) sehingga
+bentuknya sama persis dengan data produksi, lalu ditulis dengan insert_many
+bertahap (unordered). Ringkasan akun (student_accounts) dihitung sekalian, sama
+dengan hasil rebuild_student_accounts, dan versi data (data_versions) koleksi yang
+ditulis dinaikkan agar cache laporan server yang sedang berjalan ikut basi. Hash
+bcrypt password siswa dihitung sekali dan dipakai ulang.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+
+import bcrypt
+from dotenv import load_dotenv
+from pymongo import MongoClient
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+BULAN = ["Januari", "Februari", "Maret", "April", "Mei", "Juni",
+         "Juli", "Agustus", "September", "Oktober", "November", "Desember"]
+TINGKAT = ["X", "XI", "XII"]
+BANKS = ["BRI", "BNI", "BCA", "Mandiri", "BSI", "BTN"]
+NAMA_DEPAN = ["Andi", "Budi", "Citra", "Dewi", "Eka", "Fajar", "Gita", "Hendra", "Indah", "Joko",
+              "Kartika", "Lestari", "Made", "Nur", "Putri", "Rizky", "Sari", "Taufik", "Wahyu", "Yuni"]
+NAMA_BELAKANG = ["Pratama", "Saputra", "Wijaya", "Lestari", "Hidayat", "Kusuma", "Santoso",
+                 "Nugroho", "Permata", "Utami", "Siregar", "Nasution", "Setiawan", "Rahmawati"]
+
+
+@dataclass
+class SeedConfig:
+    classes: int = 9
+    angkatan: int = 3
+    students_per_class: int = 36
+    students: int = 0  # jika > 0, total siswa dibagi rata ke semua kelas (menimpa students_per_class)
+    months: int = 12
+    year: int = datetime.now().year
+    lunas_rate: float = 0.7
+    pending_rate: float = 0.1
+    base_spp: float = 500000
+    password: str = "siswa123"
+    batch_size: int = 10000
+    seed: int = 42
+
+
+def _tingkat(cohort_idx: int) -> str:
+    return TINGKAT[cohort_idx] if cohort_idx < len(TINGKAT) else f"T{cohort_idx + 1}"
+
+
+def _flush(collection, buffer: list, stats: dict, name: str):
+    if buffer:
+        collection.insert_many(buffer, ordered=False)
+        stats[name] += len(buffer)
+        buffer.clear()
+
+
+def seed_school(db, cfg: SeedConfig) -> dict:
+    """Tulis kelas, siswa, tagihan, pembayaran dan ringkasan akun ke ``db`` (database pymongo sinkron)."""
+    # Import di sini supaya `python seed_data.py --help` tidak perlu memuat server.py
+    from server import Bill, Class, Payment, Student
+
+    rng = random.Random(cfg.seed)
+    stats = {"classes": 0, "students": 0, "bills": 0, "payments": 0, "student_accounts": 0}
+
+    # Satu hash untuk semua siswa: bcrypt sengaja lambat (~0.2 detik per hash)
+    password_hash = bcrypt.hashpw(cfg.password.encode(), bcrypt.gensalt()).decode()
+
+    classes = []
+    for i in range(cfg.classes):
+        cohort = i % cfg.angkatan
+        cls = Class(nama_kelas=f"{_tingkat(cohort)}-{i // cfg.angkatan + 1}",
+                    nominal_spp=cfg.base_spp + cohort * 50000)
+        doc = cls.model_dump()
+        classes.append((doc, str(cfg.year - cohort)))
+    _flush(db.classes, [c for c, _ in classes], stats, "classes")
+
+    if cfg.students > 0:
+        per_class = [cfg.students // cfg.classes + (1 if i < cfg.students % cfg.classes else 0)
+                     for i in range(cfg.classes)]
+    else:
+        per_class = [cfg.students_per_class] * cfg.classes
+
+    periods = [(BULAN[m % 12], cfg.year + m // 12, m % 12 + 1) for m in range(cfg.months)]
+    now = datetime.now(timezone.utc)
+    students_buf, bills_buf, payments_buf, accounts_buf = [], [], [], []
+    nis = 100000
+
+    for (cls, angkatan), count in zip(classes, per_class):
+        for _ in range(count):
+            nis += 1
+            nama = f"{rng.choice(NAMA_DEPAN)} {rng.choice(NAMA_BELAKANG)}"
+            student = Student(
+                nis=str(nis),
+                nama=nama,
+                kelas=cls["nama_kelas"],
+                angkatan=angkatan,
+                no_wa=f"08{rng.randint(1000000000, 9999999999)}",
+                username=f"siswa{nis}",
+                password=password_hash,
+            )
+            s_doc = student.model_dump()
+            s_doc['created_at'] = now
+            students_buf.append(s_doc)
+            snapshot = {"nama": nama, "nis": student.nis, "kelas": student.kelas}
+            account = {"id_siswa": student.id, "tagihan": {}}
+
+            for bulan, tahun, month_no in periods:
+                roll = rng.random()
+                if roll < cfg.lunas_rate:
+                    status = "lunas"
+                elif roll < cfg.lunas_rate + cfg.pending_rate:
+                    status = "menunggu_konfirmasi"
+                else:
+                    status = "belum"
+
+                bill = Bill(id_siswa=student.id, bulan=bulan, tahun=tahun, jumlah=cls["nominal_spp"], status=status,
+                            siswa=snapshot)
+                b_doc = bill.model_dump()
+                b_doc['created_at'] = now
+                bills_buf.append(b_doc)
+                per_status = account["tagihan"].setdefault(status, {"bulan": 0, "nominal": 0})
+                per_status["bulan"] += 1
+                per_status["nominal"] += bill.jumlah
+
+                if status != "belum":
+                    paid_at = datetime(tahun, month_no, rng.randint(1, 28), rng.randint(0, 23),
+                                       rng.randint(0, 59), tzinfo=timezone.utc)
+                    payment = Payment(
+                        id_tagihan=bill.id,
+                        id_siswa=student.id,
+                        tanggal_bayar=paid_at,
+                        jumlah=bill.jumlah,
+                        status="diterima" if status == "lunas" else "pending",
+                        nama_pengirim=nama,
+                        bank_asal=rng.choice(BANKS),
+                        siswa=snapshot,
+                        tagihan={"bulan": bulan, "tahun": tahun},
+                    )
+                    p_doc = payment.model_dump()
+                    payments_buf.append(p_doc)
+                    if payment.status == "diterima":
+                        account["total_dibayar"] = account.get("total_dibayar", 0) + payment.jumlah
+                        account["jumlah_pembayaran"] = account.get("jumlah_pembayaran", 0) + 1
+                        account["pembayaran_terakhir"] = max(account.get("pembayaran_terakhir", paid_at), paid_at)
+
+            account["updated_at"] = now
+            accounts_buf.append(account)
+
+            if len(students_buf) >= cfg.batch_size:
+                _flush(db.students, students_buf, stats, "students")
+            if len(bills_buf) >= cfg.batch_size:
+                _flush(db.bills, bills_buf, stats, "bills")
+            if len(payments_buf) >= cfg.batch_size:
+                _flush(db.payments, payments_buf, stats, "payments")
+            if len(accounts_buf) >= cfg.batch_size:
+                _flush(db.student_accounts, accounts_buf, stats, "student_accounts")
+
+    _flush(db.students, students_buf, stats, "students")
+    _flush(db.bills, bills_buf, stats, "bills")
+    _flush(db.payments, payments_buf, stats, "payments")
+    _flush(db.student_accounts, accounts_buf, stats, "student_accounts")
+    # Sama dengan bump_data_version di server.py: cache laporan di server yang berjalan jadi basi
+    for name, count in stats.items():
+        if count:
+            db.data_versions.update_one({"_id": name}, {"$inc": {"version": 1}}, upsert=True)
+    return stats
+
+
+def main(argv=None):
+    defaults = SeedConfig()
+    parser = argparse.ArgumentParser(description="Isi MongoDB dengan data sekolah sintetis.")
+    parser.add_argument("--mongo-url", default=os.environ.get("MONGO_URL", "mongodb://localhost:27017"))
+    parser.add_argument("--db", default=os.environ.get("DB_NAME", "test_database"))
+    parser.add_argument("--drop", action="store_true", help="Hapus classes/students/bills/payments/student_accounts sebelum seeding")
+    parser.add_argument("--classes", type=int, default=defaults.classes)
+    parser.add_argument("--angkatan", type=int, default=defaults.angkatan, help="Jumlah angkatan (kohort)")
+    parser.add_argument("--students-per-class", type=int, default=defaults.students_per_class)
+    parser.add_argument("--students", type=int, default=defaults.students,
+                        help="Total siswa (dibagi rata ke semua kelas, menimpa --students-per-class)")
+    parser.add_argument("--months", type=int, default=defaults.months, help="Jumlah bulan tagihan mulai Januari")
+    parser.add_argument("--year", type=int, default=defaults.year)
+    parser.add_argument("--lunas-rate", type=float, default=defaults.lunas_rate)
+    parser.add_argument("--pending-rate", type=float, default=defaults.pending_rate,
+                        help="Porsi tagihan menunggu_konfirmasi (sisanya 'belum')")
+    parser.add_argument("--base-spp", type=float, default=defaults.base_spp)
+    parser.add_argument("--password", default=defaults.password, help="Password semua akun siswa")
+    parser.add_argument("--batch-size", type=int, default=defaults.batch_size)
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+    args = parser.parse_args(argv)
+
+    if args.lunas_rate + args.pending_rate > 1:
+        parser.error("--lunas-rate + --pending-rate tidak boleh lebih dari 1")
+
+    cfg = SeedConfig(
+        classes=args.classes, angkatan=args.angkatan, students_per_class=args.students_per_class,
+        students=args.students, months=args.months, year=args.year, lunas_rate=args.lunas_rate,
+        pending_rate=args.pending_rate, base_spp=args.base_spp, password=args.password,
+        batch_size=args.batch_size, seed=args.seed,
+    )
+
+    client = MongoClient(args.mongo_url)
+    db = client[args.db]
+    if args.drop:
+        for name in ("classes", "students", "bills", "payments", "student_accounts"):
+            db.drop_collection(name)
+
+    started = time.perf_counter()
+    stats = seed_school(db, cfg)
+    elapsed = time.perf_counter() - started
+    total = sum(stats.values())
+    print(f"[SEED] {args.db}: {stats['classes']} kelas, {stats['students']} siswa, "
+          f"{stats['bills']} tagihan, {stats['payments']} pembayaran, {stats['student_accounts']} ringkasan akun")
+    print(f"[SEED] {total} dokumen dalam {elapsed:.1f} detik ({total / elapsed:,.0f} dok/detik)")
+    print(f"[SEED] Login siswa: username siswa<NIS>, password '{cfg.password}'")
+    client.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
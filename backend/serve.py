@@ -0,0 +1,249 @@
+"""Launcher produksi: beberapa worker uvicorn di belakang satu port.
+
+Contoh:
+    python serve.py                           # gunicorn + UvicornWorker, jumlah worker = jumlah CPU
+    python serve.py --workers 4 --port 8000
+    python serve.py --reuse-port              # tiap worker bind sendiri dengan SO_REUSEPORT (Linux)
+    python serve.py --workers 1               # satu proses tanpa gunicorn (mis. di Windows)
+
+server.py di-import sekali di proses master sebelum fork (preload), sehingga kode
+dan modul yang sudah dimuat dibagi copy-on-write antar worker; dengan
+EXPORT_PREWARM=1 modul export (reportlab/pandas) ikut dimuat di master. Koneksi
+Mongo baru dibuka di masing-masing worker. uvloop dan httptools dipakai otomatis
+jika terpasang.
+
+SIGTERM/SIGINT: worker berhenti menerima koneksi, menunggu request yang berjalan
+sampai --graceful-timeout, menutup sesi WebSocket dengan kode 1012 (frontend
+menyambung ulang ke worker lain), menjalankan shutdown aplikasi lalu mem-flush log.
+"""
+import argparse
+import importlib
+import importlib.util
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+
+try:
+    from uvicorn.workers import UvicornWorker
+except ImportError:  # gunicorn tidak tersedia (mis. Windows)
+    UvicornWorker = None
+
+logger = logging.getLogger("serve")
+
+# Worker yang mati kurang dari ini setelah start dianggap gagal boot (mis. port dipakai, .env salah)
+MIN_WORKER_UPTIME = 5
+# Master gunicorn menunggu drain uvicorn + waktu ini (shutdown aplikasi) sebelum SIGKILL
+SHUTDOWN_MARGIN = 5
+
+
+def default_workers() -> int:
+    """WEB_CONCURRENCY jika di-set, selain itu jumlah CPU yang boleh dipakai proses ini."""
+    if os.environ.get("WEB_CONCURRENCY"):
+        return max(int(os.environ["WEB_CONCURRENCY"]), 1)
+    try:
+        return max(len(os.sched_getaffinity(0)), 1)
+    except AttributeError:  # bukan Linux
+        return os.cpu_count() or 1
+
+
+def available(module: str) -> bool:
+    return importlib.util.find_spec(module) is not None
+
+
+def load_app():
+    """Import aplikasi di master (preload); dipanggil sebelum fork."""
+    import server
+    if server.EXPORT_PREWARM:
+        for module in server.LAZY_MODULES:
+            importlib.import_module(module)
+    return server.app
+
+
+def uvicorn_options(args) -> dict:
+    return {
+        "loop": "auto",
+        "http": "auto",
+        "timeout_graceful_shutdown": args.graceful_timeout,
+        "timeout_keep_alive": args.keepalive,
+        "backlog": args.backlog,
+        "access_log": args.access_log,
+        "forwarded_allow_ips": args.forwarded_allow_ips,
+        "limit_max_requests": args.max_requests or None,
+    }
+
+
+def run_single(args):
+    import uvicorn
+    uvicorn.run(load_app(), host=args.host, port=args.port, **uvicorn_options(args))
+
+
+if UvicornWorker is not None:
+    class GracefulUvicornWorker(UvicornWorker):
+        """UvicornWorker (loop/http auto) yang membatasi drain koneksi saat shutdown."""
+
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            # Tanpa batas, uvicorn menunggu WebSocket yang terbuka sampai master mengirim SIGKILL
+            self.config.timeout_graceful_shutdown = max(self.cfg.graceful_timeout - SHUTDOWN_MARGIN, 1)
+
+
+def run_gunicorn(args, workers: int):
+    from gunicorn.app.base import BaseApplication
+
+    class Application(BaseApplication):
+        def load_config(self):
+            settings = {
+                "bind": f"{args.host}:{args.port}",
+                "workers": workers,
+                "worker_class": f"{__name__}.GracefulUvicornWorker",
+                "preload_app": True,
+                "graceful_timeout": args.graceful_timeout + SHUTDOWN_MARGIN,
+                "timeout": args.timeout,
+                "keepalive": args.keepalive,
+                "backlog": args.backlog,
+                "max_requests": args.max_requests,
+                "max_requests_jitter": args.max_requests // 10,
+                "forwarded_allow_ips": args.forwarded_allow_ips,
+                "accesslog": "-" if args.access_log else None,
+            }
+            for key, value in settings.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return load_app()
+
+    Application().run()
+
+
+def bind_reuse_port(host: str, port: int, backlog: int) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    return sock
+
+
+def serve_reuse_port_worker(app, args):
+    import uvicorn
+    # Socket sendiri per worker: kernel membagi koneksi baru rata ke semua worker,
+    # tanpa accept() berebut di satu socket bersama
+    sock = bind_reuse_port(args.host, args.port, args.backlog)
+    server = uvicorn.Server(uvicorn.Config(app, **uvicorn_options(args)))
+    server.run(sockets=[sock])
+
+
+def run_reuse_port(args, workers: int) -> int:
+    if not hasattr(socket, "SO_REUSEPORT"):
+        logger.error("SO_REUSEPORT tidak didukung di platform ini")
+        return 2
+    app = load_app()
+    # Gagal cepat di master jika port sudah dipakai proses lain (tanpa SO_REUSEPORT)
+    bind_reuse_port(args.host, args.port, args.backlog).close()
+
+    children = {}
+    stopping = False
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            code = 0
+            try:
+                serve_reuse_port_worker(app, args)
+            except BaseException:
+                logger.exception("Worker %s gagal", os.getpid())
+                code = 1
+            finally:
+                logging.shutdown()
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(code)
+        children[pid] = time.monotonic()
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for _ in range(workers):
+        spawn()
+
+    exit_code = 0
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        started = children.pop(pid, None)
+        if started is None or stopping:
+            continue
+        logger.warning("Worker %s berhenti (status %s)", pid, status)
+        if time.monotonic() - started < MIN_WORKER_UPTIME:
+            logger.error("Worker gagal saat start, menghentikan semua worker")
+            exit_code = 1
+            stop(signal.SIGTERM, None)
+            continue
+        spawn()
+    return exit_code
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Jalankan API dengan beberapa worker uvicorn.")
+    parser.add_argument("--host", default=os.environ.get("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Jumlah worker (default: WEB_CONCURRENCY atau jumlah CPU)")
+    parser.add_argument("--reuse-port", action="store_true",
+                        help="Tiap worker bind sendiri dengan SO_REUSEPORT, tanpa gunicorn (Linux)")
+    parser.add_argument("--graceful-timeout", type=int, default=20,
+                        help="Detik menunggu request/WebSocket berjalan saat shutdown")
+    parser.add_argument("--timeout", type=int, default=60, help="Worker gunicorn yang diam selama ini di-restart")
+    parser.add_argument("--keepalive", type=int, default=5)
+    parser.add_argument("--backlog", type=int, default=2048)
+    parser.add_argument("--max-requests", type=int, default=0,
+                        help="Restart worker setelah N request (0 = tidak pernah)")
+    parser.add_argument("--forwarded-allow-ips", default=os.environ.get("FORWARDED_ALLOW_IPS", "127.0.0.1"))
+    parser.add_argument("--access-log", action="store_true", help="Tulis access log per request")
+    args = parser.parse_args(argv)
+
+    workers = args.workers or default_workers()
+    loop = "uvloop" if available("uvloop") else "asyncio"
+    http = "httptools" if available("httptools") else "h11"
+    if args.reuse_port:
+        mode = "SO_REUSEPORT"
+    elif workers == 1:
+        mode = "single"
+    elif UvicornWorker is not None:
+        mode = "gunicorn"
+    else:
+        mode = "uvicorn"
+    print(f"[SERVE] {workers} worker ({mode}), loop {loop}, http {http}, http://{args.host}:{args.port}", flush=True)
+
+    if mode == "SO_REUSEPORT":
+        return run_reuse_port(args, workers)
+    if mode == "single":
+        run_single(args)
+    elif mode == "gunicorn":
+        run_gunicorn(args, workers)
+    else:
+        # Tanpa gunicorn (Windows): uvicorn men-spawn worker, aplikasi di-import ulang per worker
+        import uvicorn
+        logger.warning("gunicorn tidak terpasang: worker di-spawn tanpa preload")
+        uvicorn.run("server:app", host=args.host, port=args.port, workers=workers, **uvicorn_options(args))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,12 +1,16 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, UploadFile, File, Request, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, UploadFile, File, Request, WebSocket, WebSocketDisconnect, BackgroundTasks
 from fastapi.staticfiles import StaticFiles
 from fastapi.exceptions import RequestValidationError
 from fastapi.responses import JSONResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from fastapi.responses import StreamingResponse, FileResponse
+from fastapi.responses import StreamingResponse, FileResponse, Response
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
+from starlette.datastructures import Headers
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument, InsertOne, UpdateOne, ReplaceOne, monitoring
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+from concurrent.futures import ProcessPoolExecutor
 import os
 import logging
 import bcrypt # Added for fix
@@ -16,31 +20,159 @@ from pathlib import Path
 if not hasattr(bcrypt, "__about__"):
     bcrypt.__about__ = type("About", (object,), {"__version__": bcrypt.__version__})
 
-from pydantic import BaseModel, Field, ConfigDict, EmailStr
+from pydantic import BaseModel, Field, ConfigDict, EmailStr, ValidationError, create_model
 from typing import List, Optional, Annotated
 import uuid
 import sys
-from datetime import datetime, timezone, timedelta
+from datetime import date, datetime, timezone, timedelta
+from zoneinfo import ZoneInfo
 from passlib.context import CryptContext
 from jose import JWTError, jwt
 from io import BytesIO
-import pandas as pd
-from reportlab.lib.pagesizes import A4
-from reportlab.lib import colors
-from reportlab.lib.units import inch
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Image
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.enums import TA_CENTER, TA_LEFT, TA_RIGHT
-from reportlab.lib.pagesizes import A4, letter
 import mimetypes
+import json
+import calendar
+import hashlib
+import tempfile
+import re
+from difflib import SequenceMatcher
+import csv
+import codecs
+import io
+import zipfile
+from xml.etree import ElementTree
+import asyncio
+import threading
+import time
+import inspect
+import importlib
+import math
+from collections import OrderedDict
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    """Statistik pool koneksi Mongo per client: lama menunggu koneksi, koneksi terpakai, timeout.
+
+    Event check-out dipanggil berurutan di thread yang sama (thread executor Motor),
+    jadi waktu mulai menunggu cukup disimpan per thread.
+    """
+    WAIT_BUCKETS_MS = (1, 5, 25, 100, 500)
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        # Gauge (keadaan pool saat ini), tidak ikut di-reset
+        self.in_use = 0
+        self.open = 0
+        self.reset()
+
+    def reset(self):
+        """Nolkan counter kumulatif (checkout, waktu tunggu, kegagalan)."""
+        with self._lock:
+            self.checkouts = 0
+            self.wait_total_ms = 0.0
+            self.wait_max_ms = 0.0
+            self.wait_buckets = [0] * (len(self.WAIT_BUCKETS_MS) + 1)
+            self.failures = {}
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            labels = [f"<{b}ms" for b in self.WAIT_BUCKETS_MS] + [f">={self.WAIT_BUCKETS_MS[-1]}ms"]
+            return {
+                "checkouts": self.checkouts,
+                "wait_avg_ms": round(self.wait_total_ms / self.checkouts, 3) if self.checkouts else 0,
+                "wait_max_ms": round(self.wait_max_ms, 3),
+                "wait_histogram": dict(zip(labels, self.wait_buckets)),
+                "checkout_failures": dict(self.failures),
+                "in_use": self.in_use,
+                "open": self.open,
+            }
+
+    def connection_check_out_started(self, event):
+        self._local.started = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        waited = (time.perf_counter() - getattr(self._local, "started", time.perf_counter())) * 1000
+        with self._lock:
+            self.checkouts += 1
+            self.in_use += 1
+            self.wait_total_ms += waited
+            self.wait_max_ms = max(self.wait_max_ms, waited)
+            self.wait_buckets[next((i for i, b in enumerate(self.WAIT_BUCKETS_MS) if waited < b), len(self.WAIT_BUCKETS_MS))] += 1
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self.failures[event.reason] = self.failures.get(event.reason, 0) + 1
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.in_use -= 1
+
+    def connection_created(self, event):
+        with self._lock:
+            self.open += 1
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.open -= 1
+
+    def connection_ready(self, event):
+        pass
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+# Opsi pool dari environment: <PREFIX>_MAX_POOL_SIZE, _MIN_POOL_SIZE, _MAX_IDLE_TIME_MS,
+# _MAX_CONNECTING, _WAIT_QUEUE_TIMEOUT_MS (PREFIX = MONGO untuk OLTP, REPORT_MONGO untuk laporan)
+MONGO_POOL_ENV = [("MAX_POOL_SIZE", "maxPoolSize"), ("MIN_POOL_SIZE", "minPoolSize"), ("MAX_IDLE_TIME_MS", "maxIdleTimeMS"),
+                  ("MAX_CONNECTING", "maxConnecting"), ("WAIT_QUEUE_TIMEOUT_MS", "waitQueueTimeoutMS")]
+
+def mongo_pool_options(prefix: str, **defaults) -> dict:
+    options = dict(defaults)
+    for env, option in MONGO_POOL_ENV:
+        value = os.environ.get(f"{prefix}_{env}")
+        if value:
+            options[option] = int(value)
+    return options
+
+# Laporan boleh dibaca dari secondary (REPORT_READ_PREFERENCE) dengan batas ketertinggalan
+# REPORT_MAX_STALENESS detik (minimal 90 menurut spesifikasi driver; <= 0 = tanpa batas)
+REPORT_READ_PREFERENCE = os.environ.get("REPORT_READ_PREFERENCE", "secondaryPreferred")
+REPORT_MAX_STALENESS = int(os.environ.get("REPORT_MAX_STALENESS", "90"))
+oltp_pool_metrics = PoolMetrics("oltp")
+report_pool_metrics = PoolMetrics("report")
+
+def make_report_client(url: str) -> AsyncIOMotorClient:
+    options = {"readPreference": REPORT_READ_PREFERENCE}
+    if REPORT_READ_PREFERENCE != "primary" and REPORT_MAX_STALENESS > 0:
+        options["maxStalenessSeconds"] = REPORT_MAX_STALENESS
+    return AsyncIOMotorClient(url, tz_aware=True, event_listeners=[report_pool_metrics], **options,
+                              **mongo_pool_options("REPORT_MONGO", maxPoolSize=20))
+
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+# Dua client dengan pool terpisah: OLTP (login, tagihan, pembayaran) selalu ke primary,
+# sedangkan laporan/analitik yang berat memakai report_client sehingga rekap kelas yang
+# lama tidak menghabiskan koneksi untuk login. REPORT_MONGO_URL opsional (default sama).
+# tz_aware: tanggal disimpan sebagai BSON date (UTC) dan dibaca kembali sebagai datetime aware.
+# Motor baru membuka koneksi saat query pertama, jadi modul ini aman di-preload sebelum fork (serve.py).
+client = AsyncIOMotorClient(mongo_url, tz_aware=True, event_listeners=[oltp_pool_metrics],
+                            **mongo_pool_options("MONGO", maxPoolSize=100))
 db = client[os.environ['DB_NAME']]
+report_client = make_report_client(os.environ.get('REPORT_MONGO_URL', mongo_url))
+report_db = report_client[os.environ['DB_NAME']]
 
 # Create the main app without a prefix
 app = FastAPI()
@@ -65,6 +197,13 @@ pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 SECRET_KEY = os.environ.get("SECRET_KEY", "your-secret-key-change-this")
 ALGORITHM = "HS256"
 
+# Sekolah beroperasi di WIB: batas hari/bulan/tahun laporan dihitung di zona ini
+SCHOOL_TZ = ZoneInfo(os.environ.get("SCHOOL_TZ", "Asia/Jakarta"))
+
+# Urutan bulan untuk sorting di pipeline agregasi (field bulan disimpan sebagai nama)
+BULAN = ["Januari", "Februari", "Maret", "April", "Mei", "Juni",
+         "Juli", "Agustus", "September", "Oktober", "November", "Desember"]
+
 # Connection Manager for WebSockets
 class ConnectionManager:
     def __init__(self):
@@ -87,9 +226,27 @@ class ConnectionManager:
     def get_online_users(self):
         return list(self.active_connections.keys())
 
+    async def send_to_user(self, user_id: str, message: dict):
+        """Kirim pesan JSON ke semua koneksi user (mis. progres import/export)."""
+        for websocket in list(self.active_connections.get(user_id, ())):
+            try:
+                await websocket.send_json(message)
+            except Exception:
+                self.disconnect(user_id, websocket)
+
     def is_user_online(self, user_id: str):
         return user_id in self.active_connections
 
+    async def close_all(self, code: int = 1012):
+        """Tutup semua sesi saat worker berhenti (1012 = service restart); frontend menyambung ulang."""
+        for user_id, sockets in list(self.active_connections.items()):
+            for websocket in list(sockets):
+                try:
+                    await websocket.close(code=code)
+                except Exception:
+                    pass
+                self.disconnect(user_id, websocket)
+
 manager = ConnectionManager()
 
 # Utility functions
@@ -102,6 +259,73 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
 def create_token(data: dict) -> str:
     return jwt.encode(data, SECRET_KEY, algorithm=ALGORITHM)
 
+def student_snapshot(student: dict) -> dict:
+    """Data siswa yang ikut disimpan di dokumen tagihan/pembayaran agar listing tidak perlu join."""
+    return {"nama": student["nama"], "nis": student["nis"], "kelas": student["kelas"]}
+
+def to_local(value) -> datetime:
+    """Tanggal dari DB (datetime atau string ISO data lama) -> datetime di zona waktu sekolah."""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(SCHOOL_TZ)
+
+def local_range(start: datetime, end: datetime):
+    """Rentang [start, end) dalam waktu lokal sekolah, siap dipakai di query $gte/$lt."""
+    return start.replace(tzinfo=SCHOOL_TZ), end.replace(tzinfo=SCHOOL_TZ)
+
+def local_day_range(day: datetime):
+    start = datetime(day.year, day.month, day.day)
+    return local_range(start, start + timedelta(days=1))
+
+def local_month_range(year: int, month: int):
+    start = datetime(year, month, 1)
+    end = datetime(year + 1, 1, 1) if month == 12 else datetime(year, month + 1, 1)
+    return local_range(start, end)
+
+def json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+async def stream_json_list(cursor, chunk_size: int = 500):
+    """Kirim hasil cursor sebagai JSON array sedikit demi sedikit, tanpa menampung semuanya di memori."""
+    yield "["
+    buffer = []
+    first = True
+    async for doc in cursor:
+        buffer.append(json.dumps(doc, default=json_default))
+        if len(buffer) >= chunk_size:
+            yield ("" if first else ",") + ",".join(buffer)
+            first = False
+            buffer = []
+    if buffer:
+        yield ("" if first else ",") + ",".join(buffer)
+    yield "]"
+
+# Renderer PDF/XLSX (reportlab, pandas, numpy) ada di report_render / report_analytics dan
+# baru di-import saat dipakai, supaya start worker tidak membayar ~0,3 detik import + memorinya.
+# EXPORT_PREWARM=1 meng-import keduanya di background setelah startup (export pertama tidak lambat).
+LAZY_MODULES = ("report_render", "report_analytics")
+EXPORT_PREWARM = os.environ.get("EXPORT_PREWARM", "0").lower() in ("1", "true", "yes")
+
+async def run_lazy(module: str, func: str, *args):
+    """Panggil module.func(*args) di thread; import pertama modul juga terjadi di thread itu."""
+    def call():
+        return getattr(importlib.import_module(module), func)(*args)
+    return await asyncio.to_thread(call)
+
+async def prewarm_lazy_modules():
+    started = time.perf_counter()
+    for module in LAZY_MODULES:
+        try:
+            await asyncio.to_thread(importlib.import_module, module)
+        except Exception:
+            logging.exception("[EXPORT] Prewarm %s gagal", module)
+            return
+    logging.info("[EXPORT] Modul export siap dalam %.0f ms", (time.perf_counter() - started) * 1000)
+
 security = HTTPBearer()
 
 async def get_current_user(credentials: Annotated[HTTPAuthorizationCredentials, Depends(security)]):
@@ -122,7 +346,6 @@ async def log_activity(username: str, role: str, activity_type: str, description
         ip_address=ip_address
     )
     doc = log.model_dump()
-    doc['timestamp'] = doc['timestamp'].isoformat()
     await db.activity_logs.insert_one(doc)
     
     # Also log to console for visibility
@@ -167,6 +390,7 @@ class Bill(BaseModel):
     tahun: int
     jumlah: float
     status: str = "belum"  # belum, menunggu_konfirmasi, lunas
+    siswa: Optional[dict] = None  # snapshot {nama, nis, kelas}, disinkronkan saat data siswa berubah
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class Payment(BaseModel):
@@ -181,6 +405,8 @@ class Payment(BaseModel):
     receipt_path: Optional[str] = None
     nama_pengirim: str = "" 
     bank_asal: str = ""
+    siswa: Optional[dict] = None  # snapshot {nama, nis, kelas}
+    tagihan: Optional[dict] = None  # snapshot {bulan, tahun} dari tagihan (tidak pernah berubah)
 
 class SchoolProfile(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -249,6 +475,14 @@ class BillGenerate(BaseModel):
 class BillConfirm(BaseModel):
     status: str
 
+class BillBatchConfirm(BaseModel):
+    ids: List[str]
+    status: str = "lunas"
+
+class MonthClose(BaseModel):
+    bulan: str
+    tahun: int
+
 class PaymentCreate(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id_tagihan: str
@@ -305,157 +539,8 @@ async def get_payment_receipt(bill_id: str):
         }
 
     # 5. Buat PDF
-    buffer = BytesIO()
-    # Half-Letter Landscape (8.5 x 5.5 inch)
-    doc = SimpleDocTemplate(buffer, pagesize=(8.5*inch, 5.5*inch), leftMargin=0.4*inch, rightMargin=0.4*inch, topMargin=0.3*inch, bottomMargin=0.3*inch)
-    elements = []
-    
-    styles = getSampleStyleSheet()
-    
-    # Define styles with Courier (Monospace)
-    f_bold = 'Courier-Bold'
-    f_norm = 'Courier'
-    
-    header_style = ParagraphStyle('Header', fontSize=12, alignment=TA_CENTER, fontName=f_bold, leading=14)
-    addr_style = ParagraphStyle('Addr', fontSize=9, alignment=TA_CENTER, fontName=f_norm, leading=11)
-    title_style = ParagraphStyle('Title', fontSize=11, alignment=TA_CENTER, fontName=f_bold, spaceBefore=2, spaceAfter=2)
-    
-    label_style = ParagraphStyle('Label', fontSize=9, fontName=f_norm)
-    value_style = ParagraphStyle('Value', fontSize=9, fontName=f_bold)
-    
-    table_header = ParagraphStyle('THeader', fontSize=9, fontName=f_bold, alignment=TA_CENTER)
-    table_cell = ParagraphStyle('TCell', fontSize=9, fontName=f_norm)
-    table_right = ParagraphStyle('TRight', fontSize=9, fontName=f_norm, alignment=TA_RIGHT)
-    table_bold_right = ParagraphStyle('TBoldRight', fontSize=9, fontName=f_bold, alignment=TA_RIGHT)
-    
-    footer_style = ParagraphStyle('Footer', fontSize=9, fontName=f_norm, alignment=TA_CENTER)
-
-    def p(text, style):
-        return Paragraph(str(text), style)
-
-    # --- 1. Header with Logo ---
-    logo_path = uploads_dir / "logo.png"
-    if logo_path.exists():
-        # Create a table for header: [Logo, School Info]
-        logo_img = Image(str(logo_path), width=0.7*inch, height=0.7*inch)
-        
-        school_info = [
-            [p(school['nama_sekolah'].upper(), header_style)],
-            [p(school['alamat'], addr_style)],
-            [p(f"Telp: {school['no_telp']}", addr_style)]
-        ]
-        info_table = Table(school_info, colWidths=[6.5*inch])
-        info_table.setStyle(TableStyle([
-            ('ALIGN', (0,0), (-1,-1), 'CENTER'),
-            ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
-        ]))
-        
-        header_table = Table([[logo_img, info_table]], colWidths=[0.8*inch, 6.7*inch])
-        header_table.setStyle(TableStyle([
-            ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
-        ]))
-        elements.append(header_table)
-    else:
-        elements.append(p(school['nama_sekolah'].upper(), header_style))
-        elements.append(p(school['alamat'], addr_style))
-        elements.append(p(f"Telp: {school['no_telp']}", addr_style))
-    
-    # Separator Line
-    line_str = "-" * 85
-    elements.append(p(line_str, addr_style))
-    
-    # --- 2. Title ---
-    elements.append(p("BUKTI PEMBAYARAN", title_style))
-    
-    # --- 3. Info Section (Two Columns) ---
-    # Convert ISO date if needed
-    tgl_bayar = payment['tanggal_bayar']
-    if isinstance(tgl_bayar, str):
-        try:
-            tgl_dt = datetime.fromisoformat(tgl_bayar.replace('Z', '+00:00'))
-            tgl_str = tgl_dt.strftime('%d-%m-%Y %H:%M:%S')
-        except:
-            tgl_str = tgl_bayar
-    else:
-        tgl_str = tgl_bayar.strftime('%d-%m-%Y %H:%M:%S')
-
-    info_data = [
-        [p("No Transaksi", label_style), p(":", label_style), p(payment['id'][:12].upper(), value_style), 
-         p("", label_style), # gap
-         p("Tanggal", label_style), p(":", label_style), p(tgl_str, value_style)],
-        
-        [p("No Induk", label_style), p(":", label_style), p(student['nis'], value_style), 
-         p("", label_style), # gap
-         p("Kelas", label_style), p(":", label_style), p(student['kelas'], value_style)],
-        
-        [p("Nama", label_style), p(":", label_style), p(student['nama'], value_style), 
-         p("", label_style), p("", label_style), p("", label_style), p("", label_style)],
-    ]
-    
-    info_table = Table(info_data, colWidths=[1.1*inch, 0.1*inch, 2.5*inch, 0.5*inch, 0.8*inch, 0.1*inch, 2.5*inch])
-    info_table.setStyle(TableStyle([
-        ('VALIGN', (0,0), (-1,-1), 'TOP'),
-        ('LEFTPADDING', (0,0), (-1,-1), 0),
-        ('BOTTOMPADDING', (0,0), (-1,-1), 0),
-        ('TOPPADDING', (0,0), (-1,-1), 0),
-    ]))
-    elements.append(info_table)
-    elements.append(p(line_str, addr_style)) # Line after info
-    
-    # --- 4. Items Table ---
-    # Reduced spacing to ensure one page
-    item_data = [
-        [p("No", table_header), p("Nama Pembayaran", table_header), p("Nominal", table_header)],
-        [p("1", table_cell), p(f"BIAYA SPP {bill['tahun']} Bulan {bill['bulan']}", table_cell), p(f"{bill['jumlah']:,.0f}", table_right)],
-    ]
-    
-    item_table = Table(item_data, colWidths=[0.5*inch, 5.5*inch, 1.6*inch])
-    item_table.setStyle(TableStyle([
-        ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
-        ('LINEBELOW', (0,0), (-1,0), 0.5, colors.black),
-        ('TOPPADDING', (0,0), (-1,-1), 2),
-        ('BOTTOMPADDING', (0,0), (-1,-1), 2),
-    ]))
-    elements.append(item_table)
-    elements.append(p(line_str, addr_style))
-    
-    # --- 5. Totals Section ---
-    total_data = [
-        [p("", table_cell), p("Total   :", table_bold_right), p(f"{bill['jumlah']:,.0f}", table_bold_right)],
-        [p("", table_cell), p("Tunai   :", table_cell), p(f"{bill['jumlah']:,.0f}", table_right)],
-        [p("", table_cell), p("Kembali :", table_cell), p("0", table_right)],
-    ]
-    total_table = Table(total_data, colWidths=[5.0*inch, 1.0*inch, 1.6*inch])
-    total_table.setStyle(TableStyle([
-        ('ALIGN', (1,0), (-1,-1), 'RIGHT'),
-        ('LEFTPADDING', (0,0), (-1,-1), 0),
-        ('BOTTOMPADDING', (0,0), (-1,-1), 0),
-        ('TOPPADDING', (0,0), (-1,-1), 0),
-    ]))
-    elements.append(total_table)
-    elements.append(p(line_str, addr_style))
-    
-    # --- 6. Signature Section ---
-    # Signature moved up and made more compact
-    elements.append(Spacer(1, 0.1*inch))
-    
-    tgl_now = datetime.now().strftime('%d-%m-%Y')
-    sig_data = [
-        ["", p(f"Indonesia, {tgl_now}", footer_style)],
-        ["", p("Petugas", footer_style)],
-        ["", Spacer(1, 0.2*inch)], # reduced from 0.3
-        ["", p("Admin", footer_style)],
-    ]
-    
-    sig_table = Table(sig_data, colWidths=[5.5*inch, 1.8*inch])
-    sig_table.setStyle(TableStyle([
-        ('ALIGN', (1,0), (1,-1), 'CENTER'),
-    ]))
-    elements.append(sig_table)
-    
-    doc.build(elements)
-    buffer.seek(0)
-    return StreamingResponse(buffer, media_type="application/pdf", headers={"Content-Disposition": f"attachment; filename=kuitansi_{student['nis']}_{bill['bulan']}_{bill['tahun']}.pdf"})
+    pdf = await run_lazy("report_render", "receipt_pdf", bill, payment, student, school, uploads_dir / "logo.png", SCHOOL_TZ)
+    return StreamingResponse(BytesIO(pdf), media_type="application/pdf", headers={"Content-Disposition": f"attachment; filename=kuitansi_{student['nis']}_{bill['bulan']}_{bill['tahun']}.pdf"})
 
 @api_router.put("/classes/{class_id}")
 async def update_class(class_id: str, class_data: ClassUpdate):
@@ -465,6 +550,7 @@ async def update_class(class_id: str, class_data: ClassUpdate):
     
     updated_data = class_data.model_dump()
     await db.classes.update_one({"id": class_id}, {"$set": updated_data})
+    await bump_data_version("classes")
     return {"message": "Kelas berhasil diupdate"}
 
 @api_router.delete("/classes/{class_id}")
@@ -477,11 +563,276 @@ async def delete_class(class_id: str):
     result = await db.classes.delete_one({"id": class_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Kelas tidak ditemukan")
+    await bump_data_version("classes")
     return {"message": "Kelas berhasil dihapus"}
 
 
+async def ensure_indexes():
+    for collection in ("students", "bills", "payments"):
+        try:
+            await db[collection].create_index("id", unique=True)
+        except OperationFailure as e:
+            # Data lama bisa berisi id ganda: server tetap jalan dengan index biasa
+            logging.warning(f"[INDEX] Index unik {collection}.id gagal dibuat (ada id ganda?): {e}")
+            await db[collection].create_index("id")
+    await db.bills.create_index([("status", 1), ("id_siswa", 1)])
+    await db.bills.create_index("id_siswa")
+    await db.payments.create_index("id_tagihan")
+    try:
+        # Paling banyak satu pembayaran pending per tagihan (penjaga terakhir create_payment)
+        await db.payments.create_index([("id_tagihan", 1), ("status", 1)], name="satu_pending_per_tagihan",
+                                       unique=True, partialFilterExpression={"status": "pending"})
+    except OperationFailure as e:
+        logging.warning(f"[INDEX] Index satu_pending_per_tagihan gagal dibuat (ada pembayaran pending ganda?): {e}")
+    await db.payments.create_index("receipt_sha256", sparse=True)
+    await db.payments.create_index([("id_siswa", 1), ("status", 1)])
+    await db.payments.create_index("tanggal_bayar")
+    await db.payments.create_index([("status", 1), ("tanggal_bayar", 1)])
+    await db.login_logs.create_index([("ip_address", 1), ("status", 1), ("timestamp", -1)])
+    await db.login_logs.create_index([("timestamp", -1)])
+    await db.activity_logs.create_index([("timestamp", -1)])
+    await db.student_accounts.create_index("id_siswa", unique=True)
+    await db.student_accounts.create_index("tagihan.belum.bulan")
+    await db.export_jobs.create_index("id", unique=True)
+    await db.export_jobs.create_index([("user_id", 1), ("created_at", -1)])
+    await db.export_jobs.create_index([("status", 1), ("heartbeat_at", 1)])
+    await db.report_snapshots.create_index("file_ids")
+    if RATE_LIMIT_BACKEND == "mongo":
+        await db.rate_limits.create_index("expires_at", expireAfterSeconds=0)
+
+# Versi data per koleksi (koleksi data_versions). Dinaikkan setiap kali koleksi
+# ditulis; hasil laporan yang di-cache disimpan bersama versinya sehingga cukup
+# dibandingkan, tanpa TTL, dan tetap benar meski server berjalan multi-worker.
+async def bump_data_version(*collections: str):
+    for name in collections:
+        await db.data_versions.update_one({"_id": name}, {"$inc": {"version": 1}}, upsert=True)
+
+async def get_data_version(*collections: str) -> tuple:
+    versions = {d["_id"]: d["version"] async for d in db.data_versions.find({"_id": {"$in": list(collections)}})}
+    return tuple(versions.get(name, 0) for name in collections)
+
+def report_cache_expired(entry: dict) -> bool:
+    # Hasil yang dibaca dari secondary bisa lebih tua dari versi datanya: umurnya dibatasi
+    if REPORT_READ_PREFERENCE == "primary":
+        return False
+    return time.monotonic() - entry["at"] > (REPORT_MAX_STALENESS if REPORT_MAX_STALENESS > 0 else 90)
+
+# Cache respons endpoint baca (dashboard, laporan bulanan, rekap kelas) per proses.
+# Key: route + query param + role; entri menyimpan versi data koleksi yang dibacanya
+# dan dianggap basi begitu salah satu versinya naik. Ukuran dibatasi jumlah entri dan
+# perkiraan byte (panjang JSON), entri yang paling lama tidak dipakai dibuang dulu.
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", "256"))
+RESPONSE_CACHE_MAX_BYTES = int(float(os.environ.get("RESPONSE_CACHE_MAX_MB", "32")) * 1024 * 1024)
+
+class ResponseCache:
+    """LRU {key: entri} dengan statistik hit/miss per route."""
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries, self.max_bytes = max_entries, max_bytes
+        self.entries: OrderedDict = OrderedDict()
+        self.bytes = 0
+        self.reset()
+
+    def reset(self):
+        self.stats = {}
+
+    def clear(self):
+        self.entries.clear()
+        self.bytes = 0
+
+    def _count(self, route: str, field: str):
+        counters = self.stats.setdefault(route, {"hits": 0, "misses": 0, "stale": 0, "evictions": 0})
+        counters[field] += 1
+
+    def _drop(self, key) -> dict:
+        entry = self.entries.pop(key)
+        self.bytes -= entry["size"]
+        return entry
+
+    def get(self, key: tuple, version: tuple):
+        entry = self.entries.get(key)
+        if entry is None:
+            self._count(key[0], "misses")
+            return None
+        if entry["version"] != version or report_cache_expired(entry):
+            self._drop(key)
+            self._count(key[0], "stale")
+            self._count(key[0], "misses")
+            return None
+        self.entries.move_to_end(key)
+        self._count(key[0], "hits")
+        return entry["value"]
+
+    def put(self, key: tuple, version: tuple, value):
+        size = len(json.dumps(value, default=str))
+        if size > self.max_bytes:
+            return
+        if key in self.entries:
+            self._drop(key)
+        self.entries[key] = {"version": version, "value": value, "size": size, "at": time.monotonic()}
+        self.bytes += size
+        while len(self.entries) > self.max_entries or self.bytes > self.max_bytes:
+            oldest = next(iter(self.entries))
+            self._drop(oldest)
+            self._count(oldest[0], "evictions")
+
+    def snapshot(self) -> dict:
+        routes = {}
+        for route, counters in self.stats.items():
+            lookups = counters["hits"] + counters["misses"]
+            routes[route] = {**counters, "hit_ratio": round(counters["hits"] / lookups, 3) if lookups else 0}
+        return {
+            "entries": len(self.entries),
+            "bytes": self.bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "routes": routes,
+        }
+
+response_cache = ResponseCache(RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_MAX_BYTES)
+
+async def cached_response(route: str, params: dict, role: str, collections: tuple, compute):
+    """Kembalikan hasil compute() dari cache selama versi `collections` tidak berubah."""
+    if response_cache.max_entries <= 0:
+        return await compute()
+    key = (route, role, tuple(sorted((k, v) for k, v in params.items() if v is not None)))
+    # Versi dibaca sebelum compute: penulisan yang terjadi selama compute membuat entri ini basi
+    version = await get_data_version(*collections)
+    value = response_cache.get(key, version)
+    if value is None:
+        value = await compute()
+        response_cache.put(key, version, value)
+    return value
+
+# Ringkasan akun per siswa (koleksi student_accounts): total tagihan per status,
+# total dibayar dan tanggal bayar terakhir. Diperbarui dengan $inc setiap kali
+# status tagihan/pembayaran berubah, sehingga laporan siswa & dashboard tidak
+# perlu menjumlah ulang seluruh tagihan.
+BILL_STATUSES = ("belum", "menunggu_konfirmasi", "lunas")
+
+# Cache /student/{id}/overview per proses (LRU, seperti response_cache). Entri disimpan
+# bersama versi data siswa tersebut di data_versions ("student_overview:<id>") plus versi
+# global "student_overview", jadi penulisan di worker mana pun langsung membuatnya basi.
+# Invalidasi harus dipanggil *setelah* penulisan ke database.
+OVERVIEW_CACHE_MAX_ENTRIES = int(os.environ.get("OVERVIEW_CACHE_MAX_ENTRIES", "2048"))
+OVERVIEW_CACHE_MAX_BYTES = int(float(os.environ.get("OVERVIEW_CACHE_MAX_MB", "16")) * 1024 * 1024)
+overview_cache = ResponseCache(OVERVIEW_CACHE_MAX_ENTRIES, OVERVIEW_CACHE_MAX_BYTES)
+
+async def invalidate_student_overview(*student_ids: str):
+    """Naikkan versi overview siswa tertentu; tanpa argumen semua overview dianggap basi."""
+    if not student_ids:
+        overview_cache.clear()
+        await bump_data_version("student_overview")
+        return
+    for sid in student_ids:
+        overview_cache.entries.pop(("student_overview", sid), None)
+    ops = [UpdateOne({"_id": f"student_overview:{sid}"}, {"$inc": {"version": 1}}, upsert=True) for sid in set(student_ids)]
+    for i in range(0, len(ops), 1000):
+        await db.data_versions.bulk_write(ops[i:i + 1000], ordered=False)
+
+async def account_add_bills(bills: list):
+    now = datetime.now(timezone.utc)
+    ops = [
+        UpdateOne(
+            {"id_siswa": b["id_siswa"]},
+            {"$inc": {f"tagihan.{b['status']}.bulan": 1, f"tagihan.{b['status']}.nominal": b["jumlah"]},
+             "$set": {"updated_at": now}},
+            upsert=True,
+        )
+        for b in bills
+    ]
+    if ops:
+        await db.student_accounts.bulk_write(ops, ordered=False)
+    await invalidate_student_overview(*{b["id_siswa"] for b in bills})
+
+async def account_move_bill(bill: dict, old_status: str, new_status: str):
+    if old_status != new_status:
+        await db.student_accounts.update_one(
+            {"id_siswa": bill["id_siswa"]},
+            {"$inc": {f"tagihan.{old_status}.bulan": -1, f"tagihan.{old_status}.nominal": -bill["jumlah"],
+                      f"tagihan.{new_status}.bulan": 1, f"tagihan.{new_status}.nominal": bill["jumlah"]},
+             "$set": {"updated_at": datetime.now(timezone.utc)}},
+            upsert=True,
+        )
+    await invalidate_student_overview(bill["id_siswa"])
+
+async def account_add_payment(id_siswa: str, jumlah: float, tanggal_bayar: datetime):
+    await db.student_accounts.update_one(
+        {"id_siswa": id_siswa},
+        {"$inc": {"total_dibayar": jumlah, "jumlah_pembayaran": 1},
+         "$max": {"pembayaran_terakhir": tanggal_bayar},
+         "$set": {"updated_at": datetime.now(timezone.utc)}},
+        upsert=True,
+    )
+    await invalidate_student_overview(id_siswa)
+
+async def set_bill_status(bill_id: str, new_status: str, extra_filter: Optional[dict] = None):
+    """Ubah status tagihan secara atomik dan sesuaikan ringkasan akun dengan status lamanya.
+
+    Mengembalikan tagihan *sebelum* diubah (None jika tidak ada yang cocok dengan filter).
+    Dari dua request yang berpacu, hanya satu yang melihat status lama != new_status.
+    """
+    before = await db.bills.find_one_and_update(
+        {"id": bill_id, **(extra_filter or {})},
+        {"$set": {"status": new_status}},
+        projection={"_id": 0, "id": 1, "id_siswa": 1, "jumlah": 1, "status": 1, "bulan": 1, "tahun": 1, "siswa": 1},
+        return_document=ReturnDocument.BEFORE,
+    )
+    if before:
+        await account_move_bill(before, before["status"], new_status)
+        if before["status"] != new_status:
+            await bump_data_version("bills")
+    return before
+
+async def rebuild_student_accounts() -> int:
+    """Hitung ulang seluruh student_accounts dari bills & payments (backfill / perbaikan drift)."""
+    accounts = {}
+    now = datetime.now(timezone.utc)
+    bill_pipeline = [{"$group": {"_id": {"id_siswa": "$id_siswa", "status": "$status"},
+                                 "bulan": {"$sum": 1}, "nominal": {"$sum": "$jumlah"}}}]
+    async for row in db.bills.aggregate(bill_pipeline, allowDiskUse=True):
+        acc = accounts.setdefault(row["_id"]["id_siswa"], {"tagihan": {}})
+        acc["tagihan"][row["_id"]["status"]] = {"bulan": row["bulan"], "nominal": row["nominal"]}
+    payment_pipeline = [
+        {"$match": {"status": "diterima"}},
+        {"$group": {"_id": "$id_siswa", "total": {"$sum": "$jumlah"}, "jumlah": {"$sum": 1},
+                    "terakhir": {"$max": "$tanggal_bayar"}}},
+    ]
+    async for row in db.payments.aggregate(payment_pipeline, allowDiskUse=True):
+        acc = accounts.setdefault(row["_id"], {"tagihan": {}})
+        acc.update(total_dibayar=row["total"], jumlah_pembayaran=row["jumlah"], pembayaran_terakhir=row["terakhir"])
+
+    ops = [ReplaceOne({"id_siswa": sid}, {"id_siswa": sid, **acc, "updated_at": now}, upsert=True)
+           for sid, acc in accounts.items()]
+    for i in range(0, len(ops), 1000):
+        await db.student_accounts.bulk_write(ops[i:i + 1000], ordered=False)
+    await db.student_accounts.delete_many({"id_siswa": {"$nin": list(accounts)}})
+    await bump_data_version("student_accounts")
+    await invalidate_student_overview()
+    return len(accounts)
+
+def account_summary(account: Optional[dict], status: Optional[str] = None) -> dict:
+    tagihan = (account or {}).get("tagihan", {})
+    statuses = [status] if status else list(tagihan)
+    total_tagihan = sum(tagihan.get(st, {}).get("nominal", 0) for st in statuses)
+    total_dibayar = (account or {}).get("total_dibayar", 0)
+    return {
+        "total_tagihan": total_tagihan,
+        "total_dibayar": total_dibayar,
+        "sisa_tagihan": total_tagihan - total_dibayar,
+        "bulan_tertunggak": tagihan.get("belum", {}).get("bulan", 0),
+        "pembayaran_terakhir": (account or {}).get("pembayaran_terakhir"),
+    }
+
 # Initialize database with default data
 async def init_db():
+    await ensure_indexes()
+
+    # Backfill ringkasan akun untuk data yang dibuat sebelum student_accounts ada
+    if not await db.student_accounts.find_one({}, {"_id": 1}) and await db.bills.find_one({}, {"_id": 1}):
+        count = await rebuild_student_accounts()
+        logging.info(f"[ACCOUNTS] {count} ringkasan akun siswa dibangun ulang")
+
     # Check if admin exists
     admin_exists = await db.users.find_one({"username": "admin"})
     if not admin_exists:
@@ -492,7 +843,6 @@ async def init_db():
             role="admin"
         )
         doc = admin_user.model_dump()
-        doc['created_at'] = doc['created_at'].isoformat()
         await db.users.insert_one(doc)
 
     # Check if kepsek exists
@@ -505,7 +855,6 @@ async def init_db():
             role="kepsek"
         )
         doc = kepsek_user.model_dump()
-        doc['created_at'] = doc['created_at'].isoformat()
         await db.users.insert_one(doc)
 
     # Check if sample class exists
@@ -518,7 +867,6 @@ async def init_db():
         ]
         for cls in classes:
             doc = cls.model_dump()
-            doc['created_at'] = doc['created_at'].isoformat()
             await db.classes.insert_one(doc)
 
     # Check if master exists
@@ -531,7 +879,6 @@ async def init_db():
             role="master"
         )
         doc = master_user.model_dump()
-        doc['created_at'] = doc['created_at'].isoformat()
         await db.users.insert_one(doc)
 
     # Check if school profile exists
@@ -539,7 +886,6 @@ async def init_db():
     if not profile_exists:
         profile = SchoolProfile()
         doc = profile.model_dump()
-        doc['updated_at'] = doc['updated_at'].isoformat()
         await db.school_profile.insert_one(doc)
 
 # Routes
@@ -554,7 +900,7 @@ async def login(request: LoginRequest, fastapi_request: Request):
     user_agent = fastapi_request.headers.get("user-agent", "unknown")
     
     # Check for suspicious activity (e.g., 5 failed attempts from same IP in last 5 mins)
-    five_mins_ago = (datetime.now(timezone.utc) - timedelta(minutes=5)).isoformat()
+    five_mins_ago = datetime.now(timezone.utc) - timedelta(minutes=5)
     recent_failures = await db.login_logs.count_documents({
         "ip_address": ip_address,
         "status": "failed",
@@ -575,7 +921,6 @@ async def login(request: LoginRequest, fastapi_request: Request):
             is_suspicious=is_suspicious
         )
         doc = log.model_dump()
-        doc['timestamp'] = doc['timestamp'].isoformat()
         return db.login_logs.insert_one(doc)
 
     async def log_and_raise_banned(u_role, u_id):
@@ -673,7 +1018,6 @@ async def create_staff(staff: StaffCreate, current_user: Annotated[dict, Depends
         role=staff.role
     )
     doc = new_staff.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
     await db.users.insert_one(doc)
     return {"message": "Akun staf berhasil dibuat", "id": new_staff.id}
 
@@ -789,6 +1133,91 @@ async def clear_activity_logs(current_user: Annotated[dict, Depends(get_current_
     await log_activity(username, "master", "security", "Membersihkan seluruh log aktivitas", user_id=current_user.get("user_id"))
     return {"message": "Log aktivitas berhasil dibersihkan"}
 
+# Konsistensi snapshot siswa di tagihan/pembayaran
+SNAPSHOT_COLLECTIONS = ("bills", "payments")
+
+async def check_student_snapshots(fix: bool = False) -> dict:
+    """Cari dokumen yang snapshot siswanya kosong/berbeda dari data siswa; opsional langsung diperbaiki."""
+    pipeline = [
+        {"$lookup": {"from": "students", "localField": "id_siswa", "foreignField": "id", "as": "_s"}},
+        {"$unwind": "$_s"},  # siswa yang sudah dihapus: snapshot terakhir dipertahankan
+        {"$project": {"_id": 0, "id_siswa": 1, "siswa": 1,
+                      "expected": {"nama": "$_s.nama", "nis": "$_s.nis", "kelas": "$_s.kelas"}}},
+        {"$match": {"$expr": {"$ne": [{"$ifNull": ["$siswa", None]}, "$expected"]}}},
+        {"$group": {"_id": "$id_siswa", "expected": {"$first": "$expected"}, "jumlah": {"$sum": 1}}},
+    ]
+    report = {}
+    for name in SNAPSHOT_COLLECTIONS:
+        collection = db[name]
+        drift = await collection.aggregate(pipeline, allowDiskUse=True).to_list(None)
+        fixed = 0
+        if fix:
+            for row in drift:
+                result = await collection.update_many({"id_siswa": row["_id"]}, {"$set": {"siswa": row["expected"]}})
+                fixed += result.modified_count
+        report[name] = {
+            "dokumen_tidak_sinkron": sum(row["jumlah"] for row in drift),
+            "siswa_terdampak": len(drift),
+            "diperbaiki": fixed,
+        }
+    return report
+
+@api_router.get("/master/consistency/student-snapshot")
+async def get_student_snapshot_consistency(current_user: Annotated[dict, Depends(get_current_user)]):
+    if current_user.get("role") != "master":
+        raise HTTPException(status_code=403, detail="Not authorized")
+    return await check_student_snapshots()
+
+@api_router.post("/master/consistency/student-snapshot/repair")
+async def repair_student_snapshots(current_user: Annotated[dict, Depends(get_current_user)]):
+    if current_user.get("role") != "master":
+        raise HTTPException(status_code=403, detail="Not authorized")
+    report = await check_student_snapshots(fix=True)
+    username = current_user.get("username", "master")
+    total = sum(r["diperbaiki"] for r in report.values())
+    await log_activity(username, "master", "system", f"Sinkronisasi snapshot siswa: {total} dokumen diperbaiki", user_id=current_user.get("user_id"))
+    return report
+
+@api_router.post("/master/consistency/student-accounts/rebuild")
+async def rebuild_accounts(current_user: Annotated[dict, Depends(get_current_user)]):
+    if current_user.get("role") != "master":
+        raise HTTPException(status_code=403, detail="Not authorized")
+    count = await rebuild_student_accounts()
+    username = current_user.get("username", "master")
+    await log_activity(username, "master", "system", f"Membangun ulang ringkasan akun {count} siswa", user_id=current_user.get("user_id"))
+    return {"message": f"Ringkasan akun {count} siswa berhasil dibangun ulang", "jumlah": count}
+
+@api_router.get("/master/db-pool")
+async def get_db_pool_stats(current_user: Annotated[dict, Depends(get_current_user)], reset: bool = False):
+    if current_user.get("role") != "master":
+        raise HTTPException(status_code=403, detail="Not authorized")
+    stats = {}
+    for name, mongo, metrics in (("oltp", client, oltp_pool_metrics), ("report", report_client, report_pool_metrics)):
+        pool = mongo.options.pool_options
+        stats[name] = {
+            **metrics.snapshot(),
+            "max_pool_size": pool.max_pool_size,
+            "min_pool_size": pool.min_pool_size,
+            "read_preference": mongo.read_preference.mongos_mode,
+            "max_staleness": mongo.read_preference.max_staleness,
+        }
+        if reset:
+            metrics.reset()
+    return stats
+
+@api_router.get("/master/response-cache")
+async def get_response_cache_stats(current_user: Annotated[dict, Depends(get_current_user)], reset: bool = False, clear: bool = False):
+    if current_user.get("role") != "master":
+        raise HTTPException(status_code=403, detail="Not authorized")
+    # Statistik per worker: dengan beberapa worker tiap proses punya cache sendiri
+    stats = {"pid": os.getpid(), **response_cache.snapshot(), "student_overview": overview_cache.snapshot()}
+    for cache in (response_cache, overview_cache):
+        if reset:
+            cache.reset()
+        if clear:
+            cache.clear()
+    return stats
+
 # Admin Master - School Profile
 @api_router.get("/school-profile")
 async def get_school_profile():
@@ -801,8 +1230,9 @@ async def update_school_profile(profile_data: SchoolProfileUpdate, current_user:
         raise HTTPException(status_code=403, detail="Not authorized")
     
     doc = profile_data.model_dump()
-    doc['updated_at'] = datetime.now(timezone.utc).isoformat()
+    doc['updated_at'] = datetime.now(timezone.utc)
     await db.school_profile.update_one({"id": "main_profile"}, {"$set": doc})
+    await invalidate_student_overview()
     return {"message": "Profil sekolah berhasil diupdate"}
 
 # Student Routes (Admin only)
@@ -828,13 +1258,206 @@ async def create_student(student: StudentCreate):
         password=hash_password(student.password)
     )
     doc = new_student.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
     await db.students.insert_one(doc)
+    await bump_data_version("students")
     await log_activity("system", "admin", "student_mgmt", f"Menambahkan siswa baru: {student.nama} ({student.nis})")
     return new_student
 
+# Import siswa massal (XLSX/CSV)
+IMPORT_CHUNK_SIZE = int(os.environ.get("IMPORT_CHUNK_SIZE", "500"))
+IMPORT_MAX_ROWS = int(os.environ.get("IMPORT_MAX_ROWS", "20000"))
+IMPORT_REQUIRED_FIELDS = ("nis", "nama", "kelas", "angkatan", "username", "password")
+hash_pool: Optional[ProcessPoolExecutor] = None
+
+def get_hash_pool() -> ProcessPoolExecutor:
+    # bcrypt sengaja lambat (~0.2 detik/hash); dibagi ke beberapa proses agar tidak memblokir event loop
+    global hash_pool
+    if hash_pool is None:
+        hash_pool = ProcessPoolExecutor(max_workers=int(os.environ.get("IMPORT_HASH_WORKERS", os.cpu_count() or 2)))
+    return hash_pool
+
+IMPORT_CSV_ENCODINGS = ("utf-8-sig", "cp1252")  # cp1252: CSV hasil "Save As" Excel di Windows
+
+def detect_csv_encoding(raw) -> Optional[str]:
+    """Encoding pertama yang bisa mendecode seluruh file; dicek per blok sebelum baris pertama diproses."""
+    decoders = {enc: codecs.getincrementaldecoder(enc)() for enc in IMPORT_CSV_ENCODINGS}
+    raw.seek(0)
+    while decoders:
+        block = raw.read(1 << 20)
+        for enc, decoder in list(decoders.items()):
+            try:
+                decoder.decode(block, final=not block)
+            except UnicodeDecodeError:
+                del decoders[enc]
+        if not block:
+            break
+    raw.seek(0)
+    return next((enc for enc in IMPORT_CSV_ENCODINGS if enc in decoders), None)
+
+def iter_import_rows(upload: UploadFile):
+    """Buka file import (XLSX/CSV) dan kembalikan iterator (nomor_baris, dict kolom->nilai). Header di baris 1.
+
+    File yang tidak bisa dibaca ditolak dengan 400 di sini, sebelum ada baris yang diproses."""
+    name = (upload.filename or "").lower()
+    upload.file.seek(0)
+    if name.endswith(".csv"):
+        encoding = detect_csv_encoding(upload.file)
+        if encoding is None:
+            raise HTTPException(status_code=400, detail="File CSV tidak bisa dibaca. Simpan ulang sebagai CSV UTF-8.")
+        reader = csv.reader(io.TextIOWrapper(upload.file, encoding=encoding, newline=""))
+        read_errors = (csv.Error,)
+    elif name.endswith(".xlsx"):
+        from openpyxl import load_workbook
+        from openpyxl.utils.exceptions import InvalidFileException
+        read_errors = (zipfile.BadZipFile, InvalidFileException, KeyError, ValueError, ElementTree.ParseError)
+        try:
+            reader = load_workbook(upload.file, read_only=True, data_only=True).active.iter_rows(values_only=True)
+        except read_errors:
+            raise HTTPException(status_code=400, detail="File XLSX rusak atau bukan file Excel. Simpan ulang sebagai .xlsx.")
+    else:
+        raise HTTPException(status_code=400, detail="Format file tidak didukung. Gunakan XLSX atau CSV.")
+    return import_rows(reader, read_errors)
+
+def import_rows(reader, read_errors: tuple):
+    header = None
+    row_no = 0
+    try:
+        for row_no, row in enumerate(reader, start=1):
+            values = ["" if v is None else str(v).strip() for v in row]
+            if header is None:
+                header = [v.lower().replace(" ", "_") for v in values]
+                continue
+            if not any(values):
+                continue
+            yield row_no, dict(zip(header, values))
+    except read_errors as e:
+        raise HTTPException(status_code=400, detail=f"File tidak bisa dibaca setelah baris {row_no}: {e}")
+
+def next_import_chunk(rows, size: int) -> list:
+    chunk = []
+    for item in rows:
+        chunk.append(item)
+        if len(chunk) >= size:
+            break
+    return chunk
+
+@api_router.post("/students/import")
+async def import_students(current_user: Annotated[dict, Depends(get_current_user)], file: UploadFile = File(...)):
+    if current_user.get("role") not in ["admin", "master"]:
+        raise HTTPException(status_code=403, detail="Not authorized")
+
+    import_id = str(uuid.uuid4())
+    user_id = current_user.get("user_id")
+    rows = iter_import_rows(file)
+    errors = []
+    seen_nis, seen_username = set(), set()
+    processed = inserted = 0
+    truncated = False
+    loop = asyncio.get_running_loop()
+
+    while True:
+        # Berhenti di IMPORT_MAX_ROWS: baris yang sudah masuk tetap dilaporkan, sisanya ditandai truncated
+        remaining = IMPORT_MAX_ROWS - processed
+        if remaining <= 0:
+            truncated = bool(await asyncio.to_thread(next_import_chunk, rows, 1))
+            break
+        chunk = await asyncio.to_thread(next_import_chunk, rows, min(IMPORT_CHUNK_SIZE, remaining))
+        if not chunk:
+            break
+        processed += len(chunk)
+
+        # 1. Validasi dengan StudentCreate + duplikat di dalam file
+        valid = []
+        for row_no, data in chunk:
+            try:
+                student = StudentCreate(**data)
+            except ValidationError as e:
+                errors.append({"baris": row_no, "nis": data.get("nis", ""), "errors": [f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors()]})
+                continue
+            problems = [f"{field} wajib diisi" for field in IMPORT_REQUIRED_FIELDS if not getattr(student, field)]
+            if student.nis in seen_nis:
+                problems.append(f"NIS {student.nis} duplikat di file")
+            if student.username in seen_username:
+                problems.append(f"username {student.username} duplikat di file")
+            seen_nis.add(student.nis)
+            seen_username.add(student.username)
+            if problems:
+                errors.append({"baris": row_no, "nis": student.nis, "errors": problems})
+            else:
+                valid.append((row_no, student))
+
+        # 2. Duplikat terhadap database: satu query $in per chunk
+        if valid:
+            existing = await db.students.find(
+                {"$or": [{"nis": {"$in": [st.nis for _, st in valid]}}, {"username": {"$in": [st.username for _, st in valid]}}]},
+                {"_id": 0, "nis": 1, "username": 1},
+            ).to_list(None)
+            taken_nis = {e["nis"] for e in existing}
+            taken_username = {e["username"] for e in existing}
+            fresh = []
+            for row_no, st in valid:
+                problems = []
+                if st.nis in taken_nis:
+                    problems.append(f"NIS {st.nis} sudah terdaftar")
+                if st.username in taken_username:
+                    problems.append(f"username {st.username} sudah terdaftar")
+                if problems:
+                    errors.append({"baris": row_no, "nis": st.nis, "errors": problems})
+                else:
+                    fresh.append((row_no, st))
+            valid = fresh
+
+        # 3. Hash password paralel di process pool, lalu insert_many
+        if valid:
+            pool = get_hash_pool()
+            hashes = await asyncio.gather(*[loop.run_in_executor(pool, hash_password, st.password) for _, st in valid])
+            docs = [
+                Student(nis=st.nis, nama=st.nama, kelas=st.kelas, angkatan=st.angkatan,
+                        no_wa=st.no_wa, username=st.username, password=hashed).model_dump()
+                for (_, st), hashed in zip(valid, hashes)
+            ]
+            try:
+                result = await db.students.insert_many(docs, ordered=False)
+                inserted += len(result.inserted_ids)
+            except BulkWriteError as e:
+                inserted += e.details.get("nInserted", 0)
+                for err in e.details.get("writeErrors", []):
+                    row_no, st = valid[err["index"]]
+                    errors.append({"baris": row_no, "nis": st.nis, "errors": [err.get("errmsg", "gagal disimpan")]})
+
+        await manager.send_to_user(user_id, {
+            "type": "import_progress", "import_id": import_id,
+            "processed": processed, "inserted": inserted, "failed": len(errors),
+        })
+
+    if processed == 0:
+        raise HTTPException(status_code=400, detail="File tidak berisi data siswa")
+    if inserted:
+        await bump_data_version("students")
+    truncated_note = f", dihentikan di {IMPORT_MAX_ROWS} baris" if truncated else ""
+    await log_activity(current_user.get("username", "admin"), current_user.get("role"), "student_mgmt",
+                       f"Import siswa dari {file.filename}: {inserted} berhasil, {len(errors)} gagal{truncated_note}", user_id=user_id)
+    report = {
+        "import_id": import_id,
+        "total_rows": processed,
+        "inserted": inserted,
+        "failed": len(errors),
+        "truncated": truncated,
+        "max_rows": IMPORT_MAX_ROWS,
+        "errors": sorted(errors, key=lambda e: e["baris"]),
+    }
+    await manager.send_to_user(user_id, {"type": "import_done", **{k: v for k, v in report.items() if k != "errors"}})
+    return report
+
+async def propagate_student_snapshot(student_id: str, snapshot: dict):
+    """Perbarui snapshot siswa di semua tagihan & pembayarannya (dijalankan di background)."""
+    bills = await db.bills.update_many({"id_siswa": student_id}, {"$set": {"siswa": snapshot}})
+    payments = await db.payments.update_many({"id_siswa": student_id}, {"$set": {"siswa": snapshot}})
+    await bump_data_version("bills", "payments")
+    logging.info(f"[SNAPSHOT] Siswa {student_id}: {bills.modified_count} tagihan, {payments.modified_count} pembayaran diperbarui")
+
 @api_router.put("/students/{student_id}")
-async def update_student(student_id: str, student: StudentCreate):
+async def update_student(student_id: str, student: StudentCreate, background_tasks: BackgroundTasks):
     # Check if student exists
     exists = await db.students.find_one({"id": student_id})
     if not exists:
@@ -853,6 +1476,11 @@ async def update_student(student_id: str, student: StudentCreate):
         updated_data["password"] = hash_password(student.password)
     
     await db.students.update_one({"id": student_id}, {"$set": updated_data})
+    await invalidate_student_overview(student_id)
+    await bump_data_version("students")
+    snapshot = student_snapshot(updated_data)
+    if snapshot != student_snapshot(exists):
+        background_tasks.add_task(propagate_student_snapshot, student_id, snapshot)
     await log_activity("system", "admin", "student_mgmt", f"Mengupdate data siswa: {exists['nama']}")
     return {"message": "Siswa berhasil diupdate"}
 
@@ -860,6 +1488,8 @@ async def update_student(student_id: str, student: StudentCreate):
 async def delete_student(student_id: str):
     exists = await db.students.find_one({"id": student_id})
     result = await db.students.delete_one({"id": student_id})
+    await invalidate_student_overview(student_id)
+    await bump_data_version("students")
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Siswa tidak ditemukan")
     await log_activity("system", "admin", "student_mgmt", f"Menghapus siswa: {exists['nama'] if exists else student_id}")
@@ -878,8 +1508,8 @@ async def create_class(class_data: ClassCreate):
         nominal_spp=class_data.nominal_spp
     )
     doc = new_class.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
     await db.classes.insert_one(doc)
+    await bump_data_version("classes")
     return new_class
 
 # Bill Routes
@@ -893,20 +1523,15 @@ async def get_bills(status: Optional[str] = None, id_siswa: Optional[str] = None
     
     bills = await db.bills.find(query, {"_id": 0}).to_list(1000)
     
-    # Enrich with student data
-    for bill in bills:
-        student = await db.students.find_one({"id": bill["id_siswa"]}, {"_id": 0})
-        if student:
-            bill["siswa"] = {"nama": student["nama"], "nis": student["nis"], "kelas": student["kelas"]}
-    
-    return bills
+    # Data siswa sudah ter-embed (snapshot); hanya tagihan lama yang perlu dilengkapi
+    return await attach_student_snapshots(bills)
 
 @api_router.post("/bills/generate")
 async def generate_bills(bill_gen: BillGenerate):
     # Get all students
     students = await db.students.find({}, {"_id": 0}).to_list(1000)
     
-    generated_count = 0
+    generated = []
     for student in students:
         # Check if bill already exists for this month/year
         exists = await db.bills.find_one({
@@ -925,64 +1550,194 @@ async def generate_bills(bill_gen: BillGenerate):
                 bulan=bill_gen.bulan,
                 tahun=bill_gen.tahun,
                 jumlah=nominal,
-                status="belum"
+                status="belum",
+                siswa=student_snapshot(student)
             )
             doc = new_bill.model_dump()
-            doc['created_at'] = doc['created_at'].isoformat()
             await db.bills.insert_one(doc)
-            generated_count += 1
-    
-    return {"message": f"Berhasil generate {generated_count} tagihan"}
+            generated.append(doc)
+    
+    await account_add_bills(generated)
+    if generated:
+        await bump_data_version("bills")
+    return {"message": f"Berhasil generate {len(generated)} tagihan"}
+
+def notify_payments_received(items: list):
+    """Kirim notifikasi WA (mock) 'pembayaran diterima' untuk daftar (tagihan, siswa) sekaligus."""
+    messages = [
+        f"[MOCK WA] Pembayaran SPP {bill['bulan']} {bill['tahun']} sebesar Rp {bill['jumlah']:,.0f} telah DITERIMA. Terima kasih! - SMK MEKAR MURNI. Kirim ke: {student['no_wa']}"
+        for bill, student in items if student.get("no_wa")
+    ]
+    if messages:
+        logging.info("\n".join(messages))
+
+BATCH_CONFIRM_MAX = int(os.environ.get("BATCH_CONFIRM_MAX", "1000"))
+
+@api_router.post("/bills/confirm-batch")
+async def confirm_bills_batch(batch: BillBatchConfirm, current_user: Annotated[dict, Depends(get_current_user)]):
+    if current_user.get("role") not in ["admin", "master"]:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    if batch.status not in BILL_STATUSES:
+        raise HTTPException(status_code=400, detail="Status tagihan tidak valid")
+    ids = list(dict.fromkeys(batch.ids))
+    if not ids:
+        raise HTTPException(status_code=400, detail="Daftar tagihan kosong")
+    if len(ids) > BATCH_CONFIRM_MAX:
+        raise HTTPException(status_code=400, detail=f"Maksimal {BATCH_CONFIRM_MAX} tagihan per permintaan")
+
+    bills = await db.bills.find({"id": {"$in": ids}}, {"_id": 0}).to_list(None)
+    found = {b["id"] for b in bills}
+    not_found = [bill_id for bill_id in ids if bill_id not in found]
+    student_ids = list({b["id_siswa"] for b in bills})
+    students = {s["id"]: s async for s in db.students.find(
+        {"id": {"$in": student_ids}}, {"_id": 0, "id": 1, "nama": 1, "nis": 1, "kelas": 1, "no_wa": 1})}
+
+    # 1. Transisi status tagihan, bersyarat pada status lama. batch_id menandai
+    #    tagihan yang benar-benar diubah oleh permintaan ini (bukan oleh request lain).
+    batch_id = str(uuid.uuid4())
+    to_change = [b for b in bills if b["status"] != batch.status]
+    if to_change:
+        await db.bills.bulk_write([
+            UpdateOne({"id": b["id"], "status": b["status"]},
+                      {"$set": {"status": batch.status, "konfirmasi_batch": batch_id}})
+            for b in to_change
+        ], ordered=False)
+    applied = set()
+    if to_change:
+        applied = {b["id"] async for b in db.bills.find(
+            {"id": {"$in": [b["id"] for b in to_change]}, "konfirmasi_batch": batch_id}, {"_id": 0, "id": 1})}
+    conflicts = [b["id"] for b in to_change if b["id"] not in applied]
+    settled = [b for b in bills if b["id"] not in conflicts]
+    # Pembayaran, ringkasan akun & notifikasi hanya untuk tagihan yang benar-benar dipindahkan
+    # request ini (aturan yang sama dengan confirm_bill); tagihan yang sudah berstatus target dilewati
+    moved = [b for b in to_change if b["id"] in applied]
+
+    # Perubahan ringkasan akun dikumpulkan per siswa lalu ditulis sekali
+    account_inc, account_max = {}, {}
+    def inc(id_siswa: str, field: str, value):
+        acc = account_inc.setdefault(id_siswa, {})
+        acc[field] = acc.get(field, 0) + value
+    for b in moved:
+        inc(b["id_siswa"], f"tagihan.{b['status']}.bulan", -1)
+        inc(b["id_siswa"], f"tagihan.{b['status']}.nominal", -b["jumlah"])
+        inc(b["id_siswa"], f"tagihan.{batch.status}.bulan", 1)
+        inc(b["id_siswa"], f"tagihan.{batch.status}.nominal", b["jumlah"])
+
+    # 2. Pembayaran: buat baru atau terima yang sudah ada (hanya untuk status lunas)
+    created = accepted = 0
+    notifications = []
+    if batch.status == "lunas" and moved:
+        now = datetime.now(timezone.utc)
+        existing = {}
+        async for p in db.payments.find({"id_tagihan": {"$in": [b["id"] for b in moved]}},
+                                        {"_id": 0, "id": 1, "id_tagihan": 1, "id_siswa": 1, "jumlah": 1, "status": 1}):
+            existing.setdefault(p["id_tagihan"], p)
+        ops = []
+        for b in moved:
+            student = students.get(b["id_siswa"])
+            payment = existing.get(b["id"])
+            if payment is None:
+                snapshot = b.get("siswa") or (student_snapshot(student) if student else None)
+                doc = Payment(id_tagihan=b["id"], id_siswa=b["id_siswa"], jumlah=b["jumlah"], status="diterima",
+                              tanggal_bayar=now, siswa=snapshot, tagihan={"bulan": b["bulan"], "tahun": b["tahun"]})
+                ops.append(InsertOne(doc.model_dump()))
+                created += 1
+                inc(b["id_siswa"], "total_dibayar", b["jumlah"])
+                inc(b["id_siswa"], "jumlah_pembayaran", 1)
+                account_max[b["id_siswa"]] = now
+            elif payment["status"] != "diterima":
+                # Bersyarat pada status lama: pembayaran yang sudah diterima tidak diberi tanggal baru
+                ops.append(UpdateOne({"id": payment["id"], "status": payment["status"]},
+                                     {"$set": {"status": "diterima", "tanggal_bayar": now}}))
+                accepted += 1
+                inc(payment["id_siswa"], "total_dibayar", payment["jumlah"])
+                inc(payment["id_siswa"], "jumlah_pembayaran", 1)
+                account_max[payment["id_siswa"]] = now
+            if student:
+                notifications.append((b, student))
+        if ops:
+            await db.payments.bulk_write(ops, ordered=False)
+
+    now = datetime.now(timezone.utc)
+    account_ops = []
+    for id_siswa in set(account_inc) | set(account_max):
+        update = {"$set": {"updated_at": now}}
+        if account_inc.get(id_siswa):
+            update["$inc"] = account_inc[id_siswa]
+        if id_siswa in account_max:
+            update["$max"] = {"pembayaran_terakhir": account_max[id_siswa]}
+        account_ops.append(UpdateOne({"id_siswa": id_siswa}, update, upsert=True))
+    if account_ops:
+        await db.student_accounts.bulk_write(account_ops, ordered=False)
+    await invalidate_student_overview(*student_ids)
+    if applied:
+        await bump_data_version("bills")
+    if created or accepted:
+        await bump_data_version("payments")
+
+    # 3. Satu notifikasi batch + satu log aktivitas
+    notify_payments_received(notifications)
+    status_text = "mengonfirmasi (Lunas)" if batch.status == "lunas" else f"mengubah status ke {batch.status}"
+    await log_activity(current_user.get("username", "admin"), current_user.get("role"), "payment",
+                       f"Admin {status_text} {len(settled)} tagihan ({len({b['id_siswa'] for b in settled})} siswa) sekaligus",
+                       user_id=current_user.get("user_id"))
+
+    return {
+        "message": f"{len(settled)} tagihan berhasil diupdate",
+        "updated": len(applied),
+        "unchanged": len(bills) - len(to_change),
+        "payments_created": created,
+        "payments_accepted": accepted,
+        "not_found": not_found,
+        "conflicts": conflicts,
+    }
 
 @api_router.put("/bills/{bill_id}/confirm")
 async def confirm_bill(bill_id: str, confirm: BillConfirm):
-    # Dapatkan data tagihan
-    bill = await db.bills.find_one({"id": bill_id}, {"_id": 0})
+    if confirm.status not in BILL_STATUSES:
+        raise HTTPException(status_code=400, detail="Status tagihan tidak valid")
+
+    # Transisi status dalam satu round trip; hasilnya tagihan sebelum diubah
+    bill = await set_bill_status(bill_id, confirm.status)
     if not bill:
         raise HTTPException(status_code=404, detail="Tagihan tidak ditemukan")
 
-    # Update status tagihan
-    result = await db.bills.update_one(
-        {"id": bill_id},
-        {"$set": {"status": confirm.status}}
-    )
-    
-    if result.modified_count == 0:
-        # Mungkin statusnya tidak berubah, tapi kita tetap lanjut
-        pass
-    
-    # Jika status diubah menjadi "lunas"
-    if confirm.status == "lunas":
-        # Cek apakah sudah ada payment, jika belum, buat baru
-        existing_payment = await db.payments.find_one({"id_tagihan": bill_id})
-        
-        if not existing_payment:
-            # Buat catatan pembayaran baru
-            payment = Payment(
-                id_tagihan=bill_id,
-                id_siswa=bill["id_siswa"],
-                jumlah=bill["jumlah"],
-                status="diterima" # Langsung diterima karena dikonfirmasi admin
-            )
-            doc = payment.model_dump()
-            doc['tanggal_bayar'] = doc['tanggal_bayar'].isoformat()
-            await db.payments.insert_one(doc)
-        else:
-            # Jika payment sudah ada (dari alur siswa), update statusnya
-            await db.payments.update_one(
-                {"id_tagihan": bill_id},
-                {"$set": {"status": "diterima", "tanggal_bayar": datetime.now(timezone.utc).isoformat()}}
-            )
+    # Konfirmasi ganda (double-click / dua admin): hanya request yang benar-benar
+    # memindahkan tagihan ke lunas yang membuat/menerima pembayaran
+    if confirm.status == "lunas" and bill["status"] != "lunas":
+        student = await db.students.find_one({"id": bill["id_siswa"]}, {"_id": 0})
+        snapshot = bill.get("siswa") or (student_snapshot(student) if student else None)
+
+        # Terima payment yang sudah ada (alur siswa) atau buat baru, dalam satu upsert
+        payment = Payment(
+            id_tagihan=bill_id,
+            id_siswa=bill["id_siswa"],
+            jumlah=bill["jumlah"],
+            status="diterima", # Langsung diterima karena dikonfirmasi admin
+            siswa=snapshot,
+            tagihan={"bulan": bill["bulan"], "tahun": bill["tahun"]}
+        )
+        on_insert = payment.model_dump(exclude={"status", "tanggal_bayar"})
+        before = await db.payments.find_one_and_update(
+            {"id_tagihan": bill_id},
+            {"$set": {"status": "diterima", "tanggal_bayar": payment.tanggal_bayar}, "$setOnInsert": on_insert},
+            projection={"_id": 0, "id_siswa": 1, "jumlah": 1, "status": 1},
+            upsert=True,
+        )
+        if before is None:
+            await account_add_payment(payment.id_siswa, payment.jumlah, payment.tanggal_bayar)
+        elif before["status"] != "diterima":
+            await account_add_payment(before["id_siswa"], before["jumlah"], payment.tanggal_bayar)
+        await bump_data_version("payments")
 
         # Kirim notifikasi WA (Mock)
-        student = await db.students.find_one({"id": bill["id_siswa"]}, {"_id": 0})
         if student:
-            logging.info(f"[MOCK WA] Pembayaran SPP {bill['bulan']} {bill['tahun']} sebesar Rp {bill['jumlah']:,.0f} telah DITERIMA. Terima kasih! - SMK MEKAR MURNI. Kirim ke: {student['no_wa']}")
+            notify_payments_received([(bill, student)])
     
     # Log activity
     status_text = "mengonfirmasi (Lunas)" if confirm.status == "lunas" else f"mengubah status ke {confirm.status}"
-    student = await db.students.find_one({"id": bill['id_siswa']})
-    await log_activity("system", "admin", "payment", f"Admin {status_text} tagihan siswa: {student['nama'] if student else 'Unknown'}")
+    nama = (bill.get("siswa") or {}).get("nama", "Unknown")
+    await log_activity("system", "admin", "payment", f"Admin {status_text} tagihan siswa: {nama}")
 
     return {"message": "Status tagihan berhasil diupdate"}
 
@@ -995,34 +1750,24 @@ async def get_payments(id_siswa: Optional[str] = None):
     
     payments = await db.payments.find(query, {"_id": 0}).to_list(1000)
     
-    # Enrich with student and bill data
-    for payment in payments:
-        student = await db.students.find_one({"id": payment["id_siswa"]}, {"_id": 0})
-        bill = await db.bills.find_one({"id": payment["id_tagihan"]}, {"_id": 0})
-        if student:
-            payment["siswa"] = {"nama": student["nama"], "nis": student["nis"], "kelas": student["kelas"]}
-        if bill:
-            payment["tagihan"] = {"bulan": bill["bulan"], "tahun": bill["tahun"]}
-    
-    return payments
+    # Enrich with student and bill data (hanya untuk pembayaran lama tanpa snapshot)
+    return await enrich_payments(payments)
 
 @api_router.post("/payments")
 async def create_payment(payment_data: PaymentCreate):
-    # Check if bill exists
-    bill = await db.bills.find_one({"id": payment_data.id_tagihan}, {"_id": 0})
+    # Klaim tagihan: belum -> menunggu_konfirmasi secara atomik. Dari dua request
+    # yang berpacu (double-click) hanya satu yang lolos; yang lain mendapat 400.
+    bill = await set_bill_status(payment_data.id_tagihan, "menunggu_konfirmasi", {"status": "belum"})
     if not bill:
-        raise HTTPException(status_code=404, detail="Tagihan tidak ditemukan")
-    
-    # --- UBAH LOGIKA INI ---
-    if bill["status"] == "lunas":
-        raise HTTPException(status_code=400, detail="Tagihan sudah lunas")
-    if bill["status"] == "menunggu_konfirmasi":
+        current = await db.bills.find_one({"id": payment_data.id_tagihan}, {"_id": 0, "status": 1})
+        if not current:
+            raise HTTPException(status_code=404, detail="Tagihan tidak ditemukan")
+        if current["status"] == "lunas":
+            raise HTTPException(status_code=400, detail="Tagihan sudah lunas")
         raise HTTPException(status_code=400, detail="Tagihan ini sedang menunggu konfirmasi")
-    
-    # Cek apakah sudah ada payment pending
-    existing_payment = await db.payments.find_one({"id_tagihan": payment_data.id_tagihan, "status": "pending"})
-    if existing_payment:
-        raise HTTPException(status_code=400, detail="Pembayaran untuk tagihan ini sudah dibuat dan sedang menunggu konfirmasi")
+
+    student = await db.students.find_one({"id": payment_data.id_siswa}, {"_id": 0})
+    snapshot = bill.get("siswa") or (student_snapshot(student) if student else None)
 
     # Create payment dengan status pending
     payment = Payment(
@@ -1032,68 +1777,426 @@ async def create_payment(payment_data: PaymentCreate):
         status="pending",
         # Simpan data baru ke database
         nama_pengirim=payment_data.nama_pengirim,
-        bank_asal=payment_data.bank_asal
+        bank_asal=payment_data.bank_asal,
+        siswa=snapshot,
+        tagihan={"bulan": bill["bulan"], "tahun": bill["tahun"]}
     )
     doc = payment.model_dump()
-    doc['tanggal_bayar'] = doc['tanggal_bayar'].isoformat()
-    await db.payments.insert_one(doc)
+    try:
+        # Index unik satu_pending_per_tagihan menolak pending kedua (mis. sisa pembayaran lama)
+        await db.payments.insert_one(doc)
+    except DuplicateKeyError:
+        await set_bill_status(payment_data.id_tagihan, "belum", {"status": "menunggu_konfirmasi"})
+        raise HTTPException(status_code=400, detail="Pembayaran untuk tagihan ini sudah dibuat dan sedang menunggu konfirmasi")
+    # set_bill_status menaikkan versi sebelum insert; overview yang di-cache di antaranya belum memuat pembayaran ini
+    await invalidate_student_overview(bill["id_siswa"])
+    await bump_data_version("payments")
     
-    student = await db.students.find_one({"id": payment.id_siswa})
     await log_activity(student['username'] if student else "unknown", "siswa", "payment", f"Melakukan pembayaran SPP sebesar Rp {payment.jumlah:,.0f}")
     
-    # Update bill status menjadi "menunggu_konfirmasi"
-    await db.bills.update_one(
-        {"id": payment_data.id_tagihan},
-        {"$set": {"status": "menunggu_konfirmasi"}} # Status diubah
-    )
-    
     # JANGAN kirim WA dulu di sini
     # ---------------------------
     
     return {"message": "Pembayaran berhasil dikirim, menunggu konfirmasi admin", "id": payment.id}
 
 
+# Rekonsiliasi mutasi bank
+STATEMENT_COLUMNS = {
+    "tanggal": ("tanggal", "tgl", "tanggal_transaksi", "date", "tgl_transaksi"),
+    "jumlah": ("jumlah", "nominal", "kredit", "credit", "amount", "mutasi"),
+    "nama": ("nama", "nama_pengirim", "pengirim", "keterangan", "deskripsi", "description", "remark", "berita"),
+}
+RECONCILE_FUZZY_THRESHOLD = 0.8
+# Kandidat fuzzy per baris yang dinilai dengan SequenceMatcher (urut jumlah awalan kata yang sama)
+RECONCILE_MAX_CANDIDATES = 20
+
+def normalize_name(value: str) -> str:
+    return " ".join(re.sub(r"[^A-Z0-9 ]", " ", (value or "").upper()).split())
+
+def parse_amount(value: str) -> Optional[float]:
+    """'Rp 1.500.000,00' / '1,500,000.00' / '1500000' -> 1500000.0"""
+    text = re.sub(r"[^0-9,.\-]", "", value or "")
+    if not text:
+        return None
+    if "," in text and "." in text:
+        decimal = "," if text.rfind(",") > text.rfind(".") else "."
+        text = text.replace("." if decimal == "," else ",", "").replace(decimal, ".")
+    elif "," in text:
+        text = text.replace(",", ".") if len(text.rsplit(",", 1)[1]) == 2 else text.replace(",", "")
+    elif text.count(".") > 1 or (text.count(".") == 1 and len(text.rsplit(".", 1)[1]) == 3):
+        text = text.replace(".", "")
+    try:
+        return float(text)
+    except ValueError:
+        return None
+
+def parse_statement_date(value: str) -> Optional[date]:
+    head = (value or "").strip().split(" ")[0].split("T")[0]  # sel XLSX bertipe tanggal: '2025-01-05 00:00:00'
+    for fmt in ("%d/%m/%Y", "%d-%m-%Y", "%d/%m/%y", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(head, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+def read_statement_rows(upload: UploadFile) -> tuple:
+    """Baris mutasi kredit: [{baris, tanggal, jumlah, keterangan, nama}], plus baris yang tidak bisa dibaca."""
+    rows, invalid = [], []
+    for row_no, data in iter_import_rows(upload):
+        picked = {key: next((data[a] for a in aliases if data.get(a)), "") for key, aliases in STATEMENT_COLUMNS.items()}
+        tanggal = parse_statement_date(picked["tanggal"])
+        jumlah = parse_amount(picked["jumlah"])
+        if tanggal is None or not jumlah or jumlah <= 0:
+            invalid.append({"baris": row_no, "data": data})
+            continue
+        rows.append({"baris": row_no, "tanggal": tanggal.isoformat(), "jumlah": jumlah,
+                     "keterangan": picked["nama"], "_date": tanggal, "_nama": normalize_name(picked["nama"])})
+    return rows, invalid
+
+def name_score(statement_name: str, sender: str) -> float:
+    """Kemiripan nama: rasio SequenceMatcher atau porsi kata nama pengirim yang muncul di keterangan mutasi."""
+    if not statement_name or not sender:
+        return 0.0
+    tokens = sender.split()
+    containment = sum(1 for t in tokens if t in statement_name.split()) / len(tokens)
+    return round(max(SequenceMatcher(None, statement_name, sender).ratio(), containment), 3)
+
+def amount_key(value: float) -> int:
+    """Nominal dibulatkan ke rupiah (setengah ke atas); sama dengan rentang query di reconcile_bank_statement."""
+    return math.floor(value + 0.5)
+
+def name_prefixes(name: str) -> set:
+    # Tiga huruf awal tiap kata: toleran salah ketik di akhir kata ("SANTOSA" ~ "SANTOSO")
+    return {token[:3] for token in name.split() if len(token) >= 2}
+
+def match_statement(rows: list, payments: list, window_days: int) -> dict:
+    """Cocokkan mutasi dengan pembayaran pending.
+
+    Pembayaran diindeks per (nominal, tanggal lokal) sehingga tiap baris hanya membuka
+    2 * window_days + 1 bucket hari. Exact match lewat (nominal, tanggal, nama); kandidat fuzzy
+    disaring dulu lewat indeks awalan kata nama dan dibatasi RECONCILE_MAX_CANDIDATES sebelum
+    SequenceMatcher dijalankan, jadi biaya per baris tidak tumbuh dengan jumlah pembayaran
+    bernominal sama (SPP satu kelas yang dibayar di awal bulan).
+    """
+    by_key, by_prefix = {}, {}
+    for p in payments:
+        p["_date"] = to_local(p["tanggal_bayar"]).date()
+        p["_nama"] = normalize_name(p.get("nama_pengirim") or (p.get("siswa") or {}).get("nama", ""))
+        amount = amount_key(p["jumlah"])
+        by_key.setdefault((amount, p["_date"], p["_nama"]), []).append(p)
+        for prefix in name_prefixes(p["_nama"]):
+            by_prefix.setdefault((amount, p["_date"], prefix), []).append(p)
+
+    used = set()
+    result = {row["baris"]: None for row in rows}
+    offsets = [timedelta(days=d) for d in range(-window_days, window_days + 1)]
+
+    # Pass 1: nominal + nama (setelah normalisasi) sama persis, dalam jendela tanggal
+    for row in rows:
+        amount = amount_key(row["jumlah"])
+        candidates = [p for offset in offsets for p in by_key.get((amount, row["_date"] + offset, row["_nama"]), [])
+                      if p["id"] not in used]
+        if len(candidates) == 1:
+            used.add(candidates[0]["id"])
+            result[row["baris"]] = ("matched", "exact", [(1.0, candidates[0])])
+        elif candidates:
+            result[row["baris"]] = ("ambiguous", "exact", [(1.0, p) for p in candidates])
+
+    # Pass 2 (fuzzy): nominal sama dalam jendela tanggal, minimal satu awalan kata sama, nama mirip
+    for row in rows:
+        if result[row["baris"]] is not None:
+            continue
+        amount = amount_key(row["jumlah"])
+        shared, by_id = {}, {}
+        for prefix in name_prefixes(row["_nama"]):
+            for offset in offsets:
+                for p in by_prefix.get((amount, row["_date"] + offset, prefix), []):
+                    if p["id"] not in used:
+                        shared[p["id"]] = shared.get(p["id"], 0) + 1
+                        by_id[p["id"]] = p
+        top = sorted(shared, key=shared.get, reverse=True)[:RECONCILE_MAX_CANDIDATES]
+        scored = sorted(((name_score(row["_nama"], by_id[pid]["_nama"]), by_id[pid]) for pid in top),
+                        key=lambda item: item[0], reverse=True)
+        scored = [item for item in scored if item[0] >= RECONCILE_FUZZY_THRESHOLD]
+        if len(scored) == 1 or (len(scored) > 1 and scored[0][0] - scored[1][0] >= 0.1):
+            used.add(scored[0][1]["id"])
+            result[row["baris"]] = ("matched", "fuzzy", scored[:1])
+        elif scored:
+            result[row["baris"]] = ("ambiguous", "fuzzy", scored)
+
+    def payment_view(score, p):
+        return {"skor": score, **{k: p.get(k) for k in ("id", "id_tagihan", "id_siswa", "jumlah", "tanggal_bayar",
+                                                         "nama_pengirim", "bank_asal", "siswa", "tagihan")}}
+
+    out = {"matched": [], "ambiguous": [], "unmatched": []}
+    for row in rows:
+        public = {k: v for k, v in row.items() if not k.startswith("_")}
+        entry = result[row["baris"]]
+        if entry is None:
+            out["unmatched"].append(public)
+        elif entry[0] == "matched":
+            out["matched"].append({**public, "metode": entry[1], "payment": payment_view(*entry[2][0])})
+        else:
+            out["ambiguous"].append({**public, "metode": entry[1], "kandidat": [payment_view(*c) for c in entry[2]]})
+    return out
+
+@api_router.post("/payments/reconcile")
+async def reconcile_bank_statement(current_user: Annotated[dict, Depends(get_current_user)], file: UploadFile = File(...), window_days: int = 3):
+    if current_user.get("role") not in ["admin", "master"]:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    if not 0 <= window_days <= 31:
+        raise HTTPException(status_code=400, detail="window_days harus antara 0 dan 31")
+
+    rows, invalid = await asyncio.to_thread(read_statement_rows, file)
+    if not rows:
+        raise HTTPException(status_code=400, detail="Tidak ada baris mutasi yang bisa dibaca (kolom tanggal & jumlah wajib ada)")
+
+    # Hanya pembayaran pending dengan nominal (dibulatkan ke rupiah, lihat amount_key) yang muncul di mutasi
+    amounts = sorted({amount_key(row["jumlah"]) for row in rows})
+    payments = await db.payments.find(
+        {"status": {"$in": ["pending", "menunggu_konfirmasi"]},
+         "$or": [{"jumlah": {"$gte": a - 0.5, "$lt": a + 0.5}} for a in amounts]},
+        {"_id": 0, "id": 1, "id_tagihan": 1, "id_siswa": 1, "jumlah": 1, "tanggal_bayar": 1,
+         "nama_pengirim": 1, "bank_asal": 1, "siswa": 1, "tagihan": 1},
+    ).to_list(None)
+    await attach_student_snapshots(payments)
+
+    result = await asyncio.to_thread(match_statement, rows, payments, window_days)
+    await log_activity(current_user.get("username", "admin"), current_user.get("role"), "payment",
+                       f"Rekonsiliasi mutasi {file.filename}: {len(result['matched'])} cocok, {len(result['ambiguous'])} ambigu, {len(result['unmatched'])} tidak cocok",
+                       user_id=current_user.get("user_id"))
+    return {
+        **result,
+        "invalid_rows": invalid,
+        "summary": {
+            "rows": len(rows),
+            "matched": len(result["matched"]),
+            "ambiguous": len(result["ambiguous"]),
+            "unmatched": len(result["unmatched"]),
+            "invalid": len(invalid),
+        },
+        # Kirim ke POST /api/bills/confirm-batch untuk mengonfirmasi semua yang cocok sekaligus
+        "confirm_ids": [m["payment"]["id_tagihan"] for m in result["matched"]],
+    }
+
+# Penyimpanan file upload: dibaca per chunk, ditulis di thread, jenis file dari magic bytes,
+# nama file = SHA-256 isi (file identik disimpan sekali), tulis ke file sementara lalu rename.
+UPLOAD_CHUNK_SIZE = 256 * 1024
+UPLOAD_MAX_BYTES = int(os.environ.get("UPLOAD_MAX_BYTES", str(10 * 1024 * 1024)))
+FILE_SIGNATURES = [
+    (b"%PDF-", ".pdf"),
+    (b"\x89PNG\r\n\x1a\n", ".png"),
+    (b"\xff\xd8\xff", ".jpg"),
+]
+
+def sniff_extension(head: bytes) -> Optional[str]:
+    return next((ext for magic, ext in FILE_SIGNATURES if head.startswith(magic)), None)
+
+async def store_upload(file: UploadFile, directory: Path, allowed: tuple, max_bytes: int = UPLOAD_MAX_BYTES) -> dict:
+    directory.mkdir(parents=True, exist_ok=True)
+    fd, tmp_name = tempfile.mkstemp(dir=directory, suffix=".part")
+    tmp_path = Path(tmp_name)
+    digest = hashlib.sha256()
+    size = 0
+    ext = None
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                if ext is None:
+                    ext = sniff_extension(chunk)
+                    if ext not in allowed:
+                        raise HTTPException(status_code=400, detail="Format file tidak didukung. Gunakan " + ", ".join(e.lstrip(".").upper() for e in allowed) + ".")
+                size += len(chunk)
+                if size > max_bytes:
+                    raise HTTPException(status_code=413, detail=f"Ukuran file maksimal {max_bytes // (1024 * 1024)} MB")
+                digest.update(chunk)
+                await asyncio.to_thread(out.write, chunk)
+        if size == 0:
+            raise HTTPException(status_code=400, detail="File kosong")
+
+        sha256 = digest.hexdigest()
+        final_path = directory / f"{sha256}{ext}"
+        if final_path.exists():
+            tmp_path.unlink()  # isi identik sudah tersimpan
+        else:
+            os.replace(tmp_path, final_path)
+        return {"path": final_path, "sha256": sha256, "ext": ext, "size": size}
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+# Varian gambar (thumbnail/medium) dibuat di background, disimpan di samping file asli:
+# <sha256>_<varian>.webp dan .jpg, tanpa EXIF (orientasi sudah diterapkan ke piksel).
+IMAGE_VARIANTS = {"thumb": 160, "medium": 800}
+IMAGE_VARIANT_FORMATS = {"webp": ("WEBP", {"quality": 80, "method": 4}), "jpg": ("JPEG", {"quality": 82, "optimize": True, "progressive": True})}
+
+def variant_path(original: Path, variant: str, fmt: str) -> Path:
+    return original.with_name(f"{original.stem}_{variant}.{fmt}")
+
+def render_image_variants(original: Path) -> dict:
+    """Buat semua varian untuk satu gambar (blocking, jalankan di thread). Return {varian: {format: nama_file}}."""
+    from PIL import Image, ImageOps
+
+    result = {}
+    with Image.open(original) as img:
+        img = ImageOps.exif_transpose(img)
+        if img.mode not in ("RGB", "L"):
+            background = Image.new("RGB", img.size, (255, 255, 255))
+            background.paste(img, mask=img.convert("RGBA").getchannel("A"))
+            img = background
+        for variant, size in IMAGE_VARIANTS.items():
+            resized = img.copy()
+            resized.thumbnail((size, size), Image.LANCZOS)
+            result[variant] = {}
+            for fmt, (pil_format, options) in IMAGE_VARIANT_FORMATS.items():
+                target = variant_path(original, variant, fmt)
+                if not target.exists():  # nama berbasis hash isi: varian yang sudah ada pasti sama
+                    tmp = target.with_suffix(target.suffix + ".part")
+                    resized.save(tmp, pil_format, **options)  # tanpa exif=... -> metadata tidak ikut
+                    os.replace(tmp, target)
+                result[variant][fmt] = target.name
+    return result
+
+async def process_image_variants(original: Path, collection: str, doc_id: str, field: str, url_template: str):
+    """Tugas background: render varian lalu simpan URL-nya di dokumen (mis. profile_pic_variants).
+    url_template diformat dengan {variant}, {fmt} dan {name} (nama file varian)."""
+    try:
+        files = await asyncio.to_thread(render_image_variants, original)
+    except Exception as e:
+        logging.error(f"[IMAGE] Gagal membuat varian {original.name}: {e}")
+        return
+    urls = {variant: {fmt: url_template.format(variant=variant, fmt=fmt, name=name) for fmt, name in formats.items()}
+            for variant, formats in files.items()}
+    await db[collection].update_one({"id": doc_id}, {"$set": {field: urls}})
+    if collection == "students":
+        await invalidate_student_overview(doc_id)
+
+# Pengiriman file: ETag/304, HTTP Range (PDF besar) dan Cache-Control. File dengan nama
+# berbasis hash isi tidak pernah berubah, jadi boleh di-cache selamanya (immutable).
+HASHED_NAME = re.compile(r"^[0-9a-f]{64}(_[a-z]+)?\.[a-z0-9]+$")
+IMMUTABLE_MAX_AGE = 31536000
+
+def file_etag(path: Path, stat_result) -> str:
+    if HASHED_NAME.match(path.name):
+        return f'"{path.stem}"'
+    return f'W/"{int(stat_result.st_mtime)}-{stat_result.st_size}"'
+
+def parse_byte_range(header: str, size: int):
+    """'bytes=0-499' -> (0, 499). None jika header tidak dipakai (multi-range/format lain), 'invalid' jika di luar ukuran."""
+    match = re.fullmatch(r"bytes=(\d*)-(\d*)", header.strip())
+    if not match or match.group(1) == match.group(2) == "":
+        return None
+    if match.group(1) == "":
+        start, end = max(size - int(match.group(2)), 0), size - 1
+    else:
+        start = int(match.group(1))
+        end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+    if start >= size or start > end:
+        return "invalid"
+    return start, end
+
+async def iter_file_range(path: Path, start: int, length: int):
+    f = await asyncio.to_thread(open, path, "rb")
+    try:
+        await asyncio.to_thread(f.seek, start)
+        while length > 0:
+            data = await asyncio.to_thread(f.read, min(UPLOAD_CHUNK_SIZE, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+    finally:
+        f.close()
+
+def send_file(request_headers: Headers, path: Path, cache_control: str, media_type: Optional[str] = None,
+              filename: Optional[str] = None, stat_result=None, method: str = "GET") -> Response:
+    stat_result = stat_result or path.stat()
+    size = stat_result.st_size
+    media_type = media_type or mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+    etag = file_etag(path, stat_result)
+    headers = {"ETag": etag, "Cache-Control": cache_control, "Accept-Ranges": "bytes"}
+    if filename:
+        headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match and etag.removeprefix("W/") in [t.strip().removeprefix("W/") for t in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+
+    range_header = request_headers.get("range")
+    if_range = request_headers.get("if-range")
+    if range_header and (not if_range or if_range.strip() == etag):
+        byte_range = parse_byte_range(range_header, size)
+        if byte_range == "invalid":
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+        if byte_range:
+            start, end = byte_range
+            length = end - start + 1
+            headers.update({"Content-Range": f"bytes {start}-{end}/{size}", "Content-Length": str(length)})
+            body = iter_file_range(path, start, length) if method != "HEAD" else iter(())
+            return StreamingResponse(body, status_code=206, media_type=media_type, headers=headers)
+
+    return FileResponse(path=str(path), media_type=media_type, headers=headers, stat_result=stat_result, method=method)
+
+class UploadStaticFiles(StaticFiles):
+    """/uploads: nama berbasis hash -> immutable; file lain (logo, foto lama) divalidasi ulang lewat ETag."""
+    def file_response(self, full_path, stat_result, scope, status_code: int = 200) -> Response:
+        path = Path(full_path)
+        cache_control = f"public, max-age={IMMUTABLE_MAX_AGE}, immutable" if HASHED_NAME.match(path.name) else "public, no-cache"
+        return send_file(Headers(scope=scope), path, cache_control, stat_result=stat_result, method=scope["method"])
+
+def receipt_url(payment_id: str, sha256: str, variant: Optional[str] = None) -> str:
+    # ?v= mengikat URL ke isi file sehingga aman di-cache immutable; upload ulang -> URL baru
+    url = f"/api/payments/{payment_id}/receipt/file?v={sha256[:16]}"
+    return url + (f"&variant={variant}" if variant else "")
+
 # Upload receipt for a payment (student uploads PDF)
 @api_router.post("/payments/{payment_id}/upload_receipt")
-async def upload_payment_receipt(payment_id: str, file: UploadFile = File(...)):
+async def upload_payment_receipt(payment_id: str, background_tasks: BackgroundTasks, file: UploadFile = File(...)):
     # Validate payment exists
     payment = await db.payments.find_one({"id": payment_id}, {"_id": 0})
     if not payment:
         raise HTTPException(status_code=404, detail="Payment not found")
-
-    # 1. Cek Tipe Konten (Izinkan PDF dan Gambar)
-    allowed_types = ["application/pdf", "image/jpeg", "image/png", "image/jpg"]
-    if file.content_type not in allowed_types:
-        raise HTTPException(status_code=400, detail="Format file tidak didukung. Gunakan JPG, PNG, atau PDF.")
-
-    receipts_dir = ROOT_DIR / 'receipts'
-    receipts_dir.mkdir(parents=True, exist_ok=True)
-
-    # 2. Tentukan Ekstensi File Secara Otomatis
-    ext = mimetypes.guess_extension(file.content_type) or ".bin"
-    # Koreksi untuk .jpe -> .jpg agar lebih umum
-    if ext == ".jpe": ext = ".jpg"
-
-    filename = f"receipt_{payment_id}{ext}"
-    file_path = receipts_dir / filename
-
-    with open(file_path, 'wb') as f:
-        content = await file.read()
-        f.write(content)
-
-    # Update payment record
-    await db.payments.update_one({"id": payment_id}, {"$set": {"receipt_path": str(file_path), "status": "menunggu_konfirmasi"}})
-    await db.bills.update_one({"id": payment['id_tagihan']}, {"$set": {"status": "menunggu_konfirmasi"}})
+    if payment.get("status") == "diterima":
+        raise HTTPException(status_code=400, detail="Pembayaran sudah diterima, bukti tidak dapat diganti")
+
+    # Simpan file (PDF/JPG/PNG, dicek dari isi file, bukan content_type)
+    stored = await store_upload(file, ROOT_DIR / 'receipts', (".pdf", ".jpg", ".png"))
+
+    # Bukti yang sama persis sudah dipakai untuk pembayaran lain?
+    duplicates = await db.payments.find(
+        {"receipt_sha256": stored["sha256"], "id": {"$ne": payment_id}}, {"_id": 0, "id": 1, "id_tagihan": 1}
+    ).to_list(10)
+
+    # Update payment record (varian lama dihapus; gambar baru dibuatkan varian di background).
+    # Bersyarat: pembayaran yang dikonfirmasi admin selama upload berjalan tidak dikembalikan ke menunggu
+    result = await db.payments.update_one({"id": payment_id, "status": {"$ne": "diterima"}}, {
+        "$set": {"receipt_path": str(stored["path"]), "receipt_sha256": stored["sha256"],
+                 "receipt_url": receipt_url(payment_id, stored["sha256"]), "status": "menunggu_konfirmasi"},
+        "$unset": {"receipt_variants": ""}})
+    if result.matched_count == 0:
+        raise HTTPException(status_code=400, detail="Pembayaran sudah diterima, bukti tidak dapat diganti")
+    await bump_data_version("payments")
+    if stored["ext"] != ".pdf":
+        background_tasks.add_task(process_image_variants, stored["path"], "payments", payment_id, "receipt_variants",
+                                  receipt_url(payment_id, stored["sha256"], "{variant}_{fmt}"))
+    await set_bill_status(payment['id_tagihan'], "menunggu_konfirmasi", {"status": "belum"})
     
     student = await db.students.find_one({"id": payment['id_siswa']})
     await log_activity(student['username'] if student else "unknown", "siswa", "payment", f"Mengunggah bukti pembayaran untuk tagihan {payment['id_tagihan']}")
+    if duplicates:
+        logging.warning(f"[RECEIPT] Bukti pembayaran {payment_id} identik dengan pembayaran {[d['id'] for d in duplicates]}")
 
-    return {"message": "Receipt uploaded"}
+    variants = None
+    if stored["ext"] != ".pdf":
+        variants = {variant: {fmt: receipt_url(payment_id, stored["sha256"], f"{variant}_{fmt}") for fmt in IMAGE_VARIANT_FORMATS}
+                    for variant in IMAGE_VARIANTS}
+    return {"message": "Receipt uploaded", "url": receipt_url(payment_id, stored["sha256"]),
+            "duplicate_of": [d["id"] for d in duplicates], "variants": variants}
 
 
 # Serve receipt file for a payment (admin or student)
 @api_router.get("/payments/{payment_id}/receipt/file")
-async def get_uploaded_receipt(payment_id: str, user_payload: Annotated[dict, Depends(get_current_user)]):
+async def get_uploaded_receipt(payment_id: str, request: Request, user_payload: Annotated[dict, Depends(get_current_user)], variant: Optional[str] = None, v: Optional[str] = None):
 
     payment = await db.payments.find_one({"id": payment_id}, {"_id": 0})
     if not payment:
@@ -1112,41 +2215,66 @@ async def get_uploaded_receipt(payment_id: str, user_payload: Annotated[dict, De
     if not file_path.exists():
         raise HTTPException(status_code=404, detail="Receipt file not found on server")
 
-    # Deteksi media type otomatis (PDF/JPG/PNG)
-    media_type, _ = mimetypes.guess_type(file_path)
-    return FileResponse(path=str(file_path), media_type=media_type, filename=file_path.name)
+    # ?variant=thumb_webp / medium_jpg ... (varian belum jadi atau PDF -> file asli)
+    exact = True
+    if variant:
+        name, _, fmt = variant.partition("_")
+        if name not in IMAGE_VARIANTS or fmt not in IMAGE_VARIANT_FORMATS:
+            raise HTTPException(status_code=400, detail="Varian tidak dikenal")
+        candidate = variant_path(file_path, name, fmt)
+        exact = candidate.exists()
+        if exact:
+            file_path = candidate
+
+    # URL ber-?v= yang cocok dengan isi file saat ini boleh di-cache browser selamanya;
+    # selain itu (URL lama, varian belum jadi) selalu divalidasi ulang lewat ETag
+    sha = payment.get("receipt_sha256") or ""
+    if exact and v and sha.startswith(v):
+        cache_control = f"private, max-age={IMMUTABLE_MAX_AGE}, immutable"
+    else:
+        cache_control = "private, no-cache"
+    return send_file(request.headers, file_path, cache_control, filename=f"receipt_{payment_id}{file_path.suffix}", method=request.method)
 
 # Dashboard Stats
 @api_router.get("/dashboard/stats")
 async def get_dashboard_stats(current_user: Annotated[dict, Depends(get_current_user)]):
     if current_user.get("role") not in ["admin", "kepsek", "master"]:
         raise HTTPException(status_code=403, detail="Not authorized")
+    # Angka dashboard bergantung pada bulan berjalan, jadi bulan ikut menjadi bagian key
+    now = datetime.now(SCHOOL_TZ)
+    return await cached_response("/dashboard/stats", {"bulan": now.strftime("%Y-%m")}, current_user.get("role"),
+                                 ("students", "bills", "payments", "student_accounts"), lambda: build_dashboard_stats(now))
+
+async def build_dashboard_stats(now: datetime) -> dict:
     # Total students
-    total_students = await db.students.count_documents({})
+    total_students = await report_db.students.count_documents({})
     
-    # Total payment this month
-    now = datetime.now(timezone.utc)
-    current_month_str = now.strftime("%Y-%m")
-    
-    monthly_payments = await db.payments.find({"status": "diterima"}, {"_id": 0}).to_list(1000)
-    total_bulan_ini = sum(p["jumlah"] for p in monthly_payments if isinstance(p["tanggal_bayar"], str) and p["tanggal_bayar"].startswith(current_month_str))
+    # Total payment this month (bulan berjalan WIB, range query pada tanggal_bayar)
+    month_start, month_end = local_month_range(now.year, now.month)
+    monthly = await report_db.payments.aggregate([
+        {"$match": {"status": "diterima", "tanggal_bayar": {"$gte": month_start, "$lt": month_end}}},
+        {"$group": {"_id": None, "total": {"$sum": "$jumlah"}}},
+    ]).to_list(1)
+    total_bulan_ini = monthly[0]["total"] if monthly else 0
     
     # Students with unpaid bills
-    unpaid_bills = await db.bills.find({"status": "belum"}, {"_id": 0}).to_list(1000)
-    siswa_menunggak = len(set(b["id_siswa"] for b in unpaid_bills))
-    
-    # Monthly income chart data
-    payments = await db.payments.find({}, {"_id": 0}).to_list(1000)
-    monthly_income = {}
-    for payment in payments:
-        date_str = payment["tanggal_bayar"]
-        if isinstance(date_str, str):
-            month_key = date_str[:7]  # YYYY-MM
-            if month_key not in monthly_income:
-                monthly_income[month_key] = 0
-            monthly_income[month_key] += payment["jumlah"]
-    
-    chart_data = [{"bulan": k, "pemasukan": v} for k, v in sorted(monthly_income.items())[-6:]]
+    siswa_menunggak = await report_db.student_accounts.count_documents({"tagihan.belum.bulan": {"$gt": 0}})
+    
+    # Monthly income chart data (6 bulan terakhir, dikelompokkan per bulan WIB)
+    first_month = now.month - 5
+    first_year = now.year + (first_month - 1) // 12
+    first_month = (first_month - 1) % 12 + 1
+    chart_start, _ = local_month_range(first_year, first_month)
+    chart_rows = await report_db.payments.aggregate([
+        {"$match": {"tanggal_bayar": {"$gte": chart_start, "$lt": month_end}}},
+        {"$group": {
+            "_id": {"$dateToString": {"format": "%Y-%m", "date": "$tanggal_bayar", "timezone": SCHOOL_TZ.key}},
+            "pemasukan": {"$sum": "$jumlah"},
+        }},
+        {"$sort": {"_id": 1}},
+    ]).to_list(None)
+    
+    chart_data = [{"bulan": row["_id"], "pemasukan": row["pemasukan"]} for row in chart_rows]
     
     return {
         "total_siswa": total_students,
@@ -1155,113 +2283,237 @@ async def get_dashboard_stats(current_user: Annotated[dict, Depends(get_current_
         "chart_data": chart_data
     }
 
+async def arrears_student_ids(kelas: Optional[str] = None, angkatan: Optional[str] = None) -> Optional[list]:
+    """Id siswa untuk filter kelas/angkatan (None = semua siswa).
+
+    Snapshot siswa di tagihan tidak memuat angkatan dan bisa tertinggal sesaat setelah siswa
+    pindah kelas, jadi filter di-resolve dari koleksi students lalu dipakai di $match pertama.
+    """
+    query = {}
+    if kelas:
+        query["kelas"] = kelas
+    if angkatan:
+        query["angkatan"] = angkatan
+    if not query:
+        return None
+    return await report_db.students.distinct("id", query)
+
+def arrears_pipeline(student_ids: Optional[list] = None, min_bulan: Optional[int] = None, per_student: bool = False):
+    """Pipeline tunggakan (tagihan status "belum") dengan data siswa di-join server-side.
+
+    student_ids membatasi ke siswa tertentu (lihat arrears_student_ids) sebelum $group/$lookup,
+    sehingga laporan satu kelas hanya men-join tagihan kelas itu (index status + id_siswa).
+
+    per_student=False -> satu dokumen per tagihan (+ siswa), urut kelas/nama/periode
+    per_student=True  -> satu dokumen per siswa dengan total tunggakan, urut terbesar dulu
+    """
+    match = {"status": "belum"}
+    if student_ids is not None:
+        match["id_siswa"] = {"$in": student_ids}
+    pipeline = [{"$match": match}]
+
+    if per_student:
+        pipeline += [
+            {"$group": {
+                "_id": "$id_siswa",
+                "total_tunggakan": {"$sum": "$jumlah"},
+                "bulan_count": {"$sum": 1},
+                "detail_bulan": {"$push": {"$concat": ["$bulan", " ", {"$toString": "$tahun"}]}},
+            }},
+        ]
+        if min_bulan:
+            pipeline.append({"$match": {"bulan_count": {"$gte": min_bulan}}})
+        pipeline += [
+            {"$lookup": {"from": "students", "localField": "_id", "foreignField": "id", "as": "siswa"}},
+            {"$unwind": "$siswa"},
+            {"$sort": {"total_tunggakan": -1, "siswa.nama": 1}},
+            {"$project": {
+                "_id": 0,
+                "id": "$_id",
+                "nis": "$siswa.nis",
+                "nama": "$siswa.nama",
+                "kelas": "$siswa.kelas",
+                "total_tunggakan": 1,
+                "bulan_count": 1,
+                "detail_bulan": 1,
+            }},
+        ]
+        return pipeline
+
+    if min_bulan:
+        # Hanya siswa yang menunggak minimal `min_bulan` bulan
+        pipeline += [
+            {"$group": {"_id": "$id_siswa", "bills": {"$push": "$$ROOT"}, "count": {"$sum": 1}}},
+            {"$match": {"count": {"$gte": min_bulan}}},
+            {"$unwind": "$bills"},
+            {"$replaceRoot": {"newRoot": "$bills"}},
+        ]
+    pipeline += [
+        {"$lookup": {"from": "students", "localField": "id_siswa", "foreignField": "id", "as": "siswa"}},
+        {"$unwind": "$siswa"},
+        {"$set": {
+            "_bulan_idx": {"$indexOfArray": [BULAN, "$bulan"]},
+            "siswa": {"nama": "$siswa.nama", "nis": "$siswa.nis", "kelas": "$siswa.kelas"},
+        }},
+        {"$sort": {"siswa.kelas": 1, "siswa.nama": 1, "id_siswa": 1, "tahun": 1, "_bulan_idx": 1}},
+        {"$project": {"_id": 0, "_bulan_idx": 0}},
+    ]
+    return pipeline
+
 @api_router.get("/dashboard/arrears-detail")
-async def get_arrears_detail(current_user: Annotated[dict, Depends(get_current_user)]):
+async def get_arrears_detail(current_user: Annotated[dict, Depends(get_current_user)], kelas: Optional[str] = None, angkatan: Optional[str] = None, min_bulan: Optional[int] = None):
     if current_user.get("role") not in ["admin", "kepsek", "master"]:
         raise HTTPException(status_code=403, detail="Not authorized")
     
-    # Fetch all unpaid bills
-    unpaid_bills = await db.bills.find({"status": "belum"}, {"_id": 0}).to_list(5000)
-    
-    # Group by student
-    student_arrears = {}
-    for bill in unpaid_bills:
-        id_siswa = bill["id_siswa"]
-        if id_siswa not in student_arrears:
-            student_arrears[id_siswa] = {
-                "total_tunggakan": 0,
-                "count": 0,
-                "detail_bulan": []
-            }
-        student_arrears[id_siswa]["total_tunggakan"] += bill["jumlah"]
-        student_arrears[id_siswa]["count"] += 1
-        student_arrears[id_siswa]["detail_bulan"].append(f"{bill['bulan']} {bill['tahun']}")
-    
-    # Enrich with student data
-    result = []
-    for id_siswa, data in student_arrears.items():
-        student = await db.students.find_one({"id": id_siswa}, {"_id": 0})
-        if student:
-            result.append({
-                "id": id_siswa,
-                "nis": student["nis"],
-                "nama": student["nama"],
-                "kelas": student["kelas"],
-                "total_tunggakan": data["total_tunggakan"],
-                "bulan_count": data["count"],
-                "detail_bulan": data["detail_bulan"]
-            })
-            
-    # Sort by total_tunggakan descending
-    result.sort(key=lambda x: x["total_tunggakan"], reverse=True)
-    
-    return result
+    # Group per siswa + total tunggakan dihitung di MongoDB, hasil di-stream langsung dari cursor
+    student_ids = await arrears_student_ids(kelas, angkatan)
+    cursor = report_db.bills.aggregate(arrears_pipeline(student_ids, min_bulan, per_student=True), allowDiskUse=True)
+    return StreamingResponse(stream_json_list(cursor), media_type="application/json")
     
 @api_router.get("/reports/annual")
 async def get_annual_report(current_user: Annotated[dict, Depends(get_current_user)]):
     if current_user.get("role") not in ["admin", "kepsek", "master"]:
         raise HTTPException(status_code=403, detail="Not authorized")
-    # Ambil semua pembayaran yang statusnya diterima
-    payments = await db.payments.find({"status": "diterima"}, {"_id": 0}).to_list(1000)
-    annual_data = {}
-
-    current_year = datetime.now(timezone.utc).year
-    total_pemasukan_tahun_ini = 0
-
-    for p in payments:
-        try:
-            # Pastikan tanggal_bayar adalah string ISO
-            payment_date = datetime.fromisoformat(p["tanggal_bayar"])
-            year = payment_date.year
-
-            if year not in annual_data:
-                annual_data[year] = 0
-
-            annual_data[year] += p["jumlah"]
-
-            if year == current_year:
-                total_pemasukan_tahun_ini += p["jumlah"]
-
-        except (TypeError, ValueError):
-            continue # Abaikan format tanggal yang salah atau data lama
+    # Total pembayaran diterima per tahun (tahun WIB), dihitung di MongoDB
+    rows = await report_db.payments.aggregate([
+        {"$match": {"status": "diterima", "tanggal_bayar": {"$type": "date"}}},
+        {"$group": {
+            "_id": {"$year": {"date": "$tanggal_bayar", "timezone": SCHOOL_TZ.key}},
+            "pemasukan": {"$sum": "$jumlah"},
+        }},
+        {"$sort": {"_id": 1}},
+    ]).to_list(None)
+
+    current_year = datetime.now(SCHOOL_TZ).year
+    total_pemasukan_tahun_ini = next((row["pemasukan"] for row in rows if row["_id"] == current_year), 0)
 
     # Konversi ke format chart
-    chart_data = [{"tahun": year, "pemasukan": total} for year, total in sorted(annual_data.items())]
+    chart_data = [{"tahun": row["_id"], "pemasukan": row["pemasukan"]} for row in rows]
 
     return {
         "total_pemasukan_tahun_ini": total_pemasukan_tahun_ini,
         "chart_data": chart_data
     }
+
+async def attach_student_snapshots(docs: list) -> list:
+    """Lengkapi field siswa untuk dokumen lama yang belum punya snapshot (satu query $in)."""
+    missing = list({d["id_siswa"] for d in docs if not d.get("siswa")})
+    if missing:
+        students = {s["id"]: s async for s in db.students.find({"id": {"$in": missing}}, {"_id": 0, "id": 1, "nama": 1, "nis": 1, "kelas": 1})}
+        for d in docs:
+            if not d.get("siswa") and d["id_siswa"] in students:
+                d["siswa"] = student_snapshot(students[d["id_siswa"]])
+    return docs
+
+async def enrich_payments(payments: list) -> list:
+    """Tambahkan data siswa & tagihan ke daftar pembayaran; snapshot yang sudah ter-embed dipakai langsung."""
+    await attach_student_snapshots(payments)
+    bill_ids = list({p["id_tagihan"] for p in payments if not p.get("tagihan")})
+    if bill_ids:
+        bills = {b["id"]: b async for b in db.bills.find({"id": {"$in": bill_ids}}, {"_id": 0, "id": 1, "bulan": 1, "tahun": 1})}
+        for payment in payments:
+            bill = bills.get(payment["id_tagihan"])
+            if not payment.get("tagihan") and bill:
+                payment["tagihan"] = {"bulan": bill["bulan"], "tahun": bill["tahun"]}
+    return payments
+
+def resolve_period(periode: str, tanggal: Optional[date], mulai: Optional[date], sampai: Optional[date]):
+    """Periode laporan -> (tanggal awal, tanggal akhir inklusif) dalam kalender WIB."""
+    anchor = tanggal or datetime.now(SCHOOL_TZ).date()
+    if periode == "day":
+        return anchor, anchor
+    if periode == "week":
+        start = anchor - timedelta(days=anchor.weekday())  # Senin
+        return start, start + timedelta(days=6)
+    if periode == "month":
+        start = anchor.replace(day=1)
+        return start, start.replace(day=calendar.monthrange(start.year, start.month)[1])
+    if periode == "custom":
+        if not mulai or not sampai:
+            raise HTTPException(status_code=400, detail="Periode custom membutuhkan parameter mulai dan sampai")
+        if sampai < mulai:
+            raise HTTPException(status_code=400, detail="Tanggal sampai harus setelah tanggal mulai")
+        if (sampai - mulai).days > 366:
+            raise HTTPException(status_code=400, detail="Rentang periode maksimal 1 tahun")
+        return mulai, sampai
+    raise HTTPException(status_code=400, detail="Periode harus day, week, month atau custom")
+
+async def build_period_report(start: date, end: date, status: Optional[str] = None, detail: bool = True, breakdown: bool = False):
+    range_start, _ = local_day_range(start)
+    _, range_end = local_day_range(end)
+    query = {"tanggal_bayar": {"$gte": range_start, "$lt": range_end}}
+    if status:
+        query["status"] = status
+
+    report = {"mulai": start.isoformat(), "sampai": end.isoformat()}
+
+    if detail:
+        payments = await report_db.payments.find(query, {"_id": 0}).sort("tanggal_bayar", 1).to_list(None)
+        report["total"] = sum(p["jumlah"] for p in payments)
+        report["jumlah_transaksi"] = len(payments)
+        if breakdown:
+            per_day = {}
+            for p in payments:
+                key = to_local(p["tanggal_bayar"]).date().isoformat()
+                row = per_day.setdefault(key, {"tanggal": key, "total": 0, "jumlah_transaksi": 0})
+                row["total"] += p["jumlah"]
+                row["jumlah_transaksi"] += 1
+            report["per_hari"] = list(per_day.values())
+        report["payments"] = await enrich_payments(payments)
+        return report
+
+    # Ringkasan saja: total per hari dihitung di MongoDB, tanpa mengirim daftar pembayaran
+    rows = await report_db.payments.aggregate([
+        {"$match": query},
+        {"$group": {
+            "_id": {"$dateToString": {"format": "%Y-%m-%d", "date": "$tanggal_bayar", "timezone": SCHOOL_TZ.key}},
+            "total": {"$sum": "$jumlah"},
+            "jumlah_transaksi": {"$sum": 1},
+        }},
+        {"$sort": {"_id": 1}},
+    ]).to_list(None)
+    report["total"] = sum(r["total"] for r in rows)
+    report["jumlah_transaksi"] = sum(r["jumlah_transaksi"] for r in rows)
+    if breakdown:
+        report["per_hari"] = [{"tanggal": r["_id"], "total": r["total"], "jumlah_transaksi": r["jumlah_transaksi"]} for r in rows]
+    return report
+
 # Reports
 @api_router.get("/reports/daily")
 async def get_daily_report(current_user: Annotated[dict, Depends(get_current_user)]):
     if current_user.get("role") not in ["admin", "kepsek", "master"]:
         raise HTTPException(status_code=403, detail="Not authorized")
-    today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
-    payments = await db.payments.find({}, {"_id": 0}).to_list(1000)
-    daily_payments = [p for p in payments if isinstance(p["tanggal_bayar"], str) and p["tanggal_bayar"].startswith(today)]
-    
-    total = sum(p["jumlah"] for p in daily_payments)
-    
-    # Enrich with student data
-    for payment in daily_payments:
-        student = await db.students.find_one({"id": payment["id_siswa"]}, {"_id": 0})
-        bill = await db.bills.find_one({"id": payment["id_tagihan"]}, {"_id": 0})
-        if student:
-            payment["siswa"] = {"nama": student["nama"], "nis": student["nis"], "kelas": student["kelas"]}
-        if bill:
-            payment["tagihan"] = {"bulan": bill["bulan"], "tahun": bill["tahun"]}
-    
-    return {"total": total, "payments": daily_payments}
+    today = datetime.now(SCHOOL_TZ).date()
+    report = await build_period_report(today, today)
+    return {"total": report["total"], "payments": report["payments"]}
+
+@api_router.get("/reports/period")
+async def get_period_report(periode: str = "day", tanggal: Optional[date] = None, mulai: Optional[date] = None, sampai: Optional[date] = None, status: Optional[str] = None, detail: bool = True, breakdown: bool = False, current_user: Annotated[dict, Depends(get_current_user)] = None):
+    if current_user.get("role") not in ["admin", "kepsek", "master"]:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    start, end = resolve_period(periode, tanggal, mulai, sampai)
+    report = await build_period_report(start, end, status, detail, breakdown)
+    return {"periode": periode, **report}
 
 @api_router.get("/reports/monthly")
 async def get_monthly_report(bulan: str, tahun: int, status: Optional[str] = None, current_user: Annotated[dict, Depends(get_current_user)] = None):
     if current_user.get("role") not in ["admin", "kepsek", "master"]:
         raise HTTPException(status_code=403, detail="Not authorized")
-    
+
+    # Bulan yang sudah ditutup dibaca dari snapshot, tidak dihitung ulang
+    snapshot = await get_month_snapshot(bulan, tahun)
+    if snapshot:
+        return snapshot_monthly_report(snapshot, status)
+    return await cached_response("/reports/monthly", {"bulan": bulan, "tahun": tahun, "status": status}, current_user.get("role"),
+                                 ("bills", "payments"), lambda: build_monthly_report(bulan, tahun, status))
+
+async def build_monthly_report(bulan: str, tahun: int, status: Optional[str] = None, source=None) -> dict:
+    # source: database yang dibaca (default report_db; tutup buku membaca primary lewat db)
+    source = report_db if source is None else source
+
     # Filter bills for the summary
     bills_query = {"bulan": bulan, "tahun": tahun}
-    bills = await db.bills.find(bills_query, {"_id": 0}).to_list(1000)
+    bills = await source.bills.find(bills_query, {"_id": 0}).to_list(1000)
     
     # Filter payments for this month/year context
     # Get payments that were accepted and belong to bills of this month/year OR paid in this month/year?
@@ -1277,17 +2529,11 @@ async def get_monthly_report(bulan: str, tahun: int, status: Optional[str] = Non
         # Only belum lunas bills
         bills = [b for b in bills if b["status"] != "lunas"]
 
-    payments = await db.payments.find(payments_query, {"_id": 0}).to_list(1000)
+    payments = await source.payments.find(payments_query, {"_id": 0}).to_list(1000)
     
-    # Enrich payments with student data
-    enriched_payments = []
-    for p in payments:
-        student = await db.students.find_one({"id": p["id_siswa"]}, {"_id": 0})
-        bill = await db.bills.find_one({"id": p["id_tagihan"]}, {"_id": 0})
-        if student and bill:
-            p["siswa"] = {"nama": student["nama"], "nis": student["nis"], "kelas": student["kelas"]}
-            p["tagihan"] = {"bulan": bill["bulan"], "tahun": bill["tahun"]}
-            enriched_payments.append(p)
+    # Data siswa & tagihan dari snapshot; join hanya untuk pembayaran lama tanpa snapshot
+    await enrich_payments(payments)
+    enriched_payments = [p for p in payments if p.get("siswa") and p.get("tagihan")]
     
     total_pemasukan = sum(p["jumlah"] for p in payments)
     total_tagihan = len(bills)
@@ -1301,7 +2547,8 @@ async def get_monthly_report(bulan: str, tahun: int, status: Optional[str] = Non
         "total_tagihan": total_tagihan,
         "total_lunas": total_lunas,
         "total_belum_lunas": total_belum_lunas,
-        "payments": enriched_payments
+        "payments": enriched_payments,
+        "ditutup": False,
     }
 
 @api_router.get("/reports/student/{student_id}")
@@ -1317,6 +2564,8 @@ async def get_student_report(student_id: str, status: Optional[str] = None, curr
         logging.warning(f"Unauthorized report access: {user_id} ({role}) tried to access student {student_id}")
         raise HTTPException(status_code=403, detail="Not authorized")
     
+    # Per siswa & dibuka siswa sendiri: dibaca dari primary (db), bukan report_db, supaya
+    # pembayaran yang baru dikonfirmasi langsung terlihat tanpa menunggu replikasi
     student = await db.students.find_one({"id": student_id}, {"_id": 0})
     if not student:
         raise HTTPException(status_code=404, detail="Siswa tidak ditemukan")
@@ -1333,62 +2582,75 @@ async def get_student_report(student_id: str, status: Optional[str] = None, curr
     # Get all payments for this student
     payments = await db.payments.find({"id_siswa": student_id, "status": "diterima"}, {"_id": 0}).to_list(1000)
     
-    total_tagihan = sum(b["jumlah"] for b in bills)
-    total_dibayar = sum(p["jumlah"] for p in payments)
+    # Ringkasan dari student_accounts (tidak menjumlah ulang tagihan)
+    account = await db.student_accounts.find_one({"id_siswa": student_id}, {"_id": 0})
     
     return {
         "student": student,
         "bills": bills,
         "payments": payments,
-        "summary": {
-            "total_tagihan": total_tagihan,
-            "total_dibayar": total_dibayar,
-            "sisa_tagihan": total_tagihan - total_dibayar
-        }
+        "summary": account_summary(account, status if status in ("lunas", "belum") else None)
     }
 
+async def fetch_arrears_bills(kelas: Optional[str] = None, angkatan: Optional[str] = None, min_bulan: Optional[int] = None):
+    student_ids = await arrears_student_ids(kelas, angkatan)
+    cursor = report_db.bills.aggregate(arrears_pipeline(student_ids, min_bulan), allowDiskUse=True)
+    return await cursor.to_list(None)
+
 @api_router.get("/reports/arrears")
-async def get_arrears_report(current_user: Annotated[dict, Depends(get_current_user)] = None):
+async def get_arrears_report(current_user: Annotated[dict, Depends(get_current_user)] = None, kelas: Optional[str] = None, angkatan: Optional[str] = None, min_bulan: Optional[int] = None):
     if current_user.get("role") not in ["admin", "kepsek", "master"]:
         raise HTTPException(status_code=403, detail="Not authorized")
     
-    # Condition: status: "belum"
-    bills = await db.bills.find({"status": "belum"}, {"_id": 0}).to_list(5000)
-    
-    enriched_bills = []
-    for b in bills:
-        student = await db.students.find_one({"id": b["id_siswa"]}, {"_id": 0})
-        if student:
-            b["siswa"] = {"nama": student["nama"], "nis": student["nis"], "kelas": student["kelas"]}
-            enriched_bills.append(b)
-            
-    return enriched_bills
+    # Condition: status: "belum", tanpa batas jumlah (di-stream)
+    student_ids = await arrears_student_ids(kelas, angkatan)
+    cursor = report_db.bills.aggregate(arrears_pipeline(student_ids, min_bulan), allowDiskUse=True)
+    return StreamingResponse(stream_json_list(cursor), media_type="application/json")
+
+async def bill_totals_by_student(match: dict) -> dict:
+    """Total tagihan dan total lunas per siswa, dijumlahkan di MongoDB dalam satu agregasi."""
+    pipeline = [
+        {"$match": match},
+        {"$group": {
+            "_id": "$id_siswa",
+            "total": {"$sum": "$jumlah"},
+            "lunas": {"$sum": {"$cond": [{"$eq": ["$status", "lunas"]}, "$jumlah", 0]}},
+        }},
+    ]
+    return {row["_id"]: row async for row in report_db.bills.aggregate(pipeline, allowDiskUse=True)}
 
 @api_router.get("/reports/class-recap")
 async def get_class_recap_report(current_user: Annotated[dict, Depends(get_current_user)] = None):
     if current_user.get("role") not in ["admin", "kepsek", "master"]:
         raise HTTPException(status_code=403, detail="Not authorized")
-        
-    classes = await db.classes.find({}, {"_id": 0}).to_list(100)
-    recap = []
+    return await cached_response("/reports/class-recap", {}, current_user.get("role"),
+                                 ("classes", "students", "bills"), build_class_recap)
+
+async def build_class_recap() -> list:
+    classes = await report_db.classes.find({}, {"_id": 0}).to_list(None)
+    students = await report_db.students.find({}, {"_id": 0, "id": 1, "kelas": 1}).to_list(None)
+    bill_totals = await bill_totals_by_student({})
+    
+    # Satu pass: akumulasi total per kelas lewat dict, bukan query per kelas
+    per_class = {}
+    for s in students:
+        acc = per_class.setdefault(s.get("kelas"), {"jumlah_siswa": 0, "total_tagihan": 0, "pembayaran_lunas": 0})
+        acc["jumlah_siswa"] += 1
+        totals = bill_totals.get(s["id"])
+        if totals:
+            acc["total_tagihan"] += totals["total"]
+            acc["pembayaran_lunas"] += totals["lunas"]
     
+    recap = []
     for cls in classes:
         class_name = cls["nama_kelas"]
-        students = await db.students.find({"kelas": class_name}, {"_id": 0}).to_list(1000)
-        student_ids = [s["id"] for s in students]
-        
-        bills = await db.bills.find({"id_siswa": {"$in": student_ids}}, {"_id": 0}).to_list(5000)
-        
-        total_tagihan = sum(b["jumlah"] for b in bills)
-        pembayaran_lunas = sum(b["jumlah"] for b in bills if b["status"] == "lunas")
-        total_tunggakan = total_tagihan - pembayaran_lunas
-        
+        acc = per_class.get(class_name, {"jumlah_siswa": 0, "total_tagihan": 0, "pembayaran_lunas": 0})
         recap.append({
             "nama_kelas": class_name,
-            "jumlah_siswa": len(students),
-            "total_tagihan": total_tagihan,
-            "pembayaran_lunas": pembayaran_lunas,
-            "total_tunggakan": total_tunggakan
+            "jumlah_siswa": acc["jumlah_siswa"],
+            "total_tagihan": acc["total_tagihan"],
+            "pembayaran_lunas": acc["pembayaran_lunas"],
+            "total_tunggakan": acc["total_tagihan"] - acc["pembayaran_lunas"]
         })
         
     return recap
@@ -1398,38 +2660,40 @@ async def get_batch_report(batch: str, current_user: Annotated[dict, Depends(get
     if current_user.get("role") not in ["admin", "kepsek", "master"]:
         raise HTTPException(status_code=403, detail="Not authorized")
     # Get all students in this batch (angkatan)
-    students = await db.students.find({"angkatan": batch}, {"_id": 0}).to_list(1000)
+    students = await report_db.students.find({"angkatan": batch}, {"_id": 0, "id": 1, "kelas": 1}).to_list(None)
     student_ids = [s["id"] for s in students]
     
-    # Get all bills for these students
-    bills = await db.bills.find({"id_siswa": {"$in": student_ids}}, {"_id": 0}).to_list(10000)
-    
-    # Get all payments for these students
-    payments = await db.payments.find({"id_siswa": {"$in": student_ids}, "status": "diterima"}, {"_id": 0}).to_list(10000)
-    
-    total_estimasi = sum(b["jumlah"] for b in bills)
-    total_masuk = sum(p["jumlah"] for p in payments)
+    # Total tagihan & pembayaran diterima per siswa, masing-masing satu agregasi
+    bill_totals = await bill_totals_by_student({"id_siswa": {"$in": student_ids}})
+    payment_pipeline = [
+        {"$match": {"id_siswa": {"$in": student_ids}, "status": "diterima"}},
+        {"$group": {"_id": "$id_siswa", "total": {"$sum": "$jumlah"}}},
+    ]
+    paid_totals = {row["_id"]: row["total"] async for row in report_db.payments.aggregate(payment_pipeline, allowDiskUse=True)}
+    
+    # Per class breakdown within batch (satu pass lewat dict)
+    per_class = {}
+    total_estimasi = 0
+    total_masuk = 0
+    for s in students:
+        acc = per_class.setdefault(s.get("kelas", "-"), {"student_count": 0, "total_tagihan": 0, "total_dibayar": 0})
+        acc["student_count"] += 1
+        if s["id"] in bill_totals:
+            acc["total_tagihan"] += bill_totals[s["id"]]["total"]
+            total_estimasi += bill_totals[s["id"]]["total"]
+        if s["id"] in paid_totals:
+            acc["total_dibayar"] += paid_totals[s["id"]]
+            total_masuk += paid_totals[s["id"]]
     
-    # Per class breakdown within batch
-    classes = sorted(list(set(s.get("kelas", "-") for s in students)))
     class_breakdown = []
-    
-    for cls in classes:
-        cls_students = [s for s in students if s.get("kelas", "-") == cls]
-        cls_student_ids = [s["id"] for s in cls_students]
-        
-        cls_bills = [b for b in bills if b["id_siswa"] in cls_student_ids]
-        cls_payments = [p for p in payments if p["id_siswa"] in cls_student_ids]
-        
-        c_total = sum(b["jumlah"] for b in cls_bills)
-        c_paid = sum(p["jumlah"] for p in cls_payments)
-        
+    for cls in sorted(per_class):
+        acc = per_class[cls]
         class_breakdown.append({
             "kelas": cls,
-            "student_count": len(cls_students),
-            "total_tagihan": c_total,
-            "total_dibayar": c_paid,
-            "total_tunggakan": c_total - c_paid
+            "student_count": acc["student_count"],
+            "total_tagihan": acc["total_tagihan"],
+            "total_dibayar": acc["total_dibayar"],
+            "total_tunggakan": acc["total_tagihan"] - acc["total_dibayar"]
         })
     
     return {
@@ -1441,150 +2705,210 @@ async def get_batch_report(batch: str, current_user: Annotated[dict, Depends(get
         "class_breakdown": class_breakdown
     }
 
-import calendar
+# Analitik kelas x bulan (dihitung dengan pandas di report_analytics, di-cache per versi data)
+analytics_cache: dict = {}
+
+@api_router.get("/reports/analytics")
+async def get_payment_analytics(tahun: Optional[int] = None, format: str = "json", current_user: Annotated[dict, Depends(get_current_user)] = None):
+    if current_user.get("role") not in ["admin", "kepsek", "master"]:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    if format not in ("json", "xlsx"):
+        raise HTTPException(status_code=400, detail="Format harus json atau xlsx")
+    tahun = tahun or datetime.now(SCHOOL_TZ).year
+
+    version = await get_data_version("bills", "students")
+    cached = analytics_cache.get(tahun)
+    if not cached or cached["version"] != version or report_cache_expired(cached):
+        bills = await report_db.bills.aggregate([
+            {"$match": {"tahun": tahun}},
+            {"$project": {"_id": 0, "id_siswa": 1, "kelas": "$siswa.kelas", "bulan": 1, "jumlah": 1, "status": 1}},
+        ], allowDiskUse=True).to_list(None)
+        students = await report_db.students.find({}, {"_id": 0, "id": 1, "kelas": 1, "angkatan": 1}).to_list(None)
+        report = await run_lazy("report_analytics", "build_payment_matrix", bills, students, tahun, BULAN)
+        cached = {"version": version, "report": report, "xlsx": None, "at": time.monotonic()}
+        analytics_cache[tahun] = cached
+
+    if format == "json":
+        return cached["report"]
+    if cached["xlsx"] is None:
+        cached["xlsx"] = await run_lazy("report_analytics", "payment_matrix_xlsx", cached["report"])
+    return StreamingResponse(BytesIO(cached["xlsx"]), media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", headers={"Content-Disposition": f"attachment; filename=analitik_spp_{tahun}.xlsx"})
 
 @api_router.get("/reports/export-pdf")
 async def export_pdf(bulan: str, tahun: int, status: Optional[str] = None, current_user: Annotated[dict, Depends(get_current_user)] = None):
     if current_user.get("role") not in ["admin", "kepsek", "master"]:
         raise HTTPException(status_code=403, detail="Not authorized")
     
+    status_suffix = f"_{status}" if status else ""
+    headers = {"Content-Disposition": f"attachment; filename=laporan_{bulan}_{tahun}{status_suffix}.pdf"}
+    snapshot = await get_month_snapshot(bulan, tahun)
+    stored = snapshot_file(snapshot, "pdf", status) if snapshot else None
+    if stored:
+        return StreamingResponse(BytesIO(await asyncio.to_thread(stored.read_bytes)), media_type="application/pdf", headers=headers)
+
     # Get filtered data
-    report_data = await get_monthly_report(bulan, tahun, status, current_user)
-    payments = report_data["payments"]
-    
-    # Create PDF
-    buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=A4)
-    elements = []
-    
-    # Styles
-    styles = getSampleStyleSheet()
-    title_style = ParagraphStyle(
-        'CustomTitle',
-        parent=styles['Heading1'],
-        fontSize=16,
-        textColor=colors.HexColor('#1e3a8a'),
-        spaceAfter=30,
-        alignment=TA_CENTER
-    )
-    
-    # --- Header with Logo ---
+    report_data = snapshot_monthly_report(snapshot, status) if snapshot else await build_monthly_report(bulan, tahun, status)
     school = await db.school_profile.find_one({"id": "main_profile"}, {"_id": 0})
-    if not school:
-        school = {"nama_sekolah": "SMK MEKAR MURNI", "alamat": "Jl. Pendidikan No. 123", "no_telp": "-"}
-
-    h_style = ParagraphStyle('RepHeader', fontSize=14, fontName='Helvetica-Bold', alignment=TA_CENTER)
-    a_style = ParagraphStyle('RepAddr', fontSize=10, fontName='Helvetica', alignment=TA_CENTER)
-    
-    logo_path = uploads_dir / "logo.png"
-    if logo_path.exists():
-        logo_img = Image(str(logo_path), width=0.8*inch, height=0.8*inch)
-        school_info = [
-            [Paragraph(school['nama_sekolah'].upper(), h_style)],
-            [Paragraph(school['alamat'], a_style)],
-            [Paragraph(f"Telp: {school['no_telp']}", a_style)]
-        ]
-        info_table = Table(school_info, colWidths=[5*inch])
-        header_table = Table([[logo_img, info_table]], colWidths=[1*inch, 5.5*inch])
-        header_table.setStyle(TableStyle([('VALIGN', (0,0), (-1,-1), 'MIDDLE')]))
-        elements.append(header_table)
-    else:
-        elements.append(Paragraph(school['nama_sekolah'].upper(), h_style))
-        elements.append(Paragraph(school['alamat'], a_style))
-    
-    elements.append(Spacer(1, 0.1*inch))
-    elements.append(Paragraph("-" * 95, a_style))
-    elements.append(Spacer(1, 0.2*inch))
-    
-    # Title
-    filter_text = f" ({status.upper()})" if status and status != 'all' else ""
-    title = Paragraph(f"LAPORAN PEMBAYARAN SPP BULANAN{filter_text}<br/>{bulan} {tahun}", title_style)
-    elements.append(title)
-    elements.append(Spacer(1, 0.2*inch))
-    
-    # Table data
-    data = [['No', 'NIS', 'Nama', 'Kelas', 'Tgl Bayar', 'Jumlah', 'Status']]
-    
-    total_jumlah = 0
-    for idx, p in enumerate(payments, 1):
-        # Format date from ISO to DD/MM/YYYY
-        tgl_bayar = "-"
-        if 'tanggal_bayar' in p:
-            try:
-                dt = datetime.fromisoformat(p['tanggal_bayar'].replace('Z', '+00:00'))
-                tgl_bayar = dt.strftime("%d/%m/%Y")
-            except:
-                tgl_bayar = p['tanggal_bayar'].split('T')[0]
-
-        data.append([
-            str(idx),
-            p['siswa']['nis'],
-            p['siswa']['nama'],
-            p['siswa']['kelas'],
-            tgl_bayar,
-            f"Rp {p['jumlah']:,.0f}",
-            p['status'].upper()
-        ])
-        total_jumlah += p['jumlah']
-    
-    # Add total row
-    data.append(['', '', '', '', 'Total:', f"Rp {total_jumlah:,.0f}", ''])
-    
-    # Create table
-    table = Table(data, colWidths=[0.4*inch, 0.8*inch, 1.8*inch, 0.8*inch, 1*inch, 1.2*inch, 1*inch])
-    table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#1e3a8a')),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, 0), 9),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-        ('GRID', (0, 0), (-1, -1), 1, colors.black),
-        ('BACKGROUND', (0, -1), (-1, -1), colors.HexColor('#fbbf24')),
-        ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold'),
-    ]))
-    
-    elements.append(table)
-    
-    # Build PDF
-    doc.build(elements)
-    buffer.seek(0)
-    
-    status_suffix = f"_{status}" if status else ""
-    return StreamingResponse(buffer, media_type="application/pdf", headers={"Content-Disposition": f"attachment; filename=laporan_{bulan}_{tahun}{status_suffix}.pdf"})
+    pdf = await run_lazy("report_render", "monthly_pdf", report_data, school, uploads_dir / "logo.png", status, SCHOOL_TZ)
+    return StreamingResponse(BytesIO(pdf), media_type="application/pdf", headers=headers)
 
 @api_router.get("/reports/export-xlsx")
 async def export_xlsx(bulan: str, tahun: int, status: Optional[str] = None, current_user: Annotated[dict, Depends(get_current_user)] = None):
     if current_user.get("role") not in ["admin", "kepsek", "master"]:
         raise HTTPException(status_code=403, detail="Not authorized")
         
-    report_data = await get_monthly_report(bulan, tahun, status, current_user)
-    payments = report_data["payments"]
-    
-    # Prepare data
-    data_list = []
-    for p in payments:
-        tgl_bayar = p.get('tanggal_bayar', '-').split('T')[0] if 'tanggal_bayar' in p else '-'
-        data_list.append({
-            'NIS': p['siswa']['nis'],
-            'Nama': p['siswa']['nama'],
-            'Kelas': p['siswa']['kelas'],
-            'Bulan Tagihan': p['tagihan']['bulan'],
-            'Tahun Tagihan': p['tagihan']['tahun'],
-            'Tanggal Bayar': tgl_bayar,
-            'Jumlah': p['jumlah'],
-            'Status': p['status'].upper()
-        })
-    
-    # Create Excel
-    df = pd.DataFrame(data_list)
-    buffer = BytesIO()
-    with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
-        df.to_excel(writer, index=False, sheet_name='Laporan SPP')
-    buffer.seek(0)
-    
     status_suffix = f"_{status}" if status else ""
-    return StreamingResponse(buffer, media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", headers={"Content-Disposition": f"attachment; filename=laporan_{bulan}_{tahun}{status_suffix}.xlsx"})
+    headers = {"Content-Disposition": f"attachment; filename=laporan_{bulan}_{tahun}{status_suffix}.xlsx"}
+    snapshot = await get_month_snapshot(bulan, tahun)
+    stored = snapshot_file(snapshot, "xlsx", status) if snapshot else None
+    if stored:
+        data = await asyncio.to_thread(stored.read_bytes)
+    else:
+        report_data = snapshot_monthly_report(snapshot, status) if snapshot else await build_monthly_report(bulan, tahun, status)
+        data = await run_lazy("report_render", "monthly_xlsx", report_data, SCHOOL_TZ)
+    return StreamingResponse(BytesIO(data), media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", headers=headers)
+
+# Tutup buku bulanan (koleksi report_snapshots, _id "<tahun>-<bulan>"). Saat bulan ditutup,
+# laporan bulanan (total + daftar pembayaran) dibekukan dan PDF/XLSX-nya dirender sekali
+# ke report_snapshots/<sha256>.<ext>. Laporan & export bulan tertutup dilayani dari snapshot;
+# koreksi susulan lewat rebuild (bulan tetap tertutup) atau reopen (kembali ke data live).
+report_snapshots_dir = ROOT_DIR / 'report_snapshots'
+SNAPSHOT_PDF_STATUSES = (None, "lunas", "belum")
+
+def month_key(bulan: str, tahun: int) -> str:
+    return f"{tahun}-{bulan}"
+
+async def get_month_snapshot(bulan: str, tahun: int) -> Optional[dict]:
+    return await db.report_snapshots.find_one({"_id": month_key(bulan, tahun), "status": "closed"})
+
+def snapshot_monthly_report(snapshot: dict, status: Optional[str] = None) -> dict:
+    report = {**snapshot["report"], "ditutup": True, "ditutup_pada": snapshot["closed_at"]}
+    # Filter status hanya memengaruhi hitungan tagihan, sama seperti build_monthly_report
+    if status == "lunas":
+        report.update(total_tagihan=report["total_lunas"], total_belum_lunas=0)
+    elif status == "belum":
+        report.update(total_tagihan=report["total_belum_lunas"], total_lunas=0)
+    return report
+
+def snapshot_file(snapshot: dict, fmt: str, status: Optional[str] = None) -> Optional[Path]:
+    # XLSX tidak bergantung pada filter status; PDF hanya beda judul
+    key = f"{fmt}_{status}" if fmt == "pdf" and status else fmt
+    sha = snapshot.get("files", {}).get(key)
+    if not sha:
+        return None
+    path = report_snapshots_dir / f"{sha}.{fmt}"
+    return path if path.exists() else None
+
+def write_snapshot_files(report: dict, school: Optional[dict]) -> dict:
+    # Dijalankan di thread (asyncio.to_thread), jadi import reportlab/pandas tidak memblok event loop
+    import report_render
+    report_snapshots_dir.mkdir(parents=True, exist_ok=True)
+    rendered = {"xlsx": ("xlsx", report_render.monthly_xlsx(report, SCHOOL_TZ))}
+    logo_path = uploads_dir / "logo.png"
+    for bill_status in SNAPSHOT_PDF_STATUSES:
+        rendered[f"pdf_{bill_status}" if bill_status else "pdf"] = ("pdf", report_render.monthly_pdf(report, school, logo_path, bill_status, SCHOOL_TZ))
+    files = {}
+    for key, (ext, data) in rendered.items():
+        sha = hashlib.sha256(data).hexdigest()
+        path = report_snapshots_dir / f"{sha}.{ext}"
+        if not path.exists():
+            fd, tmp = tempfile.mkstemp(dir=report_snapshots_dir, suffix=".part")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        files[key] = sha
+    return files
+
+async def build_month_snapshot(bulan: str, tahun: int) -> dict:
+    # Snapshot dibekukan dari primary, bukan dari secondary yang mungkin tertinggal
+    report = await build_monthly_report(bulan, tahun, source=db)
+    school = await db.school_profile.find_one({"id": "main_profile"}, {"_id": 0})
+    files = await asyncio.to_thread(write_snapshot_files, report, school)
+    return {"report": report, "files": files, "file_ids": list(files.values()), "jumlah_pembayaran": len(report["payments"])}
+
+async def release_snapshot_files(file_ids: list):
+    # File berbasis hash bisa dipakai snapshot lain (mis. XLSX kosong yang identik)
+    for sha in set(file_ids or []):
+        if not await db.report_snapshots.find_one({"file_ids": sha}, {"_id": 1}):
+            for path in report_snapshots_dir.glob(f"{sha}.*"):
+                path.unlink(missing_ok=True)
+
+def require_closable_month(payload: MonthClose, current_user: dict) -> str:
+    if current_user.get("role") not in ["admin", "master"]:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    if payload.bulan not in BULAN:
+        raise HTTPException(status_code=400, detail="Nama bulan tidak valid")
+    return month_key(payload.bulan, payload.tahun)
+
+def snapshot_view(snapshot: dict) -> dict:
+    view = {k: v for k, v in snapshot.items() if k not in ("_id", "report", "files", "file_ids")}
+    if snapshot.get("report"):
+        view.update({k: snapshot["report"][k] for k in ("total_pemasukan", "total_tagihan", "total_lunas", "total_belum_lunas")})
+    return view
+
+@api_router.get("/reports/monthly/snapshots")
+async def list_month_snapshots(current_user: Annotated[dict, Depends(get_current_user)], tahun: Optional[int] = None):
+    if current_user.get("role") not in ["admin", "kepsek", "master"]:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    query = {"tahun": tahun} if tahun else {}
+    snapshots = await db.report_snapshots.find(query, {"report.payments": 0}).sort([("tahun", -1), ("bulan_ke", -1)]).to_list(240)
+    return [snapshot_view(s) for s in snapshots]
+
+@api_router.post("/reports/monthly/close")
+async def close_month(payload: MonthClose, current_user: Annotated[dict, Depends(get_current_user)]):
+    key = require_closable_month(payload, current_user)
+    month = BULAN.index(payload.bulan) + 1
+    if local_month_range(payload.tahun, month)[1] > datetime.now(timezone.utc):
+        raise HTTPException(status_code=400, detail="Bulan belum berakhir, belum bisa ditutup")
+    if await get_month_snapshot(payload.bulan, payload.tahun):
+        raise HTTPException(status_code=409, detail="Bulan sudah ditutup")
+
+    snapshot = await build_month_snapshot(payload.bulan, payload.tahun)
+    fields = {**snapshot, "bulan": payload.bulan, "tahun": payload.tahun, "bulan_ke": month, "status": "closed",
+              "closed_at": datetime.now(timezone.utc), "closed_by": current_user.get("username")}
+    try:
+        # Syarat status != closed + _id unik: dua request tutup buku bersamaan, hanya satu yang menang
+        await db.report_snapshots.update_one({"_id": key, "status": {"$ne": "closed"}}, {"$set": fields}, upsert=True)
+    except DuplicateKeyError:
+        await release_snapshot_files(snapshot["file_ids"])
+        raise HTTPException(status_code=409, detail="Bulan sudah ditutup")
+
+    await log_activity(current_user.get("username"), current_user.get("role"), "report", f"Menutup buku {payload.bulan} {payload.tahun}")
+    return snapshot_view(fields)
+
+@api_router.post("/reports/monthly/rebuild")
+async def rebuild_month(payload: MonthClose, current_user: Annotated[dict, Depends(get_current_user)]):
+    key = require_closable_month(payload, current_user)
+    old = await get_month_snapshot(payload.bulan, payload.tahun)
+    if not old:
+        raise HTTPException(status_code=404, detail="Bulan belum ditutup")
+
+    snapshot = await build_month_snapshot(payload.bulan, payload.tahun)
+    updated = await db.report_snapshots.find_one_and_update(
+        {"_id": key, "status": "closed"},
+        {"$set": {**snapshot, "rebuilt_at": datetime.now(timezone.utc), "rebuilt_by": current_user.get("username")}},
+        return_document=ReturnDocument.AFTER)
+    await release_snapshot_files([sha for sha in old.get("file_ids", []) if sha not in snapshot["file_ids"]])
+    if not updated:
+        await release_snapshot_files(snapshot["file_ids"])
+        raise HTTPException(status_code=409, detail="Bulan dibuka kembali saat snapshot dibangun ulang")
+
+    await log_activity(current_user.get("username"), current_user.get("role"), "report", f"Membangun ulang snapshot {payload.bulan} {payload.tahun}")
+    return snapshot_view(updated)
+
+@api_router.post("/reports/monthly/reopen")
+async def reopen_month(payload: MonthClose, current_user: Annotated[dict, Depends(get_current_user)]):
+    key = require_closable_month(payload, current_user)
+    old = await db.report_snapshots.find_one_and_update(
+        {"_id": key, "status": "closed"},
+        {"$set": {"status": "open", "reopened_at": datetime.now(timezone.utc), "reopened_by": current_user.get("username")},
+         "$unset": {"report": "", "files": "", "file_ids": ""}})
+    if not old:
+        raise HTTPException(status_code=404, detail="Bulan belum ditutup")
+    await release_snapshot_files(old.get("file_ids"))
+
+    await log_activity(current_user.get("username"), current_user.get("role"), "report", f"Membuka kembali buku {payload.bulan} {payload.tahun}")
+    return {"message": f"Buku {payload.bulan} {payload.tahun} dibuka kembali"}
 
 @api_router.get("/reports/student/{student_id}/export-pdf")
 async def export_student_pdf(student_id: str, status: Optional[str] = None, current_user: Annotated[dict, Depends(get_current_user)] = None):
@@ -1592,350 +2916,65 @@ async def export_student_pdf(student_id: str, status: Optional[str] = None, curr
     logging.info(f"Export student PDF request: student={student_id}, user={current_user.get('user_id')}, status={status}")
     report = await get_student_report(student_id, status, current_user)
     student = report['student']
-    
-    buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=A4)
-    elements = []
-    styles = getSampleStyleSheet()
-    
-    title_style = ParagraphStyle('Title', parent=styles['Heading1'], fontSize=16, alignment=TA_CENTER, spaceAfter=20)
-    
-    # --- Header with Logo ---
     school = await db.school_profile.find_one({"id": "main_profile"}, {"_id": 0})
-    if not school:
-        school = {"nama_sekolah": "SMK MEKAR MURNI", "alamat": "Jl. Pendidikan No. 123", "no_telp": "-"}
-
-    h_style = ParagraphStyle('RepHeader', fontSize=14, fontName='Helvetica-Bold', alignment=TA_CENTER)
-    a_style = ParagraphStyle('RepAddr', fontSize=10, fontName='Helvetica', alignment=TA_CENTER)
-    
-    logo_path = uploads_dir / "logo.png"
-    if logo_path.exists():
-        logo_img = Image(str(logo_path), width=0.8*inch, height=0.8*inch)
-        school_info = [
-            [Paragraph(school['nama_sekolah'].upper(), h_style)],
-            [Paragraph(school['alamat'], a_style)],
-            [Paragraph(f"Telp: {school['no_telp']}", a_style)]
-        ]
-        info_table = Table(school_info, colWidths=[5*inch])
-        header_table = Table([[logo_img, info_table]], colWidths=[1*inch, 5.5*inch])
-        header_table.setStyle(TableStyle([('VALIGN', (0,0), (-1,-1), 'MIDDLE')]))
-        elements.append(header_table)
-    else:
-        elements.append(Paragraph(school['nama_sekolah'].upper(), h_style))
-        elements.append(Paragraph(school['alamat'], a_style))
-    
-    elements.append(Spacer(1, 0.1*inch))
-    elements.append(Paragraph("-" * 95, a_style))
-    elements.append(Spacer(1, 0.2*inch))
-    
-    status_text = f" ({status.upper()})" if status else ""
-    elements.append(Paragraph(f"LAPORAN PEMBAYARAN SISWA{status_text}", title_style))
-    
-    info_data = [
-        [Paragraph(f"Nama: <b>{student.get('nama', '-')}</b>", styles['Normal']), Paragraph(f"NIS: <b>{student.get('nis', '-')}</b>", styles['Normal'])],
-        [Paragraph(f"Kelas: <b>{student.get('kelas', '-')}</b>", styles['Normal']), Paragraph(f"Angkatan: <b>{student.get('angkatan', '-')}</b>", styles['Normal'])]
-    ]
-    elements.append(Table(info_data, colWidths=[3*inch, 3*inch]))
-    elements.append(Spacer(1, 0.2*inch))
-    
-    data = [['No', 'Bulan/Tahun', 'Jumlah', 'Status']]
-    for idx, b in enumerate(report['bills'], 1):
-        data.append([str(idx), f"{b['bulan']} {b['tahun']}", f"Rp {b['jumlah']:,.0f}", b['status'].upper()])
-    
-    summary = report['summary']
-    data.append(['', 'Total Tagihan', f"Rp {summary['total_tagihan']:,.0f}", ''])
-    data.append(['', 'Total Dibayar', f"Rp {summary['total_dibayar']:,.0f}", ''])
-    data.append(['', 'Sisa Tagihan', f"Rp {summary['sisa_tagihan']:,.0f}", ''])
-    
-    t = Table(data, colWidths=[0.5*inch, 2.5*inch, 1.5*inch, 1.5*inch])
-    t.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#1e3a8a')),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('GRID', (0, 0), (-1, -4), 1, colors.black),
-        ('FONTNAME', (0, -3), (-1, -1), 'Helvetica-Bold')
-    ]))
-    elements.append(t)
-    
-    doc.build(elements)
-    buffer.seek(0)
+    pdf = await run_lazy("report_render", "student_pdf", report, school, uploads_dir / "logo.png", status)
     nis_val = str(student.get('nis', 'data'))
     status_suffix = f"_{status}" if status else ""
-    return StreamingResponse(buffer, media_type="application/pdf", headers={"Content-Disposition": f"attachment; filename=laporan_siswa_{nis_val}{status_suffix}.pdf"})
+    return StreamingResponse(BytesIO(pdf), media_type="application/pdf", headers={"Content-Disposition": f"attachment; filename=laporan_siswa_{nis_val}{status_suffix}.pdf"})
 
 @api_router.get("/reports/class/{class_name}/export-pdf")
 async def export_class_pdf(class_name: str, current_user: Annotated[dict, Depends(get_current_user)]):
     report = await get_class_report(class_name, current_user)
-    
-    buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=A4)
-    elements = []
-    styles = getSampleStyleSheet()
-    
-    title_style = ParagraphStyle('Title', parent=styles['Heading1'], fontSize=16, alignment=TA_CENTER, spaceAfter=20)
-    
-    # --- Header with Logo ---
     school = await db.school_profile.find_one({"id": "main_profile"}, {"_id": 0})
-    if not school:
-        school = {"nama_sekolah": "SMK MEKAR MURNI", "alamat": "Jl. Pendidikan No. 123", "no_telp": "-"}
-
-    h_style = ParagraphStyle('RepHeader', fontSize=14, fontName='Helvetica-Bold', alignment=TA_CENTER)
-    a_style = ParagraphStyle('RepAddr', fontSize=10, fontName='Helvetica', alignment=TA_CENTER)
-    
-    logo_path = uploads_dir / "logo.png"
-    if logo_path.exists():
-        logo_img = Image(str(logo_path), width=0.8*inch, height=0.8*inch)
-        school_info = [
-            [Paragraph(school['nama_sekolah'].upper(), h_style)],
-            [Paragraph(school['alamat'], a_style)],
-            [Paragraph(f"Telp: {school['no_telp']}", a_style)]
-        ]
-        info_table = Table(school_info, colWidths=[5*inch])
-        header_table = Table([[logo_img, info_table]], colWidths=[1*inch, 5.5*inch])
-        header_table.setStyle(TableStyle([('VALIGN', (0,0), (-1,-1), 'MIDDLE')]))
-        elements.append(header_table)
-    else:
-        elements.append(Paragraph(school['nama_sekolah'].upper(), h_style))
-        elements.append(Paragraph(school['alamat'], a_style))
-    
-    elements.append(Spacer(1, 0.1*inch))
-    elements.append(Paragraph("-" * 95, a_style))
-    elements.append(Spacer(1, 0.2*inch))
-    
-    elements.append(Paragraph(f"LAPORAN PEMBAYARAN KELAS {class_name}", title_style))
-    
-    summary_data = [
-        ["Total Estimasi", f"Rp {report['total_estimasi']:,.0f}"],
-        ["Total Masuk", f"Rp {report['total_masuk']:,.0f}"],
-        ["Total Tunggakan", f"Rp {report['total_tunggakan']:,.0f}"],
-        ["Jumlah Siswa", str(report['student_count'])]
-    ]
-    elements.append(Table(summary_data, colWidths=[2*inch, 2*inch]))
-    elements.append(Spacer(1, 0.2*inch))
-    
-    data = [['NIS', 'Nama', 'Tagihan', 'Dibayar', 'Status']]
-    for s in report['breakdown']:
-        data.append([s['nis'], s['nama'], f"Rp {s['total_tagihan']:,.0f}", f"Rp {s['total_dibayar']:,.0f}", s['status']])
-    
-    t = Table(data, colWidths=[1*inch, 2.5*inch, 1.2*inch, 1.2*inch, 1*inch])
-    t.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#1e3a8a')),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('GRID', (0, 0), (-1, -1), 1, colors.black),
-    ]))
-    elements.append(t)
-    
-    doc.build(elements)
-    buffer.seek(0)
-    return StreamingResponse(buffer, media_type="application/pdf", headers={"Content-Disposition": f"attachment; filename=laporan_kelas_{class_name}.pdf"})
+    pdf = await run_lazy("report_render", "class_pdf", report, class_name, school, uploads_dir / "logo.png")
+    return StreamingResponse(BytesIO(pdf), media_type="application/pdf", headers={"Content-Disposition": f"attachment; filename=laporan_kelas_{class_name}.pdf"})
 
 @api_router.get("/reports/batch/{batch}/export-pdf")
 async def export_batch_pdf(batch: str, current_user: Annotated[dict, Depends(get_current_user)]):
     report = await get_batch_report(batch, current_user)
-    
-    buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=A4)
-    elements = []
-    styles = getSampleStyleSheet()
-    
-    title_style = ParagraphStyle('Title', parent=styles['Heading1'], fontSize=16, alignment=TA_CENTER, spaceAfter=20)
-    
-    # --- Header with Logo ---
     school = await db.school_profile.find_one({"id": "main_profile"}, {"_id": 0})
-    if not school:
-        school = {"nama_sekolah": "SMK MEKAR MURNI", "alamat": "Jl. Pendidikan No. 123", "no_telp": "-"}
-
-    h_style = ParagraphStyle('RepHeader', fontSize=14, fontName='Helvetica-Bold', alignment=TA_CENTER)
-    a_style = ParagraphStyle('RepAddr', fontSize=10, fontName='Helvetica', alignment=TA_CENTER)
-    
-    logo_path = uploads_dir / "logo.png"
-    if logo_path.exists():
-        logo_img = Image(str(logo_path), width=0.8*inch, height=0.8*inch)
-        school_info = [
-            [Paragraph(school['nama_sekolah'].upper(), h_style)],
-            [Paragraph(school['alamat'], a_style)],
-            [Paragraph(f"Telp: {school['no_telp']}", a_style)]
-        ]
-        info_table = Table(school_info, colWidths=[5*inch])
-        header_table = Table([[logo_img, info_table]], colWidths=[1*inch, 5.5*inch])
-        header_table.setStyle(TableStyle([('VALIGN', (0,0), (-1,-1), 'MIDDLE')]))
-        elements.append(header_table)
-    else:
-        elements.append(Paragraph(school['nama_sekolah'].upper(), h_style))
-        elements.append(Paragraph(school['alamat'], a_style))
-    
-    elements.append(Spacer(1, 0.1*inch))
-    elements.append(Paragraph("-" * 95, a_style))
-    elements.append(Spacer(1, 0.2*inch))
-    
-    elements.append(Paragraph(f"LAPORAN PEMBAYARAN ANGKATAN {batch}", title_style))
-    
-    data = [['Kelas', 'Siswa', 'Tagihan', 'Dibayar', 'Tunggakan']]
-    for c in report['class_breakdown']:
-        data.append([c['kelas'], str(c['student_count']), f"Rp {c['total_tagihan']:,.0f}", f"Rp {c['total_dibayar']:,.0f}", f"Rp {c['total_tunggakan']:,.0f}"])
-    
-    data.append(['TOTAL', str(report['student_count']), f"Rp {report['total_estimasi']:,.0f}", f"Rp {report['total_masuk']:,.0f}", f"Rp {report['total_tunggakan']:,.0f}"])
-    
-    t = Table(data, colWidths=[1.5*inch, 0.8*inch, 1.5*inch, 1.5*inch, 1.5*inch])
-    t.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#1e3a8a')),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('GRID', (0, 0), (-1, -1), 1, colors.black),
-        ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold')
-    ]))
-    elements.append(t)
-    
-    doc.build(elements)
-    buffer.seek(0)
-    return StreamingResponse(buffer, media_type="application/pdf", headers={"Content-Disposition": f"attachment; filename=laporan_angkatan_{batch}.pdf"})
+    pdf = await run_lazy("report_render", "batch_pdf", report, batch, school, uploads_dir / "logo.png")
+    return StreamingResponse(BytesIO(pdf), media_type="application/pdf", headers={"Content-Disposition": f"attachment; filename=laporan_angkatan_{batch}.pdf"})
 
 @api_router.get("/reports/student/{student_id}/export-xlsx")
 async def export_student_xlsx(student_id: str, status: Optional[str] = None, current_user: Annotated[dict, Depends(get_current_user)] = None):
     report = await get_student_report(student_id, status, current_user)
     student = report['student']
-    
-    data_list = []
-    for b in report['bills']:
-        data_list.append({
-            'Bulan': b['bulan'],
-            'Tahun': b['tahun'],
-            'Jumlah': b['jumlah'],
-            'Status': b['status'].upper()
-        })
-    
-    df = pd.DataFrame(data_list)
-    buffer = BytesIO()
-    with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
-        df.to_excel(writer, index=False, sheet_name='Laporan Siswa')
-    buffer.seek(0)
-    
+    data = await run_lazy("report_render", "student_xlsx", report)
     nis_val = str(student.get('nis', 'data'))
     status_suffix = f"_{status}" if status else ""
-    return StreamingResponse(buffer, media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", headers={"Content-Disposition": f"attachment; filename=laporan_siswa_{nis_val}{status_suffix}.xlsx"})
+    return StreamingResponse(BytesIO(data), media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", headers={"Content-Disposition": f"attachment; filename=laporan_siswa_{nis_val}{status_suffix}.xlsx"})
 
 @api_router.get("/reports/class/{class_name}/export-xlsx")
 async def export_class_xlsx(class_name: str, current_user: Annotated[dict, Depends(get_current_user)]):
     report = await get_class_report(class_name, current_user)
-    
-    data_list = []
-    for s in report['breakdown']:
-        data_list.append({
-            'NIS': s['nis'],
-            'Nama': s['nama'],
-            'Total Tagihan': s['total_tagihan'],
-            'Total Dibayar': s['total_dibayar'],
-            'Tunggakan': s['total_tagihan'] - s['total_dibayar'],
-            'Status': s['status']
-        })
-    
-    df = pd.DataFrame(data_list)
-    buffer = BytesIO()
-    with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
-        df.to_excel(writer, index=False, sheet_name=f'Kelas {class_name}')
-    buffer.seek(0)
-    
-    return StreamingResponse(buffer, media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", headers={"Content-Disposition": f"attachment; filename=laporan_kelas_{class_name}.xlsx"})
+    data = await run_lazy("report_render", "class_xlsx", report, class_name)
+    return StreamingResponse(BytesIO(data), media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", headers={"Content-Disposition": f"attachment; filename=laporan_kelas_{class_name}.xlsx"})
 
 @api_router.get("/reports/batch/{batch}/export-xlsx")
 async def export_batch_xlsx(batch: str, current_user: Annotated[dict, Depends(get_current_user)]):
     report = await get_batch_report(batch, current_user)
-    
-    data_list = []
-    for c in report['class_breakdown']:
-        data_list.append({
-            'Kelas': c['kelas'],
-            'Jumlah Siswa': c['student_count'],
-            'Total Tagihan': c['total_tagihan'],
-            'Total Dibayar': c['total_dibayar'],
-            'Tunggakan': c['total_tunggakan']
-        })
-    
-    df = pd.DataFrame(data_list)
-    buffer = BytesIO()
-    with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
-        df.to_excel(writer, index=False, sheet_name=f'Angkatan {batch}')
-    buffer.seek(0)
-    
-    return StreamingResponse(buffer, media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", headers={"Content-Disposition": f"attachment; filename=laporan_angkatan_{batch}.xlsx"})
+    data = await run_lazy("report_render", "batch_xlsx", report, batch)
+    return StreamingResponse(BytesIO(data), media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", headers={"Content-Disposition": f"attachment; filename=laporan_angkatan_{batch}.xlsx"})
+
 @api_router.get("/reports/arrears/export-pdf")
-async def export_arrears_pdf(current_user: Annotated[dict, Depends(get_current_user)] = None):
+async def export_arrears_pdf(current_user: Annotated[dict, Depends(get_current_user)] = None, kelas: Optional[str] = None, angkatan: Optional[str] = None, min_bulan: Optional[int] = None):
     if current_user.get("role") not in ["admin", "kepsek", "master"]:
         raise HTTPException(status_code=403, detail="Not authorized")
         
-    bills = await get_arrears_report(current_user)
-    
-    buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=A4)
-    elements = []
-    styles = getSampleStyleSheet()
-    
-    title_style = ParagraphStyle('Title', parent=styles['Heading1'], fontSize=16, alignment=TA_CENTER, spaceAfter=20)
-    
-    # --- Header ---
+    bills = await fetch_arrears_bills(kelas, angkatan, min_bulan)
     school = await db.school_profile.find_one({"id": "main_profile"}, {"_id": 0})
-    if not school: school = {"nama_sekolah": "SMK MEKAR MURNI", "alamat": "Jl. Pendidikan No. 123", "no_telp": "-"}
-    h_style = ParagraphStyle('RepHeader', fontSize=14, fontName='Helvetica-Bold', alignment=TA_CENTER)
-    a_style = ParagraphStyle('RepAddr', fontSize=10, fontName='Helvetica', alignment=TA_CENTER)
-    
-    elements.append(Paragraph(school['nama_sekolah'].upper(), h_style))
-    elements.append(Paragraph(school['alamat'], a_style))
-    elements.append(Spacer(1, 0.1*inch))
-    elements.append(Paragraph("-" * 95, a_style))
-    elements.append(Spacer(1, 0.2*inch))
-    
-    elements.append(Paragraph(f"LAPORAN TUNGGAKAN SISWA", title_style))
-    
-    data = [['No', 'NIS', 'Nama', 'Kelas', 'Bulan/Tahun', 'Jumlah']]
-    total_tunggakan = 0
-    for idx, b in enumerate(bills, 1):
-        data.append([
-            str(idx),
-            b['siswa']['nis'],
-            b['siswa']['nama'],
-            b['siswa']['kelas'],
-            f"{b['bulan']} {b['tahun']}",
-            f"Rp {b['jumlah']:,.0f}"
-        ])
-        total_tunggakan += b['jumlah']
-    
-    data.append(['', '', '', '', 'Total:', f"Rp {total_tunggakan:,.0f}"])
-    
-    t = Table(data, colWidths=[0.5*inch, 1*inch, 2*inch, 1*inch, 1*inch, 1.2*inch])
-    t.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#1e3a8a')),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('GRID', (0, 0), (-1, -2), 1, colors.black),
-        ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold')
-    ]))
-    elements.append(t)
-    
-    doc.build(elements)
-    buffer.seek(0)
-    return StreamingResponse(buffer, media_type="application/pdf", headers={"Content-Disposition": "attachment; filename=laporan_tunggakan.pdf"})
+    pdf = await run_lazy("report_render", "arrears_pdf", bills, school)
+    return StreamingResponse(BytesIO(pdf), media_type="application/pdf", headers={"Content-Disposition": "attachment; filename=laporan_tunggakan.pdf"})
 
 @api_router.get("/reports/arrears/export-xlsx")
-async def export_arrears_xlsx(current_user: Annotated[dict, Depends(get_current_user)] = None):
+async def export_arrears_xlsx(current_user: Annotated[dict, Depends(get_current_user)] = None, kelas: Optional[str] = None, angkatan: Optional[str] = None, min_bulan: Optional[int] = None):
     if current_user.get("role") not in ["admin", "kepsek", "master"]:
         raise HTTPException(status_code=403, detail="Not authorized")
         
-    bills = await get_arrears_report(current_user)
-    
-    data_list = []
-    for b in bills:
-        data_list.append({
-            'NIS': b['siswa']['nis'],
-            'Nama': b['siswa']['nama'],
-            'Kelas': b['siswa']['kelas'],
-            'Bulan': b['bulan'],
-            'Tahun': b['tahun'],
-            'Jumlah': b['jumlah']
-        })
-    
-    df = pd.DataFrame(data_list)
-    buffer = BytesIO()
-    with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
-        df.to_excel(writer, index=False, sheet_name='Tunggakan')
-    buffer.seek(0)
-    return StreamingResponse(buffer, media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", headers={"Content-Disposition": "attachment; filename=laporan_tunggakan.xlsx"})
+    bills = await fetch_arrears_bills(kelas, angkatan, min_bulan)
+    data = await run_lazy("report_render", "arrears_xlsx", bills)
+    return StreamingResponse(BytesIO(data), media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", headers={"Content-Disposition": "attachment; filename=laporan_tunggakan.xlsx"})
 
 @api_router.get("/reports/class-recap/export-pdf")
 async def export_class_recap_pdf(current_user: Annotated[dict, Depends(get_current_user)] = None):
@@ -1943,49 +2982,9 @@ async def export_class_recap_pdf(current_user: Annotated[dict, Depends(get_curre
         raise HTTPException(status_code=403, detail="Not authorized")
         
     recap = await get_class_recap_report(current_user)
-    
-    buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=A4)
-    elements = []
-    styles = getSampleStyleSheet()
-    
-    title_style = ParagraphStyle('Title', parent=styles['Heading1'], fontSize=16, alignment=TA_CENTER, spaceAfter=20)
-    
-    # --- Header ---
     school = await db.school_profile.find_one({"id": "main_profile"}, {"_id": 0})
-    if not school: school = {"nama_sekolah": "SMK MEKAR MURNI", "alamat": "Jl. Pendidikan No. 123", "no_telp": "-"}
-    h_style = ParagraphStyle('RepHeader', fontSize=14, fontName='Helvetica-Bold', alignment=TA_CENTER)
-    a_style = ParagraphStyle('RepAddr', fontSize=10, fontName='Helvetica', alignment=TA_CENTER)
-    
-    elements.append(Paragraph(school['nama_sekolah'].upper(), h_style))
-    elements.append(Paragraph(school['alamat'], a_style))
-    elements.append(Spacer(1, 0.1*inch))
-    elements.append(Paragraph("-" * 95, a_style))
-    elements.append(Spacer(1, 0.2*inch))
-    
-    elements.append(Paragraph(f"REKAP PEMBAYARAN PER KELAS", title_style))
-    
-    data = [['Kelas', 'Siswa', 'Total Tagihan', 'Lunas', 'Tunggakan']]
-    for c in recap:
-        data.append([
-            c['nama_kelas'],
-            str(c['jumlah_siswa']),
-            f"Rp {c['total_tagihan']:,.0f}",
-            f"Rp {c['pembayaran_lunas']:,.0f}",
-            f"Rp {c['total_tunggakan']:,.0f}"
-        ])
-    
-    t = Table(data, colWidths=[1.5*inch, 0.8*inch, 1.5*inch, 1.2*inch, 1.5*inch])
-    t.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#1e3a8a')),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('GRID', (0, 0), (-1, -1), 1, colors.black)
-    ]))
-    elements.append(t)
-    
-    doc.build(elements)
-    buffer.seek(0)
-    return StreamingResponse(buffer, media_type="application/pdf", headers={"Content-Disposition": "attachment; filename=recap_per_kelas.pdf"})
+    pdf = await run_lazy("report_render", "class_recap_pdf", recap, school)
+    return StreamingResponse(BytesIO(pdf), media_type="application/pdf", headers={"Content-Disposition": "attachment; filename=recap_per_kelas.pdf"})
 
 @api_router.get("/reports/class-recap/export-xlsx")
 async def export_class_recap_xlsx(current_user: Annotated[dict, Depends(get_current_user)] = None):
@@ -1993,23 +2992,235 @@ async def export_class_recap_xlsx(current_user: Annotated[dict, Depends(get_curr
         raise HTTPException(status_code=403, detail="Not authorized")
         
     recap = await get_class_recap_report(current_user)
-    
-    data_list = []
-    for c in recap:
-        data_list.append({
-            'Nama Kelas': c['nama_kelas'],
-            'Jumlah Siswa': c['jumlah_siswa'],
-            'Total Tagihan': c['total_tagihan'],
-            'Lunas': c['pembayaran_lunas'],
-            'Tunggakan': c['total_tunggakan']
-        })
-    
-    df = pd.DataFrame(data_list)
-    buffer = BytesIO()
-    with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
-        df.to_excel(writer, index=False, sheet_name='Rekap Kelas')
-    buffer.seek(0)
-    return StreamingResponse(buffer, media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", headers={"Content-Disposition": "attachment; filename=recap_per_kelas.xlsx"})
+    data = await run_lazy("report_render", "class_recap_xlsx", recap)
+    return StreamingResponse(BytesIO(data), media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", headers={"Content-Disposition": "attachment; filename=recap_per_kelas.xlsx"})
+
+# Antrian export (koleksi export_jobs). Export besar tidak lagi ditahan di request:
+# klien mengirim job, worker di proses ini merender file ke backend/exports, progres
+# dikirim lewat /api/ws, lalu file diunduh lewat /exports/{id}/download sampai kedaluwarsa.
+# Status job disimpan di Mongo; job 'running' yang heartbeat-nya basi (server mati/restart)
+# diantrikan ulang sampai EXPORT_MAX_ATTEMPTS, setelah itu ditandai gagal.
+EXPORT_JOB_KINDS = {
+    "monthly-pdf": export_pdf,
+    "monthly-xlsx": export_xlsx,
+    "student-pdf": export_student_pdf,
+    "student-xlsx": export_student_xlsx,
+    "batch-pdf": export_batch_pdf,
+    "batch-xlsx": export_batch_xlsx,
+    "arrears-pdf": export_arrears_pdf,
+    "arrears-xlsx": export_arrears_xlsx,
+    "class-recap-pdf": export_class_recap_pdf,
+    "class-recap-xlsx": export_class_recap_xlsx,
+}
+
+def export_params_model(kind: str, export_fn) -> type:
+    """Model parameter job export dari signature endpoint-nya (tanpa current_user).
+
+    Memberi koersi & validasi yang sama dengan query param FastAPI ("2025" -> 2025,
+    objek seperti {"$ne": null} ditolak), parameter yang tidak dikenal juga ditolak.
+    """
+    fields = {name: (param.annotation, ... if param.default is inspect.Parameter.empty else param.default)
+              for name, param in inspect.signature(export_fn).parameters.items() if name != "current_user"}
+    return create_model(f"ExportParams_{kind.replace('-', '_')}", __config__=ConfigDict(extra="forbid", coerce_numbers_to_str=True), **fields)
+
+EXPORT_JOB_PARAMS = {kind: export_params_model(kind, fn) for kind, fn in EXPORT_JOB_KINDS.items()}
+
+EXPORT_WORKERS = int(os.environ.get("EXPORT_WORKERS", "2"))
+EXPORT_TTL = int(os.environ.get("EXPORT_TTL", str(24 * 3600)))
+EXPORT_MAX_ATTEMPTS = int(os.environ.get("EXPORT_MAX_ATTEMPTS", "2"))
+EXPORT_STALE_AFTER = int(os.environ.get("EXPORT_STALE_AFTER", "120"))
+# Selama render berjalan heartbeat diperbarui berkala, jauh di bawah EXPORT_STALE_AFTER,
+# supaya render yang lama (PDF/XLSX besar) tidak dianggap yatim dan dirender ulang worker lain
+EXPORT_HEARTBEAT_INTERVAL = max(EXPORT_STALE_AFTER / 4, 1)
+EXPORT_EXTENSIONS = {"pdf": ".pdf", "xlsx": ".xlsx"}
+EXPORT_SWEEP_INTERVAL = 60
+exports_dir = ROOT_DIR / 'exports'
+export_queue: Optional[asyncio.Queue] = None
+export_tasks: list = []
+
+class ExportJobCreate(BaseModel):
+    kind: str
+    params: dict = {}
+
+def export_job_view(job: dict) -> dict:
+    view = {k: job.get(k) for k in ("id", "kind", "params", "status", "progress", "stage", "error", "filename", "size", "created_at", "finished_at", "expires_at")}
+    view["download_url"] = f"/api/exports/{job['id']}/download" if job.get("status") == "done" else None
+    return view
+
+async def publish_export_job(job: dict):
+    await manager.send_to_user(job["user_id"], {"type": "export_job", "job": json.loads(json.dumps(export_job_view(job), default=json_default))})
+
+async def update_export_job(job_id: str, fields: dict) -> Optional[dict]:
+    fields = {**fields, "heartbeat_at": datetime.now(timezone.utc)}
+    job = await db.export_jobs.find_one_and_update({"id": job_id}, {"$set": fields}, projection={"_id": 0}, return_document=ReturnDocument.AFTER)
+    if job:
+        await publish_export_job(job)
+    return job
+
+async def export_heartbeat(job_id: str):
+    while True:
+        await asyncio.sleep(EXPORT_HEARTBEAT_INTERVAL)
+        await db.export_jobs.update_one({"id": job_id, "status": "running"}, {"$set": {"heartbeat_at": datetime.now(timezone.utc)}})
+
+def write_export_artifact(path: Path, data: bytes):
+    fd, tmp = tempfile.mkstemp(dir=exports_dir, suffix=".part")
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+async def run_export_job(job: dict):
+    job_id = job["id"]
+    await update_export_job(job_id, {"stage": "rendering", "progress": 10})
+    heartbeat = asyncio.create_task(export_heartbeat(job_id))
+    try:
+        # current_user dari saat submit: cek role di fungsi export tetap berlaku
+        response = await EXPORT_JOB_KINDS[job["kind"]](**job["params"], current_user=job["owner"])
+        chunks = [chunk async for chunk in response.body_iterator]
+        await update_export_job(job_id, {"stage": "writing", "progress": 80})
+        match = re.search(r'filename="?([^";]+)"?', response.headers.get("content-disposition", ""))
+        filename = match.group(1) if match else f"export{EXPORT_EXTENSIONS[job['kind'].rsplit('-', 1)[-1]]}"
+        path = exports_dir / f"{job_id}{Path(filename).suffix}"
+        data = b"".join(chunks)
+        await asyncio.to_thread(write_export_artifact, path, data)
+    except HTTPException as e:
+        await update_export_job(job_id, {"status": "failed", "stage": "failed", "error": str(e.detail), "finished_at": datetime.now(timezone.utc)})
+        return
+    except Exception as e:
+        logging.exception(f"[EXPORT] Job {job_id} gagal")
+        await update_export_job(job_id, {"status": "failed", "stage": "failed", "error": str(e) or type(e).__name__, "finished_at": datetime.now(timezone.utc)})
+        return
+    finally:
+        heartbeat.cancel()
+    now = datetime.now(timezone.utc)
+    await update_export_job(job_id, {"status": "done", "stage": "done", "progress": 100, "artifact": str(path), "filename": filename,
+                                     "media_type": response.media_type, "size": len(data), "finished_at": now,
+                                     "expires_at": now + timedelta(seconds=EXPORT_TTL)})
+
+async def export_worker():
+    while True:
+        job_id = await export_queue.get()
+        try:
+            # Klaim atomik: job yang sama bisa masuk antrian beberapa proses (recovery)
+            job = await db.export_jobs.find_one_and_update(
+                {"id": job_id, "status": "queued"},
+                {"$set": {"status": "running", "stage": "running", "progress": 5, "started_at": datetime.now(timezone.utc), "heartbeat_at": datetime.now(timezone.utc)},
+                 "$inc": {"attempts": 1}},
+                projection={"_id": 0}, return_document=ReturnDocument.AFTER)
+            if job:
+                await publish_export_job(job)
+                await run_export_job(job)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logging.exception(f"[EXPORT] Worker error pada job {job_id}")
+        finally:
+            export_queue.task_done()
+
+async def recover_export_jobs() -> dict:
+    """Antrikan ulang job yatim (running dengan heartbeat basi, queued yang belum diambil worker)."""
+    stale = datetime.now(timezone.utc) - timedelta(seconds=EXPORT_STALE_AFTER)
+    stats = {"requeued": 0, "failed": 0}
+    async for job in db.export_jobs.find({"status": "running", "heartbeat_at": {"$lt": stale}}, {"_id": 0}):
+        if job.get("attempts", 0) >= EXPORT_MAX_ATTEMPTS:
+            fields = {"status": "failed", "stage": "failed", "error": "Export terhenti karena server restart", "finished_at": datetime.now(timezone.utc)}
+            stats["failed"] += 1
+        else:
+            fields = {"status": "queued", "stage": "queued", "progress": 0}
+            stats["requeued"] += 1
+        result = await db.export_jobs.update_one({"id": job["id"], "status": "running", "heartbeat_at": job["heartbeat_at"]}, {"$set": fields})
+        if result.modified_count:
+            await publish_export_job({**job, **fields})
+    async for job in db.export_jobs.find({"status": "queued", "heartbeat_at": {"$lt": stale}}, {"_id": 0, "id": 1}).sort("created_at", 1):
+        await db.export_jobs.update_one({"id": job["id"], "status": "queued"}, {"$set": {"heartbeat_at": datetime.now(timezone.utc)}})
+        export_queue.put_nowait(job["id"])
+    return stats
+
+async def purge_expired_exports() -> int:
+    count = 0
+    async for job in db.export_jobs.find({"status": "done", "expires_at": {"$lt": datetime.now(timezone.utc)}}, {"_id": 0, "id": 1, "artifact": 1}):
+        Path(job["artifact"]).unlink(missing_ok=True)
+        await db.export_jobs.update_one({"id": job["id"]}, {"$set": {"status": "expired"}, "$unset": {"artifact": ""}})
+        count += 1
+    return count
+
+async def export_maintenance():
+    while True:
+        try:
+            recovered = await recover_export_jobs()
+            purged = await purge_expired_exports()
+            if recovered["requeued"] or recovered["failed"] or purged:
+                logging.info(f"[EXPORT] {recovered['requeued']} job diantrikan ulang, {recovered['failed']} gagal, {purged} file kedaluwarsa dihapus")
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logging.exception("[EXPORT] Maintenance gagal")
+        await asyncio.sleep(EXPORT_SWEEP_INTERVAL)
+
+async def start_export_workers():
+    global export_queue
+    exports_dir.mkdir(parents=True, exist_ok=True)
+    export_queue = asyncio.Queue()
+    export_tasks.extend(asyncio.create_task(export_worker()) for _ in range(max(EXPORT_WORKERS, 1)))
+    export_tasks.append(asyncio.create_task(export_maintenance()))
+    if EXPORT_PREWARM:
+        export_tasks.append(asyncio.create_task(prewarm_lazy_modules()))
+
+async def stop_export_workers():
+    for task in export_tasks:
+        task.cancel()
+    await asyncio.gather(*export_tasks, return_exceptions=True)
+    export_tasks.clear()
+
+async def get_export_job_for(job_id: str, current_user: dict) -> dict:
+    job = await db.export_jobs.find_one({"id": job_id}, {"_id": 0})
+    if not job or job["user_id"] != current_user.get("user_id"):
+        raise HTTPException(status_code=404, detail="Job export tidak ditemukan")
+    return job
+
+@api_router.post("/exports")
+async def submit_export_job(payload: ExportJobCreate, current_user: Annotated[dict, Depends(get_current_user)]):
+    export_fn = EXPORT_JOB_KINDS.get(payload.kind)
+    if not export_fn:
+        raise HTTPException(status_code=400, detail=f"Jenis export tidak dikenal. Pilihan: {', '.join(EXPORT_JOB_KINDS)}")
+    try:
+        params = EXPORT_JOB_PARAMS[payload.kind](**payload.params).model_dump()
+    except ValidationError as e:
+        problems = "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors())
+        raise HTTPException(status_code=400, detail=f"Parameter export tidak valid: {problems}")
+    if current_user.get("role") not in ["admin", "kepsek", "master"] and not payload.kind.startswith("student-"):
+        raise HTTPException(status_code=403, detail="Not authorized")
+
+    now = datetime.now(timezone.utc)
+    job = {
+        "id": str(uuid.uuid4()), "user_id": current_user.get("user_id"), "owner": current_user,
+        "kind": payload.kind, "params": params, "status": "queued", "stage": "queued", "progress": 0,
+        "attempts": 0, "created_at": now, "heartbeat_at": now,
+    }
+    await db.export_jobs.insert_one(job)
+    export_queue.put_nowait(job["id"])
+    await publish_export_job(job)
+    return export_job_view(job)
+
+@api_router.get("/exports")
+async def list_export_jobs(current_user: Annotated[dict, Depends(get_current_user)], limit: int = 20):
+    jobs = await db.export_jobs.find({"user_id": current_user.get("user_id")}, {"_id": 0}).sort("created_at", -1).to_list(min(max(limit, 1), 100))
+    return [export_job_view(job) for job in jobs]
+
+@api_router.get("/exports/{job_id}")
+async def get_export_job(job_id: str, current_user: Annotated[dict, Depends(get_current_user)]):
+    return export_job_view(await get_export_job_for(job_id, current_user))
+
+@api_router.get("/exports/{job_id}/download")
+async def download_export_job(job_id: str, request: Request, current_user: Annotated[dict, Depends(get_current_user)]):
+    job = await get_export_job_for(job_id, current_user)
+    if job["status"] == "expired":
+        raise HTTPException(status_code=410, detail="File export sudah kedaluwarsa, silakan export ulang")
+    if job["status"] != "done":
+        raise HTTPException(status_code=409, detail=f"Export belum selesai (status: {job['status']})")
+    path = Path(job["artifact"])
+    if not path.exists():
+        raise HTTPException(status_code=410, detail="File export sudah tidak tersedia, silakan export ulang")
+    return send_file(request.headers, path, "private, no-cache", media_type=job.get("media_type"), filename=job["filename"], method=request.method)
 
 # Student Portal Routes
 
@@ -2057,19 +3268,88 @@ async def get_student_bills(student_id: str):
 async def get_student_payments(student_id: str):
     payments = await db.payments.find({"id_siswa": student_id}, {"_id": 0}).to_list(1000)
     
-    # Enrich with bill data
-    for payment in payments:
-        bill = await db.bills.find_one({"id": payment["id_tagihan"]}, {"_id": 0})
-        if bill:
-            payment["tagihan"] = {"bulan": bill["bulan"], "tahun": bill["tahun"]}
-    
-    return payments
+    # Data tagihan dari snapshot; pembayaran lama dilengkapi dengan satu query
+    return await enrich_payments(payments)
+
+def student_overview_pipeline(student_id: str) -> list:
+    """Satu aggregation untuk portal siswa: profil, tagihan, pembayaran, rekening sekolah, ringkasan akun."""
+    def lookup(collection: str, as_field: str, local: str = "id", foreign: str = "id_siswa"):
+        return {"$lookup": {"from": collection, "localField": local, "foreignField": foreign, "as": as_field}}
+
+    return [
+        {"$match": {"id": student_id}},
+        {"$facet": {
+            "profile": [{"$project": {"_id": 0, "password": 0}}],
+            "bills": [
+                lookup("bills", "b"),
+                {"$unwind": "$b"},
+                {"$replaceRoot": {"newRoot": "$b"}},
+                {"$project": {"_id": 0}},
+            ],
+            "payments": [
+                lookup("payments", "p"),
+                {"$unwind": "$p"},
+                {"$replaceRoot": {"newRoot": "$p"}},
+                # Pembayaran lama tanpa snapshot tagihan: ambil dari koleksi bills
+                lookup("bills", "_t", local="id_tagihan", foreign="id"),
+                {"$set": {"tagihan": {"$ifNull": ["$tagihan", {"$cond": [
+                    {"$gt": [{"$size": "$_t"}, 0]},
+                    {"bulan": {"$arrayElemAt": ["$_t.bulan", 0]}, "tahun": {"$arrayElemAt": ["$_t.tahun", 0]}},
+                    "$$REMOVE",
+                ]}]}}},
+                {"$project": {"_id": 0, "_t": 0}},
+            ],
+            "bank": [
+                {"$lookup": {"from": "school_profile", "pipeline": [
+                    {"$match": {"id": "main_profile"}},
+                    {"$project": {"_id": 0, "nama_sekolah": 1, "bank_nama": 1, "bank_rekening": 1, "bank_atas_nama": 1}},
+                ], "as": "s"}},
+                {"$unwind": "$s"},
+                {"$replaceRoot": {"newRoot": "$s"}},
+            ],
+            "account": [
+                lookup("student_accounts", "a"),
+                {"$unwind": "$a"},
+                {"$replaceRoot": {"newRoot": "$a"}},
+                {"$project": {"_id": 0}},
+            ],
+        }},
+    ]
+
+@api_router.get("/student/{student_id}/overview")
+async def get_student_overview(student_id: str, current_user: Annotated[dict, Depends(get_current_user)]):
+    role = current_user.get("role")
+    if role not in ["admin", "kepsek", "master"] and not (role == "siswa" and current_user.get("user_id") == student_id):
+        raise HTTPException(status_code=403, detail="Not authorized")
+
+    key = ("student_overview", student_id)
+    if overview_cache.max_entries > 0:
+        # Versi dibaca sebelum query, sama seperti cached_response
+        version = await get_data_version("student_overview", f"student_overview:{student_id}")
+        cached = overview_cache.get(key, version)
+        if cached is not None:
+            return cached
+
+    result = (await db.students.aggregate(student_overview_pipeline(student_id)).to_list(1))[0]
+    if not result["profile"]:
+        raise HTTPException(status_code=404, detail="Siswa tidak ditemukan")
+
+    overview = {
+        "profile": result["profile"][0],
+        "bills": result["bills"],
+        "payments": result["payments"],
+        "bank": result["bank"][0] if result["bank"] else None,
+        "summary": account_summary(result["account"][0] if result["account"] else None),
+    }
+    if overview_cache.max_entries > 0:
+        overview_cache.put(key, version, overview)
+    return overview
 
 # Mount static files for uploads
 uploads_dir = ROOT_DIR / 'uploads'
 profiles_dir = uploads_dir / 'profiles'
 profiles_dir.mkdir(parents=True, exist_ok=True)
-app.mount("/uploads", StaticFiles(directory=str(uploads_dir)), name="uploads")
+app.mount("/uploads", UploadStaticFiles(directory=str(uploads_dir)), name="uploads")
 
 @api_router.get("/profile/me")
 async def get_my_profile(current_user: Annotated[dict, Depends(get_current_user)]):
@@ -2086,34 +3366,27 @@ async def get_my_profile(current_user: Annotated[dict, Depends(get_current_user)
     return profile
 
 @api_router.post("/profile/upload-photo")
-async def upload_profile_photo(file: UploadFile = File(...), current_user: Annotated[dict, Depends(get_current_user)] = None):
+async def upload_profile_photo(background_tasks: BackgroundTasks, file: UploadFile = File(...), current_user: Annotated[dict, Depends(get_current_user)] = None):
     if not current_user:
         raise HTTPException(status_code=401, detail="Unauthorized")
         
-    allowed_types = ["image/jpeg", "image/png", "image/jpg"]
-    if file.content_type not in allowed_types:
-        raise HTTPException(status_code=400, detail="Only JPG and PNG are allowed")
-        
-    ext = mimetypes.guess_extension(file.content_type) or ".jpg"
-    filename = f"profile_{current_user['user_id']}{ext}"
-    file_path = profiles_dir / filename
-    
-    # Save the file
-    with open(file_path, 'wb') as f:
-        content = await file.read()
-        f.write(content)
-        
-    photo_url = f"/uploads/profiles/{filename}"
-    
-    # Update DB
-    if current_user['role'] == "siswa":
-        await db.students.update_one({"id": current_user['user_id']}, {"$set": {"profile_pic": photo_url}})
-    else:
-        await db.users.update_one({"id": current_user['user_id']}, {"$set": {"profile_pic": photo_url}})
+    # Save the file (JPG/PNG dicek dari magic bytes; nama file = hash isi)
+    stored = await store_upload(file, profiles_dir, (".jpg", ".png"))
+    photo_url = f"/uploads/profiles/{stored['path'].name}"
+    
+    # Update DB (varian thumb/medium dibuat di background)
+    collection = "students" if current_user['role'] == "siswa" else "users"
+    await db[collection].update_one({"id": current_user['user_id']}, {"$set": {"profile_pic": photo_url}, "$unset": {"profile_pic_variants": ""}})
+    if collection == "students":
+        await invalidate_student_overview(current_user['user_id'])
+    background_tasks.add_task(process_image_variants, stored["path"], collection, current_user['user_id'],
+                              "profile_pic_variants", "/uploads/profiles/{name}")
     
     await log_activity(current_user['username'], current_user['role'], "profile", "Mengunggah foto profil")
         
-    return {"message": "Photo updated", "url": photo_url}
+    variants = {variant: {fmt: f"/uploads/profiles/{variant_path(stored['path'], variant, fmt).name}" for fmt in IMAGE_VARIANT_FORMATS}
+                for variant in IMAGE_VARIANTS}
+    return {"message": "Photo updated", "url": photo_url, "variants": variants}
 
 @api_router.put("/profile/change-password")
 async def change_my_password(request: ChangePasswordRequest, current_user: Annotated[dict, Depends(get_current_user)]):
@@ -2140,9 +3413,129 @@ async def change_my_password(request: ChangePasswordRequest, current_user: Annot
     
     return {"message": "Password berhasil diubah"}
 
+# Rate limit token bucket per klien: user_id dari JWT jika token valid (banyak siswa bisa
+# berbagi satu IP sekolah/NAT), selain itu IP. Tiap request mengambil token sesuai bobot
+# rutenya; export PDF/XLSX jauh lebih mahal dari request biasa sehingga satu klien tidak
+# bisa memenuhi worker dengan render. Bucket terisi RATE_LIMIT_REFILL token/detik sampai
+# RATE_LIMIT_CAPACITY. Backend "memory" per proses; "mongo" dibagi semua worker/server.
+RATE_LIMIT_ENABLED = os.environ.get("RATE_LIMIT_ENABLED", "1").lower() in ("1", "true", "yes")
+RATE_LIMIT_BACKEND = os.environ.get("RATE_LIMIT_BACKEND", "memory")
+RATE_LIMIT_CAPACITY = float(os.environ.get("RATE_LIMIT_CAPACITY", "120"))
+RATE_LIMIT_REFILL = float(os.environ.get("RATE_LIMIT_REFILL", "10"))
+RATE_LIMIT_MAX_KEYS = int(os.environ.get("RATE_LIMIT_MAX_KEYS", "10000"))
+RATE_LIMIT_DEFAULT_COST = 1
+RATE_LIMIT_COSTS = [
+    ("GET", re.compile(r"^/api/reports/export-(pdf|xlsx)$"), 30),
+    ("GET", re.compile(r"^/api/reports/(student|class|batch)/[^/]+/export-(pdf|xlsx)$"), 30),
+    ("GET", re.compile(r"^/api/reports/(arrears|class-recap)/export-(pdf|xlsx)$"), 30),
+    ("POST", re.compile(r"^/api/exports$"), 30),
+    # Upload file besar: parse + hash bcrypt / pencocokan mutasi, sama mahalnya dengan export
+    ("POST", re.compile(r"^/api/students/import$"), 30),
+    ("POST", re.compile(r"^/api/payments/reconcile$"), 30),
+    ("GET", re.compile(r"^/api/reports/analytics$"), 10),
+    ("GET", re.compile(r"^/api/receipt/bill/[^/]+$"), 5),
+    ("POST", re.compile(r"^/api/auth/login$"), 2),
+]
+
+def rate_limit_cost(method: str, path: str) -> float:
+    for rule_method, pattern, cost in RATE_LIMIT_COSTS:
+        if method == rule_method and pattern.match(path):
+            # Bobot di atas kapasitas tidak akan pernah lolos
+            return min(cost, RATE_LIMIT_CAPACITY)
+    return RATE_LIMIT_DEFAULT_COST
+
+def rate_limit_key(scope) -> str:
+    authorization = Headers(scope=scope).get("authorization", "")
+    if authorization.lower().startswith("bearer "):
+        try:
+            payload = jwt.decode(authorization[7:], SECRET_KEY, algorithms=[ALGORITHM])
+            subject = payload.get("sub") or payload.get("user_id")
+            if subject:
+                return f"user:{subject}"
+        except JWTError:
+            pass
+    client_addr = scope.get("client")
+    return f"ip:{client_addr[0] if client_addr else 'unknown'}"
+
+class MemoryTokenBuckets:
+    """Bucket per key di memori proses; key yang paling lama tidak dipakai dibuang (bucket-nya sudah penuh lagi)."""
+
+    def __init__(self, capacity: float, refill: float, max_keys: int):
+        self.capacity, self.refill, self.max_keys = capacity, refill, max_keys
+        self.buckets: OrderedDict = OrderedDict()
+
+    async def take(self, key: str, cost: float) -> float:
+        """Ambil token; 0 jika diizinkan, selain itu detik sampai token cukup."""
+        now = time.monotonic()
+        tokens, updated = self.buckets.pop(key, (self.capacity, now))
+        tokens = min(self.capacity, tokens + (now - updated) * self.refill)
+        wait = 0.0
+        if tokens >= cost:
+            tokens -= cost
+        else:
+            wait = (cost - tokens) / self.refill
+        self.buckets[key] = (tokens, now)
+        if len(self.buckets) > self.max_keys:
+            self.buckets.popitem(last=False)
+        return wait
+
+class MongoTokenBuckets:
+    """Bucket di koleksi rate_limits, diperbarui atomik dengan satu update pipeline (MongoDB 4.2+)."""
+
+    def __init__(self, capacity: float, refill: float):
+        self.capacity, self.refill = capacity, refill
+
+    async def take(self, key: str, cost: float) -> float:
+        now = datetime.now(timezone.utc)
+        # Bucket yang diam selama waktu isi penuh sama dengan bucket baru, jadi boleh dihapus TTL
+        expires_at = now + timedelta(seconds=self.capacity / self.refill)
+        elapsed = {"$divide": [{"$subtract": [now, {"$ifNull": ["$updated_at", now]}]}, 1000]}
+        refilled = {"$min": [self.capacity, {"$add": [{"$ifNull": ["$tokens", self.capacity]},
+                                                      {"$multiply": [elapsed, self.refill]}]}]}
+        doc = await db.rate_limits.find_one_and_update(
+            {"_id": key},
+            [
+                {"$set": {"tokens": refilled, "updated_at": now, "expires_at": expires_at}},
+                {"$set": {"allowed": {"$gte": ["$tokens", cost]}}},
+                {"$set": {"tokens": {"$cond": ["$allowed", {"$subtract": ["$tokens", cost]}, "$tokens"]}}},
+            ],
+            upsert=True, return_document=ReturnDocument.AFTER)
+        return 0.0 if doc["allowed"] else (cost - doc["tokens"]) / self.refill
+
+def make_rate_limit_store():
+    if RATE_LIMIT_BACKEND == "mongo":
+        return MongoTokenBuckets(RATE_LIMIT_CAPACITY, RATE_LIMIT_REFILL)
+    return MemoryTokenBuckets(RATE_LIMIT_CAPACITY, RATE_LIMIT_REFILL, RATE_LIMIT_MAX_KEYS)
+
+rate_limit_store = make_rate_limit_store()
+
+class RateLimitMiddleware:
+    """Middleware ASGI: 429 + Retry-After jika bucket klien tidak cukup untuk bobot rute."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if not RATE_LIMIT_ENABLED or scope["type"] != "http" or not scope["path"].startswith("/api/"):
+            return await self.app(scope, receive, send)
+        try:
+            wait = await rate_limit_store.take(rate_limit_key(scope), rate_limit_cost(scope["method"], scope["path"]))
+        except Exception as e:
+            # Backend bersama bermasalah: lebih baik tanpa limit daripada menolak semua request
+            logging.warning(f"[RATE LIMIT] Backend gagal, request diteruskan: {e}")
+            wait = 0.0
+        if wait > 0:
+            retry_after = max(math.ceil(wait), 1)
+            response = JSONResponse(status_code=429, headers={"Retry-After": str(retry_after)},
+                                    content={"detail": f"Terlalu banyak permintaan, coba lagi dalam {retry_after} detik"})
+            return await response(scope, receive, send)
+        await self.app(scope, receive, send)
+
 # Include the router in the main app
 app.include_router(api_router)
 
+# Middleware terakhir ditambahkan = terluar: CORS tetap membungkus respons 429
+app.add_middleware(RateLimitMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -2162,7 +3555,25 @@ logger = logging.getLogger(__name__)
 async def startup_event():
     await init_db()
     logger.info("Database initialized")
+    await start_export_workers()
+    legacy = await db.payments.find_one({"tanggal_bayar": {"$type": "string"}}, {"_id": 1})
+    if legacy:
+        logger.warning("Masih ada tanggal berformat string ISO. Jalankan: python migrate_dates.py")
+
+def flush_logs():
+    """Kosongkan buffer stdout/stderr dan handler logging (stdout ke pipe di-buffer per blok)."""
+    for handler in logging.getLogger().handlers:
+        handler.flush()
+    sys.stdout.flush()
+    sys.stderr.flush()
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await manager.close_all()
+    await stop_export_workers()
     client.close()
+    report_client.close()
+    if hash_pool is not None:
+        hash_pool.shutdown(wait=False, cancel_futures=True)
+    logger.info("Worker %s berhenti", os.getpid())
+    flush_logs()
@@ -65,8 +65,10 @@ const Layout = ({ children }) => {
     navigate('/');
   };
 
-  const profileImageUrl = profile?.profile_pic
-    ? (profile.profile_pic.startsWith('http') ? profile.profile_pic : `${process.env.REACT_APP_BACKEND_URL}${profile.profile_pic}`)
+  // Varian kecil (WebP) dibuat server di background; selama belum ada pakai file asli
+  const profilePic = profile?.profile_pic_variants?.thumb?.webp || profile?.profile_pic;
+  const profileImageUrl = profilePic
+    ? (profilePic.startsWith('http') ? profilePic : `${process.env.REACT_APP_BACKEND_URL}${profilePic}`)
     : null;
 
   const logoUrl = `${process.env.REACT_APP_BACKEND_URL}/uploads/logo.png`;
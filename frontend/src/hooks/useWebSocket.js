@@ -22,6 +22,15 @@ const useWebSocket = (userId) => {
                 console.log('[WS] Connected to online status tracking');
             };
 
+            // Pesan dari server (mis. progres import siswa) diteruskan sebagai event window 'ws-message'
+            ws.current.onmessage = (event) => {
+                try {
+                    window.dispatchEvent(new CustomEvent('ws-message', { detail: JSON.parse(event.data) }));
+                } catch (err) {
+                    console.error('[WS] Pesan tidak valid:', err);
+                }
+            };
+
             ws.current.onclose = () => {
                 console.log('[WS] Disconnected from online status tracking. Retrying in 5s...');
                 setTimeout(connect, 5000);
@@ -234,7 +234,11 @@ const AdminBills = () => {
                                         variant="outline"
                                         onClick={async () => {
                                           try {
-                                            const resp = await axios.get(`${API}/payments/${payment.id}/receipt/file`, {
+                                            // receipt_url (ber-?v=hash) bisa di-cache browser; data lama pakai URL biasa
+                                            const receiptUrl = payment.receipt_url
+                                              ? `${process.env.REACT_APP_BACKEND_URL}${payment.receipt_url}`
+                                              : `${API}/payments/${payment.id}/receipt/file`;
+                                            const resp = await axios.get(receiptUrl, {
                                               params: { token },
                                               responseType: 'blob'
                                             });
@@ -93,6 +93,18 @@ const AdminReports = () => {
     }
   };
 
+  // Tutup buku / bangun ulang / buka kembali laporan bulanan
+  const monthAction = async (action) => {
+    const labels = { close: 'ditutup', rebuild: 'dibangun ulang', reopen: 'dibuka kembali' };
+    try {
+      await axios.post(`${API}/reports/monthly/${action}`, { bulan: selectedMonth, tahun: selectedYear });
+      toast.success(`Buku ${selectedMonth} ${selectedYear} ${labels[action]}`);
+      fetchReport();
+    } catch (error) {
+      toast.error(error.response?.data?.detail || 'Gagal memproses tutup buku');
+    }
+  };
+
   // Helper to format currency
   const fmt = (val) => `Rp ${Number(val).toLocaleString('id-ID')}`;
 
@@ -306,7 +318,20 @@ const AdminReports = () => {
             </div>
 
             {/* Detailed Table */}
-            <div className="flex justify-end space-x-3 mb-4">
+            <div className="flex justify-end items-center space-x-3 mb-4">
+              {reportType === 'monthly' && (
+                reportData.ditutup ? (
+                  <>
+                    <span className="text-sm text-gray-600 mr-auto">
+                      Buku ditutup {new Date(reportData.ditutup_pada).toLocaleString('id-ID')}
+                    </span>
+                    <Button variant="outline" size="sm" onClick={() => monthAction('rebuild')}>Bangun Ulang</Button>
+                    <Button variant="outline" size="sm" onClick={() => monthAction('reopen')}>Buka Kembali</Button>
+                  </>
+                ) : (
+                  <Button variant="outline" size="sm" onClick={() => monthAction('close')}>Tutup Buku</Button>
+                )
+              )}
               <Button
                 variant="outline"
                 size="sm"
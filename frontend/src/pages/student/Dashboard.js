@@ -19,12 +19,9 @@ const StudentDashboard = () => {
 
   const fetchData = async () => {
     try {
-      const [billsRes, paymentsRes] = await Promise.all([
-        axios.get(`${API}/student/bills/${user.id}`),
-        axios.get(`${API}/student/payments/${user.id}`)
-      ]);
-      setBills(billsRes.data);
-      setPayments(paymentsRes.data);
+      const response = await axios.get(`${API}/student/${user.id}/overview`);
+      setBills(response.data.bills);
+      setPayments(response.data.payments);
     } catch (error) {
       console.error('Error fetching data:', error);
     } finally {
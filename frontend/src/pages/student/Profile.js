@@ -59,7 +59,7 @@ const UserProfile = () => {
           'Content-Type': 'multipart/form-data'
         }
       });
-      setProfile({ ...profile, profile_pic: response.data.url });
+      setProfile({ ...profile, profile_pic: response.data.url, profile_pic_variants: null });
       toast.success("Foto profil berhasil diperbarui");
       // Optional: window.location.reload() or shared state update if needed for Sidebar
       setTimeout(() => window.location.reload(), 1500);
@@ -107,8 +107,10 @@ const UserProfile = () => {
     );
   }
 
-  const profileImageUrl = profile?.profile_pic
-    ? (profile.profile_pic.startsWith('http') ? profile.profile_pic : `${process.env.REACT_APP_BACKEND_URL}${profile.profile_pic}`)
+  // Varian kecil (WebP) dibuat server di background; selama belum ada pakai file asli
+  const profilePic = profile?.profile_pic_variants?.medium?.webp || profile?.profile_pic;
+  const profileImageUrl = profilePic
+    ? (profilePic.startsWith('http') ? profilePic : `${process.env.REACT_APP_BACKEND_URL}${profilePic}`)
     : null;
 
   return (
@@ -0,0 +1,57 @@
+"""Baseline / regression runner for the benchmark suite.
+
+    python -m tests.benchmarks baseline --sizes 1000,10000,100000
+    python -m tests.benchmarks compare --sizes 1000,10000,100000 --fail-on mean:15%
+
+``baseline`` saves a JSON run under ``tests/benchmarks/baselines``;
+``compare`` runs the suite again, compares it against the most recent saved
+run and exits non-zero when a benchmark regresses past ``--fail-on``.
+"""
+import argparse
+import sys
+from pathlib import Path
+
+import pytest
+
+HERE = Path(__file__).resolve().parent
+STORAGE = HERE / "baselines"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m tests.benchmarks")
+    parser.add_argument("mode", choices=["baseline", "compare"])
+    parser.add_argument("--sizes", default="1000", help="Jumlah siswa, dipisah koma (mis. 1000,10000,100000)")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--name", default="baseline", help="Nama run yang disimpan (mode baseline)")
+    parser.add_argument("--against", default=None, help="Nomor/nama run pembanding (default: run terakhir)")
+    parser.add_argument("--fail-on", action="append", default=None,
+                        help="Ambang regresi pytest-benchmark, mis. mean:15%% atau max:0.5 (bisa berulang)")
+    parser.add_argument("-k", dest="keyword", default=None, help="Filter benchmark (pytest -k)")
+    args = parser.parse_args(argv)
+
+    STORAGE.mkdir(exist_ok=True)
+    pytest_args = [
+        str(HERE),
+        "-q",
+        "--benchmark-only",
+        f"--benchmark-storage=file://{STORAGE}",
+        "--benchmark-columns=min,mean,median,max,stddev,rounds",
+        "--benchmark-sort=name",
+        f"--bench-sizes={args.sizes}",
+        f"--bench-rounds={args.rounds}",
+    ]
+    if args.keyword:
+        pytest_args += ["-k", args.keyword]
+
+    if args.mode == "baseline":
+        pytest_args.append(f"--benchmark-save={args.name}")
+    else:
+        pytest_args.append(f"--benchmark-compare={args.against}" if args.against else "--benchmark-compare")
+        for threshold in args.fail_on or ["mean:15%"]:
+            pytest_args.append(f"--benchmark-compare-fail={threshold}")
+
+    return pytest.main(pytest_args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,113 @@
+"""Fixtures for the report benchmark suite.
+
+The suite talks to a real local mongod (``BENCH_MONGO_URL``, default
+``mongodb://localhost:27017``) and seeds one database per dataset size, e.g.
+``spp_bench_1000``. Seeded databases are reused between runs as long as the
+seed parameters did not change, so only the first run pays for seeding.
+"""
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+from .dataset import SEED_VERSION, seed
+
+BACKEND_DIR = Path(__file__).resolve().parents[2] / "backend"
+BENCH_MONGO_URL = os.environ.get("BENCH_MONGO_URL", "mongodb://localhost:27017")
+# Laporan lewat client terpisah (read preference/pool dari env REPORT_*), mis. ke replica set lokal
+BENCH_REPORT_MONGO_URL = os.environ.get("BENCH_REPORT_MONGO_URL", BENCH_MONGO_URL)
+
+# server.py reads these at import time
+os.environ.setdefault("MONGO_URL", BENCH_MONGO_URL)
+os.environ.setdefault("DB_NAME", "spp_bench")
+if str(BACKEND_DIR) not in sys.path:
+    sys.path.insert(0, str(BACKEND_DIR))
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("spp-bench")
+    group.addoption("--bench-sizes", default=os.environ.get("BENCH_SIZES", "1000"),
+                    help="Comma separated student counts to benchmark, e.g. 1000,10000,100000")
+    group.addoption("--bench-rounds", type=int, default=int(os.environ.get("BENCH_ROUNDS", "5")),
+                    help="Rounds per benchmark (each round is one full endpoint call)")
+    group.addoption("--bench-reseed", action="store_true", default=False,
+                    help="Drop and reseed the benchmark databases")
+
+
+def pytest_generate_tests(metafunc):
+    if "dataset_size" in metafunc.fixturenames:
+        sizes = [int(s) for s in metafunc.config.getoption("--bench-sizes").split(",") if s.strip()]
+        metafunc.parametrize("dataset_size", sizes, ids=[f"{s}siswa" for s in sizes], scope="session")
+
+
+@pytest.fixture(scope="session")
+def event_loop_runner():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield loop.run_until_complete
+    loop.close()
+
+
+@pytest.fixture(scope="session")
+def bench_db(dataset_size, event_loop_runner, request):
+    """Seeded benchmark database for ``dataset_size`` students, wired into ``server.db``."""
+    pymongo = pytest.importorskip("pymongo")
+    from pymongo.errors import PyMongoError
+
+    sync_client = pymongo.MongoClient(BENCH_MONGO_URL, serverSelectionTimeoutMS=2000)
+    try:
+        sync_client.admin.command("ping")
+    except PyMongoError as exc:
+        pytest.skip(f"mongod tidak tersedia di {BENCH_MONGO_URL}: {exc}")
+
+    db_name = f"spp_bench_{dataset_size}"
+    sync_db = sync_client[db_name]
+    meta = sync_db.bench_meta.find_one({"_id": "seed"})
+    expected = {"students": dataset_size, "version": SEED_VERSION}
+    if request.config.getoption("--bench-reseed") or not meta or meta.get("params") != expected:
+        sync_client.drop_database(db_name)
+        seed(sync_db, dataset_size)
+        sync_db.bench_meta.insert_one({"_id": "seed", "params": expected})
+
+    import server
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    client = AsyncIOMotorClient(BENCH_MONGO_URL, tz_aware=True)
+    report_client = server.make_report_client(BENCH_REPORT_MONGO_URL)
+    original_db, original_report_db = server.db, server.report_db
+    server.db = client[db_name]
+    server.report_db = report_client[db_name]
+    # Same startup path as the real app, so whatever init_db sets up is benchmarked too
+    event_loop_runner(server.init_db())
+    yield server.db
+    server.db, server.report_db = original_db, original_report_db
+    client.close()
+    report_client.close()
+    sync_client.close()
+
+
+@pytest.fixture
+def run_bench(benchmark, event_loop_runner, request):
+    """Benchmark an endpoint coroutine factory: ``run_bench(lambda: get_x(...))``."""
+    rounds = request.config.getoption("--bench-rounds")
+
+    async def _call(coro):
+        response = await coro
+        # Streaming endpoints only hit the database while the body is consumed
+        body = getattr(response, "body_iterator", None)
+        if body is not None:
+            async for _ in body:
+                pass
+        return response
+
+    def _run(coro_factory, setup=None):
+        def target():
+            return event_loop_runner(_call(coro_factory()))
+
+        if setup is not None:
+            return benchmark.pedantic(target, setup=setup, rounds=rounds, iterations=1)
+        return benchmark.pedantic(target, rounds=rounds, iterations=1, warmup_rounds=1)
+
+    return _run
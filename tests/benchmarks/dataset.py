@@ -0,0 +1,27 @@
+"""Dataset used by the benchmark suite, generated with ``backend/seed_data.py``.
+
+Students are spread over classes of ``STUDENTS_PER_CLASS`` and three angkatan;
+every student gets one bill per month of ``BENCH_YEAR`` with roughly 70%
+``lunas``, 10% ``menunggu_konfirmasi`` and 20% ``belum``, plus the matching
+``Payment`` documents.
+"""
+BENCH_YEAR = 2025
+STUDENTS_PER_CLASS = 36
+SEED_VERSION = 4
+
+
+def seed(sync_db, n_students: int):
+    from seed_data import SeedConfig, seed_school
+
+    cfg = SeedConfig(
+        classes=max(1, n_students // STUDENTS_PER_CLASS),
+        angkatan=3,
+        students=n_students,
+        months=12,
+        year=BENCH_YEAR,
+        lunas_rate=0.7,
+        pending_rate=0.1,
+        batch_size=50000,
+        seed=n_students,
+    )
+    return seed_school(sync_db, cfg)
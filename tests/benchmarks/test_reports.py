@@ -0,0 +1,182 @@
+"""Benchmarks for the report, dashboard and export endpoints.
+
+Endpoints are called as plain coroutines (no HTTP layer), so the numbers are
+the cost of the queries plus the Python/ReportLab/pandas work inside them.
+"""
+import asyncio
+from datetime import date
+
+import pytest
+
+from .dataset import BENCH_YEAR
+
+pytest.importorskip("pytest_benchmark")
+
+ADMIN = {"user_id": "bench-admin", "role": "admin", "username": "admin"}
+BULAN = "Juni"
+
+
+@pytest.fixture(scope="session")
+def server_module(bench_db):
+    import server
+    return server
+
+
+@pytest.fixture(scope="session")
+def sample(bench_db, event_loop_runner):
+    """Ids used by the per-student / per-batch endpoints."""
+    student = event_loop_runner(bench_db.students.find_one({}, {"_id": 0, "id": 1, "angkatan": 1}))
+    bill = event_loop_runner(bench_db.bills.find_one({"status": "lunas"}, {"_id": 0, "id": 1}))
+    return {"student_id": student["id"], "angkatan": student["angkatan"], "bill_id": bill["id"]}
+
+
+# --- Dashboard -------------------------------------------------------------
+
+def test_dashboard_stats(run_bench, server_module):
+    # Cache respons dikosongkan tiap ronde supaya yang terukur adalah query-nya
+    run_bench(lambda: server_module.get_dashboard_stats(ADMIN), setup=server_module.response_cache.clear)
+
+
+def test_dashboard_stats_cached(run_bench, server_module):
+    # Hit cache: hanya lookup versi data (satu find ke data_versions)
+    run_bench(lambda: server_module.get_dashboard_stats(ADMIN))
+
+
+def test_arrears_detail(run_bench, server_module):
+    run_bench(lambda: server_module.get_arrears_detail(ADMIN))
+
+
+# --- Reports ---------------------------------------------------------------
+
+def test_daily_report(run_bench, server_module):
+    run_bench(lambda: server_module.get_daily_report(ADMIN))
+
+
+@pytest.mark.parametrize("breakdown", [False, True])
+def test_period_report_month(run_bench, server_module, breakdown):
+    tanggal = date(BENCH_YEAR, 6, 15)
+    run_bench(lambda: server_module.get_period_report("month", tanggal, None, None, None, True, breakdown, ADMIN))
+
+
+def test_period_report_month_summary(run_bench, server_module):
+    tanggal = date(BENCH_YEAR, 6, 15)
+    run_bench(lambda: server_module.get_period_report("month", tanggal, None, None, None, False, True, ADMIN))
+
+
+def test_annual_report(run_bench, server_module):
+    run_bench(lambda: server_module.get_annual_report(ADMIN))
+
+
+@pytest.mark.parametrize("status", [None, "lunas", "belum"])
+def test_monthly_report(run_bench, server_module, status):
+    run_bench(lambda: server_module.get_monthly_report(BULAN, BENCH_YEAR, status, ADMIN),
+              setup=server_module.response_cache.clear)
+
+
+def test_monthly_report_cached(run_bench, server_module):
+    run_bench(lambda: server_module.get_monthly_report(BULAN, BENCH_YEAR, None, ADMIN))
+
+
+def test_student_report(run_bench, server_module, sample):
+    run_bench(lambda: server_module.get_student_report(sample["student_id"], None, ADMIN))
+
+
+def test_student_overview(run_bench, server_module, sample):
+    # Cache dikosongkan tiap ronde supaya yang terukur adalah aggregation $facet-nya
+    run_bench(lambda: server_module.get_student_overview(sample["student_id"], ADMIN),
+              setup=server_module.overview_cache.clear)
+
+
+def test_arrears_report(run_bench, server_module):
+    run_bench(lambda: server_module.get_arrears_report(ADMIN))
+
+
+def test_class_recap_report(run_bench, server_module):
+    run_bench(lambda: server_module.get_class_recap_report(ADMIN), setup=server_module.response_cache.clear)
+
+
+def test_batch_report(run_bench, server_module, sample):
+    run_bench(lambda: server_module.get_batch_report(sample["angkatan"], ADMIN))
+
+
+@pytest.mark.parametrize("fmt", ["json", "xlsx"])
+def test_payment_analytics(run_bench, server_module, fmt):
+    # Cache dikosongkan tiap ronde: yang diukur proyeksi tagihan + pivot pandas
+    run_bench(lambda: server_module.get_payment_analytics(BENCH_YEAR, fmt, ADMIN),
+              setup=server_module.analytics_cache.clear)
+
+
+# --- Writes ----------------------------------------------------------------
+
+def test_generate_bills(run_bench, server_module, bench_db, event_loop_runner):
+    target = {"bulan": "Januari", "tahun": BENCH_YEAR + 1}
+
+    def reset():
+        event_loop_runner(bench_db.bills.delete_many(target))
+
+    run_bench(lambda: server_module.generate_bills(server_module.BillGenerate(**target)), setup=reset)
+    reset()
+    # reset() menghapus tagihan tanpa mengurangi student_accounts
+    event_loop_runner(server_module.rebuild_student_accounts())
+
+
+# --- Exports ---------------------------------------------------------------
+
+def test_export_monthly_pdf(run_bench, server_module):
+    run_bench(lambda: server_module.export_pdf(BULAN, BENCH_YEAR, None, ADMIN))
+
+
+def test_export_monthly_xlsx(run_bench, server_module):
+    run_bench(lambda: server_module.export_xlsx(BULAN, BENCH_YEAR, None, ADMIN))
+
+
+def test_export_student_pdf(run_bench, server_module, sample):
+    run_bench(lambda: server_module.export_student_pdf(sample["student_id"], None, ADMIN))
+
+
+def test_export_student_xlsx(run_bench, server_module, sample):
+    run_bench(lambda: server_module.export_student_xlsx(sample["student_id"], None, ADMIN))
+
+
+def test_export_batch_pdf(run_bench, server_module, sample):
+    run_bench(lambda: server_module.export_batch_pdf(sample["angkatan"], ADMIN))
+
+
+def test_export_batch_xlsx(run_bench, server_module, sample):
+    run_bench(lambda: server_module.export_batch_xlsx(sample["angkatan"], ADMIN))
+
+
+def test_export_arrears_pdf(run_bench, server_module):
+    run_bench(lambda: server_module.export_arrears_pdf(ADMIN))
+
+
+def test_export_arrears_xlsx(run_bench, server_module):
+    run_bench(lambda: server_module.export_arrears_xlsx(ADMIN))
+
+
+def test_export_class_recap_pdf(run_bench, server_module):
+    run_bench(lambda: server_module.export_class_recap_pdf(ADMIN), setup=server_module.response_cache.clear)
+
+
+def test_export_class_recap_xlsx(run_bench, server_module):
+    run_bench(lambda: server_module.export_class_recap_xlsx(ADMIN), setup=server_module.response_cache.clear)
+
+
+def test_payment_receipt_pdf(run_bench, server_module, sample):
+    run_bench(lambda: server_module.get_payment_receipt(sample["bill_id"]))
+
+
+# --- Pool isolation --------------------------------------------------------
+
+def test_oltp_lookups_during_class_recap(run_bench, server_module, sample):
+    """20 find_one OLTP (client utama) sementara 4 rekap kelas berjalan di report client."""
+    async def scenario():
+        recaps = [asyncio.ensure_future(server_module.build_class_recap()) for _ in range(4)]
+        await asyncio.sleep(0)
+        for _ in range(20):
+            await server_module.db.students.find_one({"id": sample["student_id"]}, {"_id": 0, "id": 1})
+        for task in recaps:
+            task.cancel()
+        await asyncio.gather(*recaps, return_exceptions=True)
+
+    run_bench(scenario)
@@ -0,0 +1,44 @@
+"""Startup benchmarks: how long a fresh interpreter needs to import ``server``.
+
+Every uvicorn worker pays this on boot (and again on every --reload), so it is
+measured in a subprocess. No mongod needed: importing server only creates the
+Motor clients, it does not connect.
+"""
+import subprocess
+import sys
+
+import pytest
+
+from .conftest import BACKEND_DIR
+
+pytest.importorskip("pytest_benchmark")
+
+HEAVY_MODULES = ("pandas", "numpy", "reportlab")
+
+
+def run_python(code: str) -> str:
+    # MONGO_URL / DB_NAME sudah di-set conftest dan diwarisi subprocess
+    result = subprocess.run([sys.executable, "-c", code], cwd=BACKEND_DIR,
+                            capture_output=True, text=True, check=True)
+    return result.stdout
+
+
+@pytest.fixture
+def run_startup(benchmark, request):
+    rounds = request.config.getoption("--bench-rounds")
+
+    def _run(code: str):
+        return benchmark.pedantic(run_python, args=(code,), rounds=rounds, iterations=1, warmup_rounds=1)
+
+    return _run
+
+
+def test_import_server(run_startup):
+    loaded = run_startup("import sys, server; print(','.join(m for m in %r if m in sys.modules))" % (HEAVY_MODULES,))
+    # Renderer export di-import lazy (report_render / report_analytics), bukan saat start
+    assert loaded.strip() == ""
+
+
+def test_import_server_with_export_modules(run_startup):
+    # Biaya start + prewarm (EXPORT_PREWARM=1), sama dengan yang dibayar export pertama tanpa prewarm
+    run_startup("import server, report_render, report_analytics")